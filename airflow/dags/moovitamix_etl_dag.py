@@ -3,12 +3,29 @@ from airflow.operators.python import PythonOperator
 from airflow.providers.http.sensors.http import HttpSensor
 from airflow.hooks.base import BaseHook
 from datetime import datetime, timedelta
+import glob
 import logging
+import math
 import requests
-import json
 import os
+import shutil
+import time
 from pathlib import Path
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.moovitamix_fastapi.etl.compaction import compact_month
+from src.moovitamix_fastapi.etl.db_loader import DuckDBLoader, record_runs
+from src.moovitamix_fastapi.etl.metrics import PipelineMetrics
+from src.moovitamix_fastapi.etl.parquet_writer import (
+    RAW_SCHEMAS,
+    ParquetStreamWriter,
+    raw_policy,
+)
+from src.moovitamix_fastapi.etl.retry import RetryPolicy, get_with_retries
+from src.moovitamix_fastapi.etl.validation import BatchValidator, QuarantineWriter
+
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +39,22 @@ default_args = {
     'retry_delay': timedelta(minutes=2)
 }
 
+RAW_DATA_DIR = '/opt/airflow/data/raw'
+SHARD_DATA_DIR = '/opt/airflow/data/shards'
+METRICS_DIR = '/opt/airflow/data/metrics'
+COMPACT_DATA_DIR = '/opt/airflow/data/compacted'
+DUCKDB_PATH = os.environ.get('MOOVITAMIX_DUCKDB_PATH', '/opt/airflow/data/moovitamix.duckdb')
+# Read-only copies published after each load, served by the analytics service
+SNAPSHOT_DIR = os.environ.get('MOOVITAMIX_DUCKDB_SNAPSHOT_DIR', '/opt/airflow/data/duckdb_snapshots')
+ENDPOINTS = ['tracks', 'users', 'listen_history']
+# Largest page size accepted by the API
+PAGE_SIZE = 100
+# Pages fetched by one mapped extraction task, at least
+PAGES_PER_SHARD = int(os.environ.get('MOOVITAMIX_PAGES_PER_SHARD', 20))
+# Mapped extraction tasks of one run, all endpoints together (up to one more per endpoint),
+# well below Airflow's default max_map_length of 1024
+MAX_SHARDS = int(os.environ.get('MOOVITAMIX_MAX_SHARDS', 512))
+
 def get_api_connection():
     """Get API connection details"""
     conn = BaseHook.get_connection('moovitamix_api')
@@ -43,73 +76,195 @@ def create_directory(directory_path):
         logger.error(f"Error creating directory {directory_path}: {str(e)}")
         raise
 
-def extract_data(**context):
-    """Extract data from API endpoints"""
+def plan_extraction(**context):
+    """Discover the page count of each endpoint and split it into page-range shards"""
     try:
-        # Setup directory - using absolute path
-        data_dir = os.path.join('/opt/airflow/data/raw', context['ds'])
-        create_directory(data_dir)
-        logger.info(f"Using data directory: {data_dir}")
-        
-        # Get API connection
+        shard_dir = os.path.join(SHARD_DATA_DIR, context['ds'])
+        # Drop the shards of a previous try: the page plan may have changed
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
         base_url = get_api_connection()
         logger.info(f"Using API base URL: {base_url}")
-        
-        # API endpoints
-        endpoints = ['tracks', 'users', 'listen_history']
-        
-        for endpoint in endpoints:
-            try:
-                # Make API request
-                response = requests.get(f"{base_url}/{endpoint}")
-                response.raise_for_status()
-                data = response.json()
-                
-                # Save to file
-                file_path = os.path.join(data_dir, f"{endpoint}.json")
-                logger.info(f"Saving data to: {file_path}")
-                
-                with open(file_path, 'w') as f:
-                    json.dump(data, f)
-                
-                logger.info(f"Successfully processed {endpoint} data")
-                
-                # Store metrics
-                context['task_instance'].xcom_push(
-                    key=f'{endpoint}_count',
-                    value=len(data.get('items', []))
-                )
-                
-            except Exception as e:
-                logger.error(f"Error processing {endpoint}: {str(e)}")
-                raise
-        
+
+        page_counts = {}
+        for endpoint in ENDPOINTS:
+            response = requests.get(f"{base_url}/{endpoint}", params={'page': 1, 'size': PAGE_SIZE})
+            response.raise_for_status()
+            page_counts[endpoint] = response.json().get('pages') or 0
+            logger.info(f"Found {page_counts[endpoint]} pages for {endpoint}")
+
+        # Larger shards at scale, so the mapped tasks stay within MAX_SHARDS
+        pages_per_shard = max(PAGES_PER_SHARD, math.ceil(sum(page_counts.values()) / MAX_SHARDS))
+        shards = []
+        for endpoint, pages in page_counts.items():
+            for first_page in range(1, pages + 1, pages_per_shard):
+                shards.append({
+                    'endpoint': endpoint,
+                    'first_page': first_page,
+                    'last_page': min(first_page + pages_per_shard - 1, pages),
+                })
+
+        logger.info(f"Planned {len(shards)} extraction shards of up to {pages_per_shard} pages")
+        return shards
+    except Exception as e:
+        logger.error(f"Extraction planning failed: {str(e)}")
+        raise
+
+def shard_path(ds, endpoint, first_page):
+    """Path of the shard file holding the pages starting at first_page"""
+    return os.path.join(SHARD_DATA_DIR, ds, endpoint, f"{first_page:06d}.parquet")
+
+def shard_metrics_path(ds, endpoint, first_page):
+    """Path of the extract metrics of the shard starting at first_page"""
+    return os.path.join(SHARD_DATA_DIR, ds, endpoint, f"{first_page:06d}.metrics.json")
+
+def extract_data(endpoint, first_page, last_page, **context):
+    """Extract one page range of an endpoint into a parquet shard"""
+    metrics = PipelineMetrics('extract', run_id=context['run_id'])
+    try:
+        file_path = shard_path(context['ds'], endpoint, first_page)
+        create_directory(os.path.dirname(file_path))
+        base_url = get_api_connection()
+
+        def on_retry(attempt, reason, delay):
+            metrics.inc('request_retries_total', endpoint=endpoint, reason=reason)
+
+        with metrics.run(), requests.Session() as session, \
+                ParquetStreamWriter(file_path, schema=RAW_SCHEMAS[endpoint], policy=raw_policy(endpoint)) as writer:
+            for page in range(first_page, last_page + 1):
+                # Failed pages are retried on their own instead of failing the whole shard
+                started = time.perf_counter()
+                response = get_with_retries(session.get, f"{base_url}/{endpoint}", RetryPolicy(), on_retry,
+                                            params={'page': page, 'size': PAGE_SIZE})
+                metrics.observe('request_seconds', time.perf_counter() - started, endpoint=endpoint)
+                items = response.json().get('items', [])
+                metrics.inc('pages_fetched_total', endpoint=endpoint)
+                metrics.inc('rows_extracted_total', len(items), endpoint=endpoint)
+                metrics.inc('bytes_extracted_total', len(response.content), endpoint=endpoint)
+                with metrics.timer('parquet_write_seconds_total', endpoint=endpoint):
+                    writer.write(items)
+
+        logger.info(f"Extracted pages {first_page}-{last_page} of {endpoint}: {writer.rows_written} records")
+        return writer.rows_written
+    except Exception as e:
+        logger.error(f"Error extracting pages {first_page}-{last_page} of {endpoint}: {str(e)}")
+        raise
+    finally:
+        # Merged into the run's extract metrics by merge_shards; a retried shard overwrites its own
+        metrics.save_json(shard_metrics_path(context['ds'], endpoint, first_page))
+
+def merge_shards(**context):
+    """Merge the shards of each endpoint into one parquet file, in page order"""
+    metrics = PipelineMetrics('extract', run_id=context['run_id'])
+    try:
+        with metrics.run():
+            data_dir = os.path.join(RAW_DATA_DIR, context['ds'])
+            create_directory(data_dir)
+            shard_dir = os.path.join(SHARD_DATA_DIR, context['ds'])
+            track_ids = None
+
+            for endpoint in ENDPOINTS:
+                shard_paths = sorted(glob.glob(os.path.join(shard_dir, endpoint, '*.parquet')))
+                for path in sorted(glob.glob(os.path.join(shard_dir, endpoint, '*.metrics.json'))):
+                    metrics.merge(PipelineMetrics.load_json(path))
+                file_path = os.path.join(data_dir, f"{endpoint}.parquet")
+                tmp_path = f"{file_path}.tmp"
+                # Validated here, where the whole endpoint is seen: keys are unique across shards
+                # and listened items are checked against the tracks merged first
+                validator = BatchValidator(endpoint, RAW_SCHEMAS[endpoint],
+                                           track_ids if endpoint == 'listen_history' else None)
+                quarantine = QuarantineWriter(validator, os.path.join(data_dir, 'quarantine', f"{endpoint}.parquet"))
+
+                # Shards are small: regroup their batches into full row groups
+                rows, pending = 0, []
+                policy = raw_policy(endpoint)
+                with pq.ParquetWriter(tmp_path, RAW_SCHEMAS[endpoint], **policy.writer_options(RAW_SCHEMAS[endpoint])) as writer:
+                    for path in shard_paths:
+                        shard = pq.read_table(path, schema=RAW_SCHEMAS[endpoint])
+                        with metrics.timer('validation_seconds_total', endpoint=endpoint):
+                            shard = quarantine.validate(shard)
+                        pending.extend(shard.to_batches())
+                        if sum(batch.num_rows for batch in pending) >= policy.row_group_size:
+                            table = pa.Table.from_batches(pending, schema=RAW_SCHEMAS[endpoint])
+                            writer.write_table(table, row_group_size=policy.row_group_size)
+                            rows += table.num_rows
+                            pending = []
+                    if pending:
+                        table = pa.Table.from_batches(pending, schema=RAW_SCHEMAS[endpoint])
+                        writer.write_table(table, row_group_size=policy.row_group_size)
+                        rows += table.num_rows
+                os.replace(tmp_path, file_path)
+                report = quarantine.close()
+                for reason, count in report.reasons.items():
+                    if count:
+                        metrics.inc('rows_rejected_total', count, endpoint=endpoint, reason=reason)
+                if endpoint == 'tracks':
+                    track_ids = validator.valid_keys()
+
+                logger.info(f"Merged {len(shard_paths)} shards of {endpoint} into {file_path}: {rows} records")
+                context['task_instance'].xcom_push(key=f'{endpoint}_count', value=rows)
+                context['task_instance'].xcom_push(key=f'{endpoint}_validation', value=report.to_dict())
+
+            shutil.rmtree(shard_dir, ignore_errors=True)
         return True
     except Exception as e:
-        logger.error(f"Data extraction failed: {str(e)}")
+        logger.error(f"Shard merge failed: {str(e)}")
         raise
+    finally:
+        # The shards' metrics and the merge's: recorded with the load run by record_runs
+        metrics.save_json(os.path.join(METRICS_DIR, 'runs', context['ds'], 'extract.json'))
+        metrics.write_prometheus(os.path.join(METRICS_DIR, 'extract.prom'))
 
 def load_data(**context):
-    """Load data into database"""
+    """Load the day's raw parquet files into DuckDB"""
+    loader = None
     try:
-        data_dir = os.path.join('/opt/airflow/data/raw', context['ds'])
-        logger.info(f"Loading data from directory: {data_dir}")
-        
+        logger.info(f"Loading data for {context['ds']} from {RAW_DATA_DIR} into {DUCKDB_PATH}")
+
         # Verify files exist
-        for endpoint in ['tracks', 'users', 'listen_history']:
-            file_path = os.path.join(data_dir, f"{endpoint}.json")
+        for endpoint in ENDPOINTS:
+            file_path = os.path.join(RAW_DATA_DIR, context['ds'], f"{endpoint}.parquet")
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"Required file not found: {file_path}")
-            
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-                logger.info(f"Found {len(data.get('items', []))} records for {endpoint}")
-        
-        logger.info("Data load completed successfully")
-        return True
+
+        # DuckDB reads the parquet files itself: no row goes through Python
+        loader = DuckDBLoader(db_path=DUCKDB_PATH, raw_dir=RAW_DATA_DIR, snapshot_dir=SNAPSHOT_DIR)
+        loader.metrics.run_id = context['run_id']
+        with loader.metrics.run():
+            loaded = loader.load_daily_data(context['ds'])
+            loader.verify_data()
+
+        for name, rows in loaded.items():
+            context['task_instance'].xcom_push(key=f'{name}_loaded', value=rows)
+        context['task_instance'].xcom_push(
+            key='load_seconds',
+            value={name: round(seconds, 3) for name, seconds in loader.last_timings.items()},
+        )
+
+        logger.info(f"Data load completed successfully: {loaded}")
+        return loaded
     except Exception as e:
         logger.error(f"Data loading failed: {str(e)}")
         raise
+    finally:
+        if loader is not None:
+            # Run history in pipeline_runs, last run in the Prometheus text file
+            try:
+                record_runs(loader, METRICS_DIR, context['ds'])
+            except Exception as e:
+                logger.error(f"Error recording pipeline run: {str(e)}")
+            loader.close()
+
+def compact_raw_month(**context):
+    """Merge the daily raw files of the run's month into monthly sorted files"""
+    try:
+        month = context['ds'][:7]
+        report = compact_month(RAW_DATA_DIR, month, COMPACT_DATA_DIR)
+        logger.info(f"Compacted {month}: {report['tables']}")
+        return report
+    except Exception as e:
+        logger.error(f"Compaction failed: {str(e)}")
+        raise
 
 with DAG(
     'moovitamix_etl',
@@ -132,12 +287,22 @@ with DAG(
         mode='poke',
     )
 
-    extract = PythonOperator(
+    plan = PythonOperator(
+        task_id='plan_extraction',
+        python_callable=plan_extraction,
+    )
+
+    # One mapped task per page range: shards run in parallel on the free worker slots
+    extract = PythonOperator.partial(
         task_id='extract_data',
         python_callable=extract_data,
-        provide_context=True,
         retries=2,
         retry_delay=timedelta(minutes=2),
+    ).expand(op_kwargs=plan.output)
+
+    merge = PythonOperator(
+        task_id='merge_shards',
+        python_callable=merge_shards,
     )
 
     load = PythonOperator(
@@ -147,4 +312,20 @@ with DAG(
     )
 
     # Set up dependencies
-    check_api >> extract >> load
\ No newline at end of file
+    check_api >> plan >> extract >> merge >> load
+
+# The @monthly run of a month starts once the month is over: its daily files are complete
+with DAG(
+    'moovitamix_raw_compaction',
+    default_args=default_args,
+    description='Compact the daily raw parquet files into monthly sorted files',
+    schedule_interval='@monthly',
+    start_date=datetime(2024, 12, 1),
+    catchup=False,
+    tags=['moovitamix', 'maintenance']
+) as compaction_dag:
+
+    PythonOperator(
+        task_id='compact_raw_month',
+        python_callable=compact_raw_month,
+    )
@@ -0,0 +1,333 @@
+"""
+End-to-end ETL benchmark.
+
+For each dataset size, the FastAPI app is started locally with that many rows,
+then ``MooVitamixDataFeed.extract_all`` and ``DuckDBLoader.load_daily_data``
+are run against it. Every stage runs in a fresh process so that its peak RSS
+is its own. Wall time, rows/sec, peak RSS and bytes on disk are written as
+JSON, and two result files can be compared to spot regressions:
+
+    python -m benchmarks.etl_benchmark run --sizes 1000 100000 1000000
+    python -m benchmarks.etl_benchmark compare old.json new.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+import pyarrow.parquet as pq
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [1000, 100_000, 1_000_000]
+DEFAULT_RESULTS_DIR = os.path.join("benchmarks", "results")
+# Fixed seed and reference time: every run serves the same rows
+BENCHMARK_SEED = 42
+BENCHMARK_REFERENCE_TIME = "2024-12-12T00:00:00"
+BENCHMARK_DATE = "2024-12-12"
+ENDPOINTS = ["tracks", "users", "listen_history"]
+# A stage is reported as a regression when its rows/sec drops by more than this
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the current process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def process_peak_rss_bytes(pid: int) -> Optional[int]:
+    """Peak resident set size of another process, where /proc exposes it"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def bytes_on_disk(path: str) -> int:
+    """Total size of a file, or of every file below a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ApiServer:
+    """Run the FastAPI app with a given dataset size in a uvicorn subprocess"""
+
+    def __init__(self, size: int, port: Optional[int] = None, startup_timeout: float = 1800):
+        self.size = size
+        self.port = port or free_port()
+        self.startup_timeout = startup_timeout
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process: Optional[subprocess.Popen] = None
+        self.startup_seconds: Optional[float] = None
+
+    def __enter__(self):
+        env = dict(
+            os.environ,
+            MOOVITAMIX_DATA_SIZE=str(self.size),
+            MOOVITAMIX_SEED=str(BENCHMARK_SEED),
+            MOOVITAMIX_REFERENCE_TIME=BENCHMARK_REFERENCE_TIME,
+        )
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.moovitamix_fastapi.main:app",
+             "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            self._wait_until_ready()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        self.startup_seconds = time.perf_counter() - started
+        return self
+
+    def _wait_until_ready(self):
+        """Poll /health until the dataset is built"""
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"API server exited with code {self.process.returncode}")
+            try:
+                status = requests.get(f"{self.base_url}/health", timeout=5).json()["dataset"]
+                if status == "ready":
+                    return
+                if status == "failed":
+                    raise RuntimeError("API dataset construction failed")
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise TimeoutError(f"API server not ready after {self.startup_timeout}s")
+
+    @property
+    def peak_rss_bytes(self) -> Optional[int]:
+        return process_peak_rss_bytes(self.process.pid)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def run_extract(base_url: str, raw_dir: str, export_format: Optional[str], concurrency: int) -> Dict[str, Any]:
+    """Extract every endpoint into raw_dir/BENCHMARK_DATE (run in a fresh process)"""
+    from src.moovitamix_fastapi.etl.data_feed import MooVitamixDataFeed
+
+    data_feed = MooVitamixDataFeed(base_url=base_url, export_format=export_format, concurrency=concurrency)
+    data_feed.output_dir = os.path.join(raw_dir, BENCHMARK_DATE)
+
+    started = time.perf_counter()
+    data_feed.extract_all()
+    wall_seconds = time.perf_counter() - started
+
+    rows = sum(
+        pq.read_metadata(os.path.join(data_feed.output_dir, f"{name}.parquet")).num_rows
+        for name in ENDPOINTS
+    )
+    return {
+        "rows": rows,
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "bytes_on_disk": bytes_on_disk(data_feed.output_dir),
+    }
+
+
+def run_load(raw_dir: str, db_path: str) -> Dict[str, Any]:
+    """Load the extracted day into a fresh DuckDB database (run in a fresh process)"""
+    from src.moovitamix_fastapi.etl.db_loader import DuckDBLoader
+
+    rows = sum(
+        pq.read_metadata(os.path.join(raw_dir, BENCHMARK_DATE, f"{name}.parquet")).num_rows
+        for name in ENDPOINTS
+    )
+    loader = DuckDBLoader(db_path=db_path, raw_dir=raw_dir)
+    try:
+        started = time.perf_counter()
+        loaded = loader.load_daily_data(BENCHMARK_DATE)
+        wall_seconds = time.perf_counter() - started
+        timings = dict(loader.last_timings)
+    finally:
+        loader.close()
+
+    return {
+        "rows": rows,
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "bytes_on_disk": bytes_on_disk(db_path),
+        "loaded": loaded,
+        "table_seconds": timings,
+    }
+
+
+def in_fresh_process(function, *args) -> Dict[str, Any]:
+    """Run function in a new interpreter, so its peak RSS is measured alone"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def with_throughput(stage: Dict[str, Any]) -> Dict[str, Any]:
+    stage["rows_per_second"] = stage["rows"] / stage["wall_seconds"] if stage["wall_seconds"] else None
+    return stage
+
+
+def benchmark_size(size: int, export_format: Optional[str] = None, concurrency: int = 1) -> Dict[str, Any]:
+    """Run the extract and load stages against an API serving size rows per resource"""
+    logger.info(f"Benchmarking {size} rows")
+    with tempfile.TemporaryDirectory(prefix="moovitamix-bench-") as work_dir:
+        raw_dir = os.path.join(work_dir, "raw")
+        db_path = os.path.join(work_dir, "moovitamix.duckdb")
+
+        with ApiServer(size) as server:
+            extract = in_fresh_process(run_extract, server.base_url, raw_dir, export_format, concurrency)
+            server_peak_rss = server.peak_rss_bytes
+        load = in_fresh_process(run_load, raw_dir, db_path)
+
+    return {
+        "size": size,
+        "export_format": export_format,
+        "concurrency": concurrency,
+        "server": {
+            "startup_seconds": server.startup_seconds,
+            "peak_rss_bytes": server_peak_rss,
+        },
+        "stages": {
+            "extract": with_throughput(extract),
+            "load": with_throughput(load),
+        },
+    }
+
+
+def run_benchmarks(sizes: List[int], export_format: Optional[str] = None, concurrency: int = 1) -> Dict[str, Any]:
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "runs": [benchmark_size(size, export_format, concurrency) for size in sizes],
+    }
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any],
+                    threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """Compare the rows/sec of every stage run at the same size in both result sets"""
+    def by_run(results):
+        return {
+            (run["size"], run.get("export_format"), run.get("concurrency", 1)): run
+            for run in results["runs"]
+        }
+
+    baseline_runs, candidate_runs = by_run(baseline), by_run(candidate)
+    comparisons = []
+    for key in sorted(set(baseline_runs) & set(candidate_runs), key=str):
+        for stage, before in baseline_runs[key]["stages"].items():
+            after = candidate_runs[key]["stages"].get(stage)
+            if after is None or not before["rows_per_second"] or after["rows_per_second"] is None:
+                continue
+            ratio = after["rows_per_second"] / before["rows_per_second"]
+            comparisons.append({
+                "size": key[0],
+                "stage": stage,
+                "baseline_rows_per_second": before["rows_per_second"],
+                "candidate_rows_per_second": after["rows_per_second"],
+                "ratio": ratio,
+                "regression": ratio < 1 - threshold,
+            })
+    return comparisons
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end MooVitamix ETL benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Run the benchmark and write the results as JSON')
+    run.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Rows per resource')
+    run.add_argument('--export-format', choices=['arrow', 'ndjson', 'parquet'],
+                     help='Extract through /export instead of paging')
+    run.add_argument('--concurrency', type=int, default=1, help='Concurrent page requests')
+    run.add_argument('--output', help='Result file (default: benchmarks/results/<commit>.json)')
+
+    compare = subparsers.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                         help='Relative rows/sec drop reported as a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.sizes, args.export_format, args.concurrency)
+        output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{results['commit'] or 'results'}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        for run in results['runs']:
+            for stage, metrics in run['stages'].items():
+                logger.info(
+                    f"{run['size']} rows - {stage}: {metrics['wall_seconds']:.2f}s, "
+                    f"{metrics['rows_per_second']:.0f} rows/s, peak RSS {metrics['peak_rss_bytes'] / 2**20:.0f} MiB, "
+                    f"{metrics['bytes_on_disk'] / 2**20:.1f} MiB on disk"
+                )
+        logger.info(f"Results written to {output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    comparisons = compare_results(baseline, candidate, args.threshold)
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison["regression"] else "ok"
+        print(f"{comparison['size']:>10} {comparison['stage']:<8} "
+              f"{comparison['baseline_rows_per_second']:>12.0f} -> {comparison['candidate_rows_per_second']:>12.0f} rows/s "
+              f"({comparison['ratio']:.2f}x) {flag}")
+    return 1 if any(comparison["regression"] for comparison in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
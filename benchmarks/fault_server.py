@@ -0,0 +1,211 @@
+"""
+Fault-injecting stand-in for the MooVitamix API.
+
+A small app serves deterministic rows on the paginated endpoints, and
+``FaultInjectionMiddleware`` answers a random share of the page requests with
+429/5xx errors (optionally with ``Retry-After``) and delays the others, to
+check that extraction retries, adapts its concurrency and still completes:
+
+    python -m benchmarks.fault_server serve --rows 100000 --error-rate 0.2 --port 8001
+    python -m benchmarks.fault_server run --rows 20000 --error-rates 0 0.05 0.1 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from fastapi import FastAPI, Query
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ERROR_STATUSES = (429, 500, 503)
+DEFAULT_ERROR_RATES = [0.0, 0.05, 0.1, 0.2]
+TIMESTAMP = "2024-12-12T00:00:00"
+
+
+class FaultInjectionMiddleware:
+    """ASGI middleware failing or delaying a share of the requests.
+
+    Args:
+        app: The wrapped ASGI app.
+        error_rate (float): Share of the requests answered with an error.
+        statuses (Sequence[int]): Error statuses, picked at random.
+        retry_after (float, optional): ``Retry-After`` seconds sent with 429 and 503.
+        latency (float): Seconds added to every answered request.
+        seed (int): Seed of the fault draws.
+        exempt_paths (Sequence[str]): Paths never failed nor delayed.
+
+    """
+
+    def __init__(self, app, error_rate: float = 0.1, statuses: Sequence[int] = DEFAULT_ERROR_STATUSES,
+                 retry_after: Optional[float] = None, latency: float = 0.0, seed: int = 0,
+                 exempt_paths: Sequence[str] = ("/health",)):
+        self.app = app
+        self.error_rate = error_rate
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        self.latency = latency
+        self.exempt_paths = set(exempt_paths)
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.injected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() >= self.error_rate:
+            await self.app(scope, receive, send)
+            return
+
+        self.injected += 1
+        status = self.rng.choice(self.statuses)
+        headers = [(b"content-type", b"application/json")]
+        if self.retry_after is not None and status in (429, 503):
+            headers.append((b"retry-after", str(self.retry_after).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": json.dumps({"detail": "injected fault"}).encode()})
+
+
+def stand_in_rows(rows: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Deterministic rows of each resource, under the raw schemas"""
+    return {
+        "tracks": [
+            {"id": i, "name": f"track {i}", "artist": f"artist {i % 97}", "songwriters": "writer",
+             "duration": "3:30", "genres": "Pop", "album": f"album {i % 53}",
+             "created_at": TIMESTAMP, "updated_at": TIMESTAMP}
+            for i in range(1, rows + 1)
+        ],
+        "users": [
+            {"id": i, "first_name": "first", "last_name": "last", "email": f"user{i}@example.com",
+             "gender": "Agender", "favorite_genres": "Rock", "created_at": TIMESTAMP, "updated_at": TIMESTAMP}
+            for i in range(1, rows + 1)
+        ],
+        "listen_history": [
+            {"user_id": i, "items": [i, i % rows + 1], "created_at": TIMESTAMP, "updated_at": TIMESTAMP}
+            for i in range(1, rows + 1)
+        ],
+    }
+
+
+def stand_in_app(rows: int = 1000) -> FastAPI:
+    """App serving ``rows`` rows per resource on the offset-paginated endpoints"""
+    app = FastAPI(title="MooVitamix stand-in")
+    data = stand_in_rows(rows)
+
+    def add_route(name: str):
+        @app.get(f"/{name}")
+        async def get_page(page: int = Query(1, ge=1), size: int = Query(100, ge=1, le=100)):
+            items = data[name][(page - 1) * size:page * size]
+            return {"items": items, "total": rows, "page": page, "size": size, "pages": -(-rows // size)}
+
+    for name in data:
+        add_route(name)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "dataset": "ready"}
+
+    return app
+
+
+def run_extraction(rows: int, error_rate: float, concurrency: int, max_concurrency: int,
+                   latency: float = 0.01, retry_after: Optional[float] = None, seed: int = 0) -> Dict[str, Any]:
+    """Extract every endpoint of a faulty stand-in through an in-process transport"""
+    from src.moovitamix_fastapi.etl.data_feed import MooVitamixDataFeed
+    from src.moovitamix_fastapi.etl.retry import RetryPolicy
+
+    app = FaultInjectionMiddleware(stand_in_app(rows), error_rate=error_rate, latency=latency,
+                                   retry_after=retry_after, seed=seed)
+    data_feed = MooVitamixDataFeed(
+        base_url="http://stand-in", concurrency=concurrency, max_concurrency=max_concurrency,
+        retry_policy=RetryPolicy(max_attempts=10, base_delay=0.05, max_delay=1.0, rng=random.Random(seed)),
+        transport=httpx.ASGITransport(app=app),
+    )
+    with tempfile.TemporaryDirectory(prefix="moovitamix-faults-") as output_dir:
+        data_feed.output_dir = output_dir
+        started = time.perf_counter()
+        data_feed.extract_all()
+        wall_seconds = time.perf_counter() - started
+
+    extracted = data_feed.metrics.total("rows_extracted_total")
+    return {
+        "error_rate": error_rate,
+        "requests": app.requests,
+        "injected_faults": app.injected,
+        "retries": data_feed.metrics.total("request_retries_total"),
+        "rows": extracted,
+        "complete": extracted == 3 * rows,
+        "wall_seconds": wall_seconds,
+        "rows_per_second": extracted / wall_seconds if wall_seconds else None,
+        "final_concurrency_limit": data_feed._limiter.current_limit,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Fault-injecting stand-in for the MooVitamix API')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='Serve the faulty stand-in with uvicorn')
+    serve.add_argument('--port', type=int, default=8001)
+    serve.add_argument('--rows', type=int, default=10000, help='Rows per resource')
+    serve.add_argument('--error-rate', type=float, default=0.1)
+    serve.add_argument('--latency', type=float, default=0.0, help='Seconds added to each request')
+    serve.add_argument('--retry-after', type=float, help='Retry-After seconds sent with 429 and 503')
+
+    run = subparsers.add_parser('run', help='Measure extraction throughput at several error rates')
+    run.add_argument('--rows', type=int, default=20000, help='Rows per resource')
+    run.add_argument('--error-rates', type=float, nargs='+', default=DEFAULT_ERROR_RATES)
+    run.add_argument('--concurrency', type=int, default=4, help='Initial concurrent requests')
+    run.add_argument('--max-concurrency', type=int, default=16, help='Ceiling of the adaptive concurrency')
+    run.add_argument('--latency', type=float, default=0.01, help='Seconds added to each request')
+    run.add_argument('--output', help='Write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    args = parse_args(argv)
+
+    if args.command == 'serve':
+        import uvicorn
+
+        app = FaultInjectionMiddleware(stand_in_app(args.rows), error_rate=args.error_rate,
+                                       latency=args.latency, retry_after=args.retry_after)
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+        return 0
+
+    results = [
+        run_extraction(args.rows, error_rate, args.concurrency, args.max_concurrency, args.latency)
+        for error_rate in args.error_rates
+    ]
+    baseline = results[0]["rows_per_second"]
+    for result in results:
+        logger.info(
+            f"error rate {result['error_rate']:.0%}: {result['rows_per_second']:.0f} rows/s "
+            f"({result['rows_per_second'] / baseline:.2f}x), {result['injected_faults']} faults, "
+            f"{result['retries']:.0f} retries, final concurrency {result['final_concurrency_limit']}"
+            f"{'' if result['complete'] else ', INCOMPLETE'}"
+        )
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(result["complete"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
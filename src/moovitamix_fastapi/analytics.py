@@ -0,0 +1,327 @@
+"""
+Read-only analytical queries over the DuckDB warehouse.
+
+The loader holds the only read-write connection to ``moovitamix.duckdb`` and
+DuckDB locks the file against every other process, so queries never open it:
+after each committed load the loader publishes a copy under its snapshot
+directory and names it in the ``CURRENT`` marker. This module serves a fixed
+set of parameterized feature queries from the current snapshot through a pool
+of read-only cursors. The snapshot name is the data version: results are
+cached under it, and the cache is dropped as soon as a new snapshot is marked
+current.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterator, List, NamedTuple, Optional, Tuple
+
+import duckdb
+
+from src.moovitamix_fastapi.etl.db_loader import DEFAULT_SNAPSHOT_DIR, current_snapshot
+from src.moovitamix_fastapi.export import ExportFormat, encode_batches
+from src.moovitamix_fastapi.page_cache import CachedPage, PageCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 4
+# Seconds a query waits for a free cursor before giving up
+DEFAULT_CURSOR_TIMEOUT = 30.0
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Results larger than this are streamed but not cached
+DEFAULT_MAX_RESULT_BYTES = 8 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 10000
+
+
+class FeatureQuery(NamedTuple):
+    """A parameterized query: its SQL with ``$1``-style placeholders and their names, in order."""
+
+    sql: str
+    params: Tuple[str, ...]
+
+
+FEATURE_QUERIES: Dict[str, FeatureQuery] = {
+    "user_genre_counts": FeatureQuery(
+        """
+        SELECT user_id, genre, listen_count
+        FROM agg_user_genre_counts
+        WHERE $1::INTEGER IS NULL OR user_id = $1::INTEGER
+        ORDER BY user_id, listen_count DESC, genre
+        """,
+        ("user_id",),
+    ),
+    "user_track_counts": FeatureQuery(
+        """
+        SELECT user_id, track_id, listen_count
+        FROM agg_user_track_counts
+        WHERE $1::INTEGER IS NULL OR user_id = $1::INTEGER
+        ORDER BY user_id, listen_count DESC, track_id
+        """,
+        ("user_id",),
+    ),
+    "top_tracks": FeatureQuery(
+        """
+        SELECT a.track_id, t.name, t.artist, t.genres, a.listen_count
+        FROM agg_track_play_counts a
+        LEFT JOIN dim_tracks t USING (track_id)
+        WHERE $1::VARCHAR IS NULL OR t.genres = $1::VARCHAR
+        ORDER BY a.listen_count DESC, a.track_id
+        LIMIT $2::INTEGER
+        """,
+        ("genre", "limit"),
+    ),
+    "daily_listens": FeatureQuery(
+        """
+        SELECT load_date, count(*) AS listens, count(DISTINCT user_id) AS users,
+               count(DISTINCT track_id) AS tracks
+        FROM fact_listen_history
+        WHERE load_date BETWEEN $1::DATE AND $2::DATE
+        GROUP BY load_date
+        ORDER BY load_date
+        """,
+        ("start_date", "end_date"),
+    ),
+    "user_activity": FeatureQuery(
+        """
+        SELECT user_id, count(*) AS listens, count(DISTINCT track_id) AS distinct_tracks,
+               min(listened_at) AS first_listen, max(listened_at) AS last_listen
+        FROM fact_listen_history
+        WHERE load_date BETWEEN $1::DATE AND $2::DATE
+        GROUP BY user_id
+        ORDER BY user_id
+        """,
+        ("start_date", "end_date"),
+    ),
+}
+
+
+class SnapshotUnavailable(LookupError):
+    """No snapshot of the warehouse has been published yet."""
+
+
+class SnapshotPool:
+    """
+    Read-only connection to one snapshot and a fixed pool of its cursors.
+
+    The service counts the queries holding the pool in ``refs`` and closes a
+    retired pool once the count drops to zero; both are only changed under
+    the service lock.
+
+    Args:
+        path (str): The snapshot database file.
+        version (str): The data version of the snapshot.
+        size (int): The number of cursors, i.e. of concurrent queries.
+        timeout (float): Seconds to wait for a free cursor.
+
+    """
+
+    def __init__(self, path: str, version: str, size: int = DEFAULT_POOL_SIZE,
+                 timeout: float = DEFAULT_CURSOR_TIMEOUT):
+        self.path = path
+        self.version = version
+        self.timeout = timeout
+        self.refs = 0
+        self.retired = False
+        self._conn = duckdb.connect(path, read_only=True)
+        self._cursors: "queue.Queue[duckdb.DuckDBPyConnection]" = queue.Queue()
+        for _ in range(size):
+            self._cursors.put(self._conn.cursor())
+
+    @property
+    def free_cursors(self) -> int:
+        return self._cursors.qsize()
+
+    @contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Hold a free cursor, waiting up to ``timeout`` seconds; raises ``TimeoutError``."""
+        try:
+            cursor = self._cursors.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No free cursor on snapshot {self.version}") from None
+        try:
+            yield cursor
+        finally:
+            self._cursors.put(cursor)
+
+    def close(self):
+        while not self._cursors.empty():
+            self._cursors.get_nowait().close()
+        self._conn.close()
+        logger.info(f"Closed snapshot {self.version}")
+
+
+class QueryResult:
+    """
+    The Arrow IPC stream of a query result, either cached or still to be read.
+
+    Args:
+        version (str): The data version the result was computed on.
+        page (CachedPage, optional): The cached encoded result.
+        chunks (Iterator[bytes], optional): The encoded result, streamed from
+            the database.
+
+    """
+
+    def __init__(self, version: str, page: Optional[CachedPage] = None,
+                 chunks: Optional[Iterator[bytes]] = None):
+        self.version = version
+        self.page = page
+        self.chunks = chunks
+
+    @property
+    def cached(self) -> bool:
+        return self.page is not None
+
+
+class AnalyticsService:
+    """
+    Run the feature queries on the current snapshot, caching their results.
+
+    Args:
+        snapshot_dir (str): The directory the loader publishes snapshots to.
+        pool_size (int): The number of read-only cursors per snapshot.
+        cursor_timeout (float): Seconds a query waits for a free cursor.
+        cache (PageCache, optional): The cache of encoded results.
+        max_result_bytes (int): The largest result kept in the cache.
+
+    """
+
+    def __init__(
+        self,
+        snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        cursor_timeout: float = DEFAULT_CURSOR_TIMEOUT,
+        cache: Optional[PageCache] = None,
+        max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES,
+    ):
+        self.snapshot_dir = snapshot_dir
+        self.pool_size = pool_size
+        self.cursor_timeout = cursor_timeout
+        self.cache = cache or PageCache(DEFAULT_CACHE_BYTES)
+        self.max_result_bytes = max_result_bytes
+        self._pool: Optional[SnapshotPool] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AnalyticsService":
+        """
+        Build the service configured by the environment.
+
+        ``MOOVITAMIX_DUCKDB_SNAPSHOT_DIR`` sets the snapshot directory,
+        ``MOOVITAMIX_ANALYTICS_POOL_SIZE`` the number of cursors and
+        ``MOOVITAMIX_ANALYTICS_CACHE_BYTES`` the cache budget.
+        """
+        return cls(
+            snapshot_dir=os.environ.get("MOOVITAMIX_DUCKDB_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR),
+            pool_size=int(os.environ.get("MOOVITAMIX_ANALYTICS_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            cache=PageCache(int(os.environ.get("MOOVITAMIX_ANALYTICS_CACHE_BYTES", DEFAULT_CACHE_BYTES))),
+        )
+
+    @property
+    def version(self) -> Optional[str]:
+        return None if self._pool is None else self._pool.version
+
+    def _select(self, path: Optional[str]) -> SnapshotPool:
+        """Switch to the snapshot at ``path`` if it is not served yet; the caller holds the lock"""
+        if path is None:
+            if self._pool is None:
+                raise SnapshotUnavailable(f"No snapshot published in {self.snapshot_dir}")
+            return self._pool
+
+        version = os.path.splitext(os.path.basename(path))[0]
+        if self._pool is None or self._pool.version != version:
+            previous = self._pool
+            self._pool = SnapshotPool(path, version,
+                                      self.pool_size, self.cursor_timeout)
+            self.cache.clear()
+            if previous is not None:
+                previous.retired = True
+                if previous.refs == 0:
+                    previous.close()
+            logger.info(f"Serving snapshot {version}")
+        return self._pool
+
+    def current(self) -> SnapshotPool:
+        """
+        Return the pool of the current snapshot, switching to a newer one if published.
+
+        Switching drops every cached result and retires the previous pool,
+        which is closed once the queries still holding it are done.
+
+        Raises:
+            SnapshotUnavailable: No snapshot has been published.
+
+        """
+        path = current_snapshot(self.snapshot_dir)
+        with self._lock:
+            return self._select(path)
+
+    def _checkout(self) -> SnapshotPool:
+        """Return the current pool, holding it open until ``_checkin``"""
+        path = current_snapshot(self.snapshot_dir)
+        with self._lock:
+            pool = self._select(path)
+            pool.refs += 1
+            return pool
+
+    def _checkin(self, pool: SnapshotPool):
+        with self._lock:
+            pool.refs -= 1
+            if pool.retired and pool.refs == 0:
+                pool.close()
+
+    def query(self, name: str, params: Dict[str, Any], batch_size: int = DEFAULT_BATCH_SIZE) -> QueryResult:
+        """
+        Run a feature query, or return its cached result for the current data version.
+
+        The query is executed before returning, so SQL errors are raised here;
+        the rows are then read one record batch at a time while the returned
+        chunks are consumed, and the full result is cached once read if it is
+        small enough. The cursor is held by the chunk generator: it is given
+        back when the chunks are exhausted, closed or garbage-collected.
+
+        Args:
+            name (str): The name of the query in ``FEATURE_QUERIES``.
+            params (Dict[str, Any]): The values of the query parameters.
+            batch_size (int): The number of rows per streamed record batch.
+
+        Returns:
+            QueryResult: The encoded Arrow IPC stream.
+
+        """
+        feature = FEATURE_QUERIES[name]
+        values = [params.get(param) for param in feature.params]
+        pool = self._checkout()
+        key: Hashable = (pool.version, name, tuple(values))
+        page = self.cache.get(key)
+        if page is not None:
+            self._checkin(pool)
+            return QueryResult(pool.version, page=page)
+
+        chunks = self._stream(pool, feature, values, batch_size, key)
+        # The first chunk (the stream schema) is only produced once the query has run
+        first = next(chunks, b"")
+        return QueryResult(pool.version, chunks=itertools.chain([first], chunks))
+
+    def _stream(self, pool: SnapshotPool, feature: FeatureQuery, values: List[Any],
+                batch_size: int, key: Hashable) -> Iterator[bytes]:
+        chunks: Optional[List[bytes]] = []
+        size = 0
+        try:
+            with pool.cursor() as cursor:
+                reader = cursor.execute(feature.sql, values).to_arrow_reader(batch_size)
+                for chunk in encode_batches(reader, reader.schema, ExportFormat.arrow):
+                    if chunks is not None:
+                        size += len(chunk)
+                        if size <= self.max_result_bytes:
+                            chunks.append(chunk)
+                        else:
+                            chunks = None
+                    yield chunk
+        finally:
+            self._checkin(pool)
+        if chunks is not None:
+            self.cache.put(key, b"".join(chunks))
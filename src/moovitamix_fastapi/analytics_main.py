@@ -0,0 +1,102 @@
+import datetime
+from typing import Any, Dict, Optional
+
+from src.moovitamix_fastapi.analytics import (
+    DEFAULT_BATCH_SIZE,
+    AnalyticsService,
+    SnapshotUnavailable,
+)
+from src.moovitamix_fastapi.export import MAX_EXPORT_BATCH_SIZE, MEDIA_TYPES, ExportFormat
+from src.moovitamix_fastapi.page_cache import etag_matches
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+
+analytics_service = AnalyticsService.from_env()
+
+app = FastAPI(
+    title="MooVitamix analytics",
+    description="Read-only feature queries over the MooVitamix warehouse, as Arrow IPC streams.",
+    version="1.0",
+)
+
+ARROW_MEDIA_TYPE = MEDIA_TYPES[ExportFormat.arrow]
+BatchSizeQuery = Query(DEFAULT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE)
+UserIdQuery = Query(None, description="Only the rows of this user.")
+
+
+async def feature_response(request: Request, name: str, params: Dict[str, Any], batch_size: int) -> Response:
+    """Serve a feature query as an Arrow IPC stream, from the cache when the data version has not changed"""
+    try:
+        result = await run_in_threadpool(analytics_service.query, name, params, batch_size)
+    except SnapshotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    headers = {"X-Data-Version": result.version}
+    if result.cached:
+        headers["ETag"] = result.page.etag
+        if etag_matches(request.headers.get("if-none-match"), result.page.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=result.page.body, media_type=ARROW_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(result.chunks, media_type=ARROW_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/features/user_genre_counts", tags=["Features"])
+async def user_genre_counts(
+    request: Request,
+    user_id: Optional[int] = UserIdQuery,
+    batch_size: int = BatchSizeQuery,
+) -> Response:
+    return await feature_response(request, "user_genre_counts", {"user_id": user_id}, batch_size)
+
+
+@app.get("/features/user_track_counts", tags=["Features"])
+async def user_track_counts(
+    request: Request,
+    user_id: Optional[int] = UserIdQuery,
+    batch_size: int = BatchSizeQuery,
+) -> Response:
+    return await feature_response(request, "user_track_counts", {"user_id": user_id}, batch_size)
+
+
+@app.get("/features/top_tracks", tags=["Features"])
+async def top_tracks(
+    request: Request,
+    genre: Optional[str] = Query(None, description="Only the tracks of this genre."),
+    limit: int = Query(100, ge=1, le=10000),
+    batch_size: int = BatchSizeQuery,
+) -> Response:
+    return await feature_response(request, "top_tracks", {"genre": genre, "limit": limit}, batch_size)
+
+
+@app.get("/features/daily_listens", tags=["Features"])
+async def daily_listens(
+    request: Request,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    batch_size: int = BatchSizeQuery,
+) -> Response:
+    params = {"start_date": start_date, "end_date": end_date}
+    return await feature_response(request, "daily_listens", params, batch_size)
+
+
+@app.get("/features/user_activity", tags=["Features"])
+async def user_activity(
+    request: Request,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    batch_size: int = BatchSizeQuery,
+) -> Response:
+    params = {"start_date": start_date, "end_date": end_date}
+    return await feature_response(request, "user_activity", params, batch_size)
+
+
+@app.get("/health", tags=["Health Check"])
+async def health_check():
+    try:
+        version = (await run_in_threadpool(analytics_service.current)).version
+    except SnapshotUnavailable:
+        return {"status": "waiting", "data_version": None}
+    return {"status": "healthy", "data_version": version}
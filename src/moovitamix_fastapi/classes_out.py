@@ -10,8 +10,14 @@ from typing import List, Optional
 from faker import Faker
 from pydantic import BaseModel, Field
 
+from src.moovitamix_fastapi.id_allocator import IdAllocator
+
 fake = Faker()
 
+# Collision-free ID sources for the generated tracks and users.
+track_id_allocator = IdAllocator()
+user_id_allocator = IdAllocator()
+
 
 def gender_list():
     return [
@@ -68,16 +74,19 @@ class TracksOut(BaseModel):
 
     @classmethod
     def generate_fake(cls) -> "TracksOut":
+        created_at = fake.date_time_between(start_date="-2y", end_date="now")
+        updated_at = fake.date_time_between(start_date=created_at, end_date="now")
+
         return cls(
-            id=fake.unique.random_int(min=1, max=100000),
+            id=track_id_allocator.allocate(),
             name=fake.word(),
             artist=fake.name(),
             songwriters=fake.name(),
             duration=fake.time(pattern="%M:%S"),
             genres=fake.word(),
             album=fake.word(),
-            created_at=fake.date_time_between(start_date="-2y", end_date="now"),
-            updated_at=fake.date_time_between(start_date="-1y", end_date="now"),
+            created_at=created_at,
+            updated_at=updated_at,
         )
 
 
@@ -93,15 +102,18 @@ class UsersOut(BaseModel):
 
     @classmethod
     def generate_fake(cls) -> "UsersOut":
+        created_at = fake.date_time_between(start_date="-2y", end_date="now")
+        updated_at = fake.date_time_between(start_date=created_at, end_date="now")
+
         return cls(
-            id=fake.unique.random_int(min=1, max=100000),
+            id=user_id_allocator.allocate(),
             first_name=fake.first_name(),
             last_name=fake.last_name(),
             email=fake.email(),
             gender=generate_random_gender(),
             favorite_genres=generate_random_genre(),
-            created_at=fake.date_time_between(start_date="-2y", end_date="now"),
-            updated_at=fake.date_time_between(start_date="-1y", end_date="now"),
+            created_at=created_at,
+            updated_at=updated_at,
         )
 
 
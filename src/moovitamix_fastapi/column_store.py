@@ -0,0 +1,116 @@
+"""
+Compact, array-backed row storage.
+
+The served rows are kept as one Arrow table instead of a list of pydantic
+models: integers and timestamps are typed 64-bit arrays (timestamps are epoch
+microseconds), low-cardinality strings such as genres and genders are
+dictionary-encoded, other strings are offsets into one byte buffer, and the
+listened items are a flat values array with offsets. Models are only built
+for the rows actually served. A table memory-mapped from an Arrow IPC file is
+read in place: its single-chunk columns are used without copying.
+"""
+
+from typing import Callable, Dict, List, Sequence, Type
+
+import numpy as np
+import pyarrow as pa
+from pydantic import BaseModel
+
+
+def _single_array(column: pa.ChunkedArray) -> pa.Array:
+    # combine_chunks would copy even a single chunk
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+def encode_dictionaries(table: pa.Table, columns: Sequence[str]) -> pa.Table:
+    """Dictionary-encode the given string columns of ``table``."""
+    for name in columns:
+        column = table.column(name)
+        if not pa.types.is_dictionary(column.type):
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, column.dictionary_encode())
+    return table
+
+
+def _column_reader(column: pa.ChunkedArray) -> Callable[[np.ndarray], list]:
+    """Return a function reading the Python values of ``column`` at given positions."""
+    array = _single_array(column)
+    column_type = array.type
+
+    if pa.types.is_dictionary(column_type):
+        codes = array.indices.to_numpy(zero_copy_only=False)
+        categories = array.dictionary.to_pylist()
+        return lambda positions: [categories[code] for code in codes[positions]]
+
+    if pa.types.is_timestamp(column_type):
+        timestamps = array.to_numpy(zero_copy_only=False).astype(f"datetime64[{column_type.unit}]", copy=False)
+        return lambda positions: timestamps[positions].tolist()
+
+    if (pa.types.is_integer(column_type) or pa.types.is_floating(column_type)) and array.null_count == 0:
+        values = array.to_numpy()
+        return lambda positions: values[positions].tolist()
+
+    if pa.types.is_list(column_type) and array.null_count == 0 and array.values.null_count == 0:
+        offsets = array.offsets.to_numpy()
+        values = array.values.to_numpy()
+        return lambda positions: [
+            values[offsets[position]:offsets[position + 1]].tolist() for position in positions
+        ]
+
+    return lambda positions: array.take(pa.array(positions, pa.int64())).to_pylist()
+
+
+class ColumnStore(Sequence):
+    """
+    Read-only sequence of models backed by an Arrow table.
+
+    Args:
+        table (pa.Table): The rows, in storage order.
+        model (Type[BaseModel]): The model built for each served row.
+        dictionary_columns (Sequence[str]): The low-cardinality string columns
+            to dictionary-encode.
+
+    """
+
+    def __init__(self, table: pa.Table, model: Type[BaseModel], dictionary_columns: Sequence[str] = ()):
+        table = encode_dictionaries(table, dictionary_columns)
+        if any(column.num_chunks != 1 for column in table.columns):
+            table = table.combine_chunks()
+        self.table = table
+        self.model = model
+        self._readers: Dict[str, Callable[[np.ndarray], list]] = {
+            name: _column_reader(self.table.column(name)) for name in self.table.column_names
+        }
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the underlying buffers, in bytes."""
+        return self.table.nbytes
+
+    def rows_at(self, positions) -> List[BaseModel]:
+        """
+        Build the models of the rows at ``positions``, one column at a time.
+
+        The values come from the store itself, so they are not validated again.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        names = self.table.column_names
+        columns = [self._readers[name](positions) for name in names]
+        return [
+            self.model.model_construct(**dict(zip(names, values)))
+            for values in zip(*columns)
+        ]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.rows_at(np.arange(*index.indices(len(self))))
+        if isinstance(index, np.ndarray):
+            return self.rows_at(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ColumnStore index out of range")
+        return self.rows_at([index])[0]
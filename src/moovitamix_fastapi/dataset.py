@@ -0,0 +1,336 @@
+"""
+Seeded, lazily built dataset served by the API.
+
+The dataset is generated from a seed and a reference time read from the
+environment, so every worker started with the same settings serves identical
+rows. It is generated once per settings into Arrow IPC files (the rows and
+their sort indexes), under a file lock, and every worker memory-maps those
+files read-only: workers share the pages through the OS page cache instead of
+each holding a copy. Loading happens in a background thread after startup;
+requests arriving before it is ready wait for it. Rows are read through
+compact ``ColumnStore`` tables and only turned into models for the page being
+served.
+"""
+
+import datetime
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+
+from src.moovitamix_fastapi.classes_out import ListenHistoryOut, TracksOut, UsersOut
+from src.moovitamix_fastapi.column_store import ColumnStore, encode_dictionaries
+from src.moovitamix_fastapi.columnar import encode_columnar_page
+from src.moovitamix_fastapi.generate_fake_data import (
+    LISTEN_HISTORY_SCHEMA,
+    TRACKS_SCHEMA,
+    USERS_SCHEMA,
+    FakeDataGenerator,
+)
+from src.moovitamix_fastapi.pagination import CursorPage, KeysetIndex, TimeIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_SIZE = 1000
+DEFAULT_SEED = 42
+# Fixed so that every worker, whenever started, generates the same rows
+DEFAULT_REFERENCE_TIME = datetime.datetime(2024, 12, 12)
+DEFAULT_DATASET_DIR = os.path.join(tempfile.gettempdir(), "moovitamix")
+# Written last: a dataset directory without it is incomplete
+READY_MARKER = "_READY"
+# Bumped whenever the generated rows change, so the files of an older generator are not reused
+DATASET_VERSION = 2
+READY_MARKER = "_READY"
+
+# Served resources: pagination key, output model, schema and the
+# low-cardinality string columns dictionary-encoded in the stored table
+RESOURCES = {
+    "tracks": ("id", TracksOut, TRACKS_SCHEMA, ("genres",)),
+    "users": ("id", UsersOut, USERS_SCHEMA, ("gender", "favorite_genres")),
+    "listen_history": ("user_id", ListenHistoryOut, LISTEN_HISTORY_SCHEMA, ()),
+}
+
+
+class DatasetSettings:
+    """
+    Settings of the generated dataset.
+
+    Args:
+        size (int): The number of observations of each resource.
+        seed (int): The generation seed.
+        reference_time (datetime.datetime): Upper bound of the generated
+            timestamps.
+        data_dir (str, optional): Root of the shared dataset files.
+
+    """
+
+    def __init__(self, size: int, seed: int, reference_time: datetime.datetime,
+                 data_dir: Optional[str] = None):
+        self.size = size
+        self.seed = seed
+        self.reference_time = reference_time
+        self.data_dir = data_dir or DEFAULT_DATASET_DIR
+
+    @property
+    def directory(self) -> str:
+        """The directory of the dataset files of these settings."""
+        stamp = self.reference_time.strftime("%Y%m%dT%H%M%S%f")
+        return os.path.join(self.data_dir, f"v{DATASET_VERSION}-size={self.size}-seed={self.seed}-time={stamp}")
+
+    @classmethod
+    def from_env(cls) -> "DatasetSettings":
+        """
+        Read the settings from the environment.
+
+        ``MOOVITAMIX_DATA_SIZE`` and ``MOOVITAMIX_SEED`` set the size and seed;
+        ``MOOVITAMIX_REFERENCE_TIME`` (ISO 8601) sets the reference time and
+        defaults to ``DEFAULT_REFERENCE_TIME``, a fixed instant, so that every
+        worker generates the same rows. ``MOOVITAMIX_DATASET_DIR`` is where the
+        shared dataset files are written.
+        """
+        reference_time = os.environ.get("MOOVITAMIX_REFERENCE_TIME")
+        if reference_time:
+            reference_time = datetime.datetime.fromisoformat(reference_time)
+        else:
+            reference_time = DEFAULT_REFERENCE_TIME
+
+        return cls(
+            size=int(os.environ.get("MOOVITAMIX_DATA_SIZE", DEFAULT_DATA_SIZE)),
+            seed=int(os.environ.get("MOOVITAMIX_SEED", DEFAULT_SEED)),
+            reference_time=reference_time,
+            data_dir=os.environ.get("MOOVITAMIX_DATASET_DIR"),
+        )
+
+
+class Resource:
+    """
+    One served table with its lookup indexes.
+
+    Args:
+        rows (ColumnStore): The rows, in storage order.
+        schema (pa.Schema): The Arrow schema of the served rows.
+        keyset_index (KeysetIndex): The rows sorted on their pagination key.
+        time_index (TimeIndex): The rows sorted on ``updated_at``.
+
+    """
+
+    def __init__(self, rows: ColumnStore, schema: pa.Schema, keyset_index: KeysetIndex, time_index: TimeIndex):
+        self.rows = rows
+        self.schema = schema
+        self.table = rows.table
+        self.keyset_index = keyset_index
+        self.time_index = time_index
+
+    def select(
+        self,
+        updated_since: Optional[datetime.datetime] = None,
+        updated_before: Optional[datetime.datetime] = None,
+    ) -> Sequence:
+        """Return the rows updated within ``[updated_since, updated_before)``."""
+        return self.time_index.select(self.rows, updated_since, updated_before)
+
+    def select_table(
+        self,
+        updated_since: Optional[datetime.datetime] = None,
+        updated_before: Optional[datetime.datetime] = None,
+    ) -> pa.Table:
+        """Return the stored table of the rows updated within ``[updated_since, updated_before)``."""
+        if updated_since is None and updated_before is None:
+            return self.table
+        return self.table.take(self.time_index.window(updated_since, updated_before))
+
+    def columnar_page(
+        self,
+        page: int,
+        size: int,
+        updated_since: Optional[datetime.datetime] = None,
+        updated_before: Optional[datetime.datetime] = None,
+    ) -> bytes:
+        """Encode one offset page of the selected rows as a columnar document."""
+        if updated_since is None and updated_before is None:
+            total = self.table.num_rows
+            start = min((page - 1) * size, total)
+            rows = self.table.slice(start, size)
+        else:
+            positions = self.time_index.window(updated_since, updated_before)
+            total = len(positions)
+            rows = self.table.take(positions[(page - 1) * size:page * size])
+        return encode_columnar_page(rows, total, page, size)
+
+    def cursor_page(self, cursor: Optional[int], size: int) -> CursorPage:
+        """Return the keyset page of rows following ``cursor``."""
+        return self.keyset_index.page(self.rows, cursor, size)
+
+
+def _write_ipc(path: str, table: pa.Table):
+    """Atomically write ``table`` as a single-batch Arrow IPC file."""
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+    os.replace(tmp_path, path)
+
+
+def _read_ipc(path: str) -> pa.Table:
+    """Memory-map an Arrow IPC file read-only; its buffers are not copied."""
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def write_dataset_files(settings: DatasetSettings, directory: str):
+    """
+    Generate the dataset and write each resource and its sort indexes.
+
+    Args:
+        settings (DatasetSettings): The settings to generate from.
+        directory (str): Where to write ``<resource>.arrow`` and
+            ``<resource>.index.arrow``.
+
+    """
+    generator = FakeDataGenerator(settings.size, seed=settings.seed)
+    data = generator.generate_bulk_data(now=settings.reference_time)
+    tables = {"tracks": data.tracks, "users": data.users, "listen_history": data.listen_history}
+
+    os.makedirs(directory, exist_ok=True)
+    for name, (key, _, _, dictionary_columns) in RESOURCES.items():
+        table = tables[name]
+        keys = table.column(key).to_numpy()
+        updated_at = table.column("updated_at").to_numpy()
+        key_positions = np.argsort(keys, kind="stable")
+        time_positions = np.argsort(updated_at, kind="stable")
+        index = pa.table({
+            "key_positions": key_positions,
+            "sorted_keys": keys[key_positions],
+            "time_positions": time_positions,
+            "sorted_updated_at": pa.array(updated_at[time_positions], pa.timestamp("us")),
+        })
+        _write_ipc(os.path.join(directory, f"{name}.arrow"), encode_dictionaries(table, dictionary_columns))
+        _write_ipc(os.path.join(directory, f"{name}.index.arrow"), index)
+
+    with open(os.path.join(directory, READY_MARKER), "w"):
+        pass
+
+
+def ensure_dataset_files(settings: DatasetSettings) -> str:
+    """
+    Return the directory of the dataset files, generating them if needed.
+
+    Only one process generates them: the others wait on a file lock and then
+    find them ready.
+    """
+    directory = settings.directory
+    if os.path.exists(os.path.join(directory, READY_MARKER)):
+        return directory
+
+    os.makedirs(settings.data_dir, exist_ok=True)
+    with open(f"{directory}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(os.path.join(directory, READY_MARKER)):
+                started = time.perf_counter()
+                write_dataset_files(settings, directory)
+                logger.info(
+                    f"Dataset files written to {directory} "
+                    f"in {time.perf_counter() - started:.2f}s"
+                )
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return directory
+
+
+class Dataset:
+    """
+    The tracks, users and listen history served by the API.
+
+    Args:
+        settings (DatasetSettings): The settings the dataset is built from.
+
+    """
+
+    def __init__(self, settings: DatasetSettings):
+        self.settings = settings
+        directory = ensure_dataset_files(settings)
+
+        self.resources: Dict[str, Resource] = {}
+        for name, (_, model, schema, dictionary_columns) in RESOURCES.items():
+            table = _read_ipc(os.path.join(directory, f"{name}.arrow"))
+            index = _read_ipc(os.path.join(directory, f"{name}.index.arrow"))
+            self.resources[name] = Resource(
+                ColumnStore(table, model, dictionary_columns),
+                schema,
+                KeysetIndex.from_sorted(
+                    index.column("key_positions").chunk(0).to_numpy(),
+                    index.column("sorted_keys").chunk(0).to_numpy(),
+                ),
+                TimeIndex.from_sorted(
+                    index.column("time_positions").chunk(0).to_numpy(),
+                    index.column("sorted_updated_at").chunk(0).to_numpy(),
+                ),
+            )
+        self.tracks = self.resources["tracks"]
+        self.users = self.resources["users"]
+        self.listen_history = self.resources["listen_history"]
+
+
+class DatasetLoader:
+    """
+    Build a ``Dataset`` once, in the background, and hand it out when ready.
+
+    Args:
+        settings (DatasetSettings, optional): The dataset settings. Defaults
+            to ``DatasetSettings.from_env()``.
+
+    """
+
+    def __init__(self, settings: Optional[DatasetSettings] = None):
+        self.settings = settings or DatasetSettings.from_env()
+        self.dataset: Optional[Dataset] = None
+        self.error: Optional[Exception] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        return "ready" if self.ready else "loading"
+
+    def _build(self):
+        started = time.perf_counter()
+        try:
+            self.dataset = Dataset(self.settings)
+            logger.info(
+                f"Dataset of {self.settings.size} rows (seed {self.settings.seed}) "
+                f"built in {time.perf_counter() - started:.2f}s"
+            )
+        except Exception as e:
+            logger.error(f"Error building dataset: {str(e)}")
+            self.error = e
+        finally:
+            self._ready.set()
+
+    def start(self):
+        """Start building the dataset in a background thread, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._build, name="dataset-loader", daemon=True
+                )
+                self._thread.start()
+
+    def get(self) -> Dataset:
+        """Return the dataset, starting the build and waiting for it if needed."""
+        self.start()
+        self._ready.wait()
+        if self.error is not None:
+            raise RuntimeError("Dataset construction failed") from self.error
+        return self.dataset
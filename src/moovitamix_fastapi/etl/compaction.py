@@ -0,0 +1,169 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.moovitamix_fastapi.etl.parquet_writer import RAW_SCHEMAS, ParquetPolicy, raw_policy, write_parquet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPACT_DIR = os.path.join('data', 'compacted')
+# Scans are timed as the best of this many runs
+SCAN_REPEATS = 3
+
+
+def daily_files(raw_dir: str, month: str, name: str) -> List[Tuple[str, str]]:
+    """The (date, path) of every daily raw file of a table within a YYYY-MM month"""
+    if not os.path.isdir(raw_dir):
+        return []
+    return [
+        (entry, os.path.join(raw_dir, entry, f"{name}.parquet"))
+        for entry in sorted(os.listdir(raw_dir))
+        if entry.startswith(f"{month}-") and len(entry) == 10
+        and os.path.exists(os.path.join(raw_dir, entry, f"{name}.parquet"))
+    ]
+
+
+def monthly_policy(name: str) -> ParquetPolicy:
+    """Raw policy of a table, also dictionary-encoding and sorting on the data_date column"""
+    policy = raw_policy(name)
+    dictionary_columns = policy.dictionary_columns
+    if dictionary_columns is not None:
+        dictionary_columns = dictionary_columns + ['data_date']
+    return policy.replace(dictionary_columns=dictionary_columns, sort_keys=policy.sort_keys + ['data_date'])
+
+
+def _best_seconds(scan: Callable[[], Any], repeats: int = SCAN_REPEATS) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        scan()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def scan_report(paths: List[str], key: Optional[str], value: Any) -> Dict[str, float]:
+    """Time a full scan of the files, and a lookup of one key value pruned on row-group statistics"""
+    report = {'full_scan_seconds': _best_seconds(lambda: pq.read_table(paths))}
+    if key is not None and value is not None:
+        report['key_lookup_seconds'] = _best_seconds(lambda: pq.read_table(paths, filters=[(key, '==', value)]))
+    return report
+
+
+def compact_table(raw_dir: str, month: str, compact_dir: str, name: str,
+                  policy: Optional[ParquetPolicy] = None) -> Optional[Dict[str, Any]]:
+    """Merge the daily files of a table into one sorted monthly file, reporting bytes and scan times"""
+    files = daily_files(raw_dir, month, name)
+    if not files:
+        logger.info(f"No daily {name} files for {month}")
+        return None
+    policy = policy or monthly_policy(name)
+    schema = RAW_SCHEMAS.get(name)
+
+    tables = []
+    for data_date, path in files:
+        table = pq.read_table(path, schema=schema)
+        tables.append(table.append_column('data_date', pa.array([data_date] * table.num_rows, pa.string())))
+    table = pa.concat_tables(tables)
+
+    output_dir = os.path.join(compact_dir, month)
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{name}.parquet")
+    write_parquet(table, output_path, policy)
+
+    # Lookup of one existing value of the first sort key
+    key = policy.sort_keys[0] if policy.sort_keys else None
+    value = table.column(key)[table.num_rows // 2].as_py() if key is not None and table.num_rows else None
+
+    daily_paths = [path for _, path in files]
+    before = scan_report(daily_paths, key, value)
+    after = scan_report([output_path], key, value)
+    report = {
+        'files': len(files),
+        'rows': table.num_rows,
+        'bytes_before': sum(os.path.getsize(path) for path in daily_paths),
+        'bytes_after': os.path.getsize(output_path),
+        'row_groups_after': pq.ParquetFile(output_path).num_row_groups,
+        **{f"{metric}_before": seconds for metric, seconds in before.items()},
+        **{f"{metric}_after": seconds for metric, seconds in after.items()},
+    }
+    logger.info(
+        f"Compacted {len(files)} daily {name} files into {output_path}: "
+        f"{report['bytes_before']} -> {report['bytes_after']} bytes, full scan "
+        f"{report['full_scan_seconds_before']:.4f}s -> {report['full_scan_seconds_after']:.4f}s"
+    )
+    return report
+
+
+def compact_month(raw_dir: str, month: str, compact_dir: str = DEFAULT_COMPACT_DIR,
+                  names: Optional[List[str]] = None, policy_overrides: Optional[Dict[str, Any]] = None,
+                  delete_daily: bool = False) -> Dict[str, Any]:
+    """Compact every table of a month, writing the report next to the monthly files
+
+    With delete_daily, the daily files are removed once compacted. The loader
+    only reads daily files, so the dates of the month can then no longer be
+    reloaded or backfilled into DuckDB.
+    """
+    tables = {}
+    for name in names or list(RAW_SCHEMAS):
+        policy = monthly_policy(name).replace(**(policy_overrides or {}))
+        report = compact_table(raw_dir, month, compact_dir, name, policy)
+        if report is None:
+            continue
+        report['policy'] = policy.to_dict()
+        tables[name] = report
+        if delete_daily:
+            # Only once the monthly file is written: write_parquet replaces it atomically
+            for _, path in daily_files(raw_dir, month, name):
+                os.remove(path)
+            logger.warning(f"Deleted the daily {name} files of {month}: they can no longer be reloaded into DuckDB")
+
+    report = {'month': month, 'tables': tables}
+    if tables:
+        report_path = os.path.join(compact_dir, month, 'report.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Compaction report written to {report_path}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compact the daily raw parquet files of a month")
+    parser.add_argument('--month', required=True, help="Month to compact (YYYY-MM)")
+    parser.add_argument('--raw-dir', default=os.path.join('data', 'raw'), help="Root of the raw date directories")
+    parser.add_argument('--compact-dir', default=DEFAULT_COMPACT_DIR, help="Root of the monthly files")
+    parser.add_argument('--compression', help="Parquet codec (default: the raw policy's)")
+    parser.add_argument('--compression-level', type=int, help="Codec level")
+    parser.add_argument('--row-group-size', type=int, help="Rows per row group")
+    parser.add_argument('--delete-daily', action='store_true',
+                        help="Remove the daily files once compacted. DuckDBLoader reloads and backfills read "
+                             "the daily files only: the deleted dates can no longer be reloaded or backfilled")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    overrides = {}
+    if args.compression:
+        overrides.update(compression=args.compression, compression_level=None)
+    if args.compression_level is not None:
+        overrides['compression_level'] = args.compression_level
+    if args.row_group_size:
+        overrides['row_group_size'] = args.row_group_size
+    try:
+        compact_month(args.raw_dir, args.month, args.compact_dir, policy_overrides=overrides,
+                      delete_daily=args.delete_daily)
+        return 0
+    except Exception as e:
+        logger.error(f"Error compacting {args.month}: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,9 +1,44 @@
 import os
+import asyncio
+import itertools
 import logging
+from collections import deque
 from datetime import datetime
+import json
+import time
+import httpx
 import requests
 import pandas as pd
-from typing import List, Dict, Any
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
+
+from src.moovitamix_fastapi.columnar import columnar_to_arrow
+from src.moovitamix_fastapi.etl.metrics import DEFAULT_METRICS_DIR, PipelineMetrics
+from src.moovitamix_fastapi.etl.parquet_writer import (
+    DEFAULT_ROW_GROUP_SIZE,
+    RAW_SCHEMAS,
+    ParquetStreamWriter,
+    raw_policy,
+)
+from src.moovitamix_fastapi.etl.retry import (
+    RETRYABLE_STATUS,
+    AdaptiveConcurrencyLimiter,
+    RetryPolicy,
+    get_with_retries,
+    parse_retry_after,
+)
+from src.moovitamix_fastapi.etl.validation import BatchValidator, QuarantineWriter
+
+# Formats served by the /export/<resource> bulk endpoint
+EXPORT_FORMATS = ('arrow', 'ndjson', 'parquet')
+# Rows per batch written from an NDJSON or parquet export
+EXPORT_BATCH_SIZE = 10000
+# Largest page size accepted by the offset-paginated endpoints
+PAGE_SIZE = 100
+# Pages scheduled ahead by the async extractor, in multiples of its largest concurrency
+LOOKAHEAD_WINDOWS = 4
 
 # Set up logging
 logging.basicConfig(
@@ -12,9 +47,51 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def to_raw_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Conform an exported Arrow table to a raw schema, with timestamps as ISO strings like the JSON pages"""
+    arrays = []
+    for field in schema:
+        if field.name not in table.column_names:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+            continue
+        column = table.column(field.name)
+        if pa.types.is_timestamp(column.type) and pa.types.is_string(field.type):
+            column = pc.strftime(column, format='%Y-%m-%dT%H:%M:%S')
+        arrays.append(column)
+    # Mistyped columns are left to the validator, or cast by the writer
+    return pa.Table.from_arrays(arrays, names=schema.names)
+
 class MooVitamixDataFeed:
-    def __init__(self, base_url: str = "http://localhost:8000"):
+    def __init__(self, base_url: str = "http://localhost:8000", export_format: Optional[str] = None,
+                 incremental: bool = False, state_path: Optional[str] = None,
+                 concurrency: int = 1, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE, metrics: Optional[PipelineMetrics] = None,
+                 columnar: bool = False, validate: bool = False, retry_policy: Optional[RetryPolicy] = None,
+                 max_concurrency: Optional[int] = None, latency_threshold: float = 1.0):
+        if export_format is not None and export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
         self.base_url = base_url
+        self.export_format = export_format
+        self.incremental = incremental
+        self.state_path = state_path or os.path.join('data', 'state', 'high_water_marks.json')
+        # More than one concurrent request switches page fetching to the async client
+        self.concurrency = concurrency
+        # The concurrency adapts (AIMD) between 1 and max_concurrency: up while pages come back
+        # within latency_threshold seconds, down on throttling, server errors and timeouts
+        self.max_concurrency = max(max_concurrency or concurrency, concurrency)
+        self.latency_threshold = latency_threshold
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._limiter: Optional[AdaptiveConcurrencyLimiter] = None
+        self.transport = transport
+        self.row_group_size = row_group_size
+        # Request columnar pages, decoded straight into Arrow tables
+        self.columnar = columnar
+        # Check each page before writing it, quarantining the failing rows
+        self.validate = validate
+        self.validation_reports: Dict[str, Dict[str, Any]] = {}
+        self._quarantines: Dict[str, QuarantineWriter] = {}
+        # Per-endpoint request latencies, pages, rows, bytes and parquet write time of the run
+        self.metrics = metrics or PipelineMetrics('extract')
         self.endpoints = {
             'tracks': '/tracks',
             'users': '/users',
@@ -22,29 +99,274 @@ class MooVitamixDataFeed:
         }
         self.output_dir = os.path.join('data', 'raw', datetime.now().strftime('%Y-%m-%d'))
 
-    def _make_request(self, endpoint: str) -> List[Dict[Any, Any]]:
-        """Make paginated requests to the API endpoint"""
+    def _load_high_water_marks(self) -> Dict[str, str]:
+        """Load the persisted updated_at high-water mark of each endpoint"""
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def _save_high_water_mark(self, name: str, value: str):
+        """Persist the high-water mark of an endpoint, atomically replacing the state file"""
+        marks = self._load_high_water_marks()
+        marks[name] = value
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(marks, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _incremental_params(self, name: str) -> Dict[str, str]:
+        """Query parameters restricting an extraction to rows updated since the last run"""
+        if not self.incremental:
+            return {}
+        high_water_mark = self._load_high_water_marks().get(name)
+        if high_water_mark is None:
+            return {}
+        logger.info(f"Extracting {name} rows updated since {high_water_mark}")
+        return {'updated_since': high_water_mark}
+
+    def _update_high_water_mark(self, name: str):
+        """Advance the high-water mark to the latest updated_at that was saved"""
+        output_path = os.path.join(self.output_dir, f"{name}.parquet")
+        updated_at = pd.read_parquet(output_path, columns=['updated_at'])['updated_at']
+        if updated_at.empty:
+            return
+        self._save_high_water_mark(name, pd.to_datetime(updated_at, format='ISO8601').max().isoformat())
+
+    def _page_params(self, params: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Query parameters of a page request"""
+        if self.columnar:
+            return {**(params or {}), 'format': 'columnar'}
+        return dict(params or {})
+
+    @staticmethod
+    def _page_rows(endpoint: str, data: Dict[str, Any]):
+        """The rows of a page: its records, or an Arrow table for a columnar page"""
+        if 'columns' in data:
+            return columnar_to_arrow(data['columns'], RAW_SCHEMAS.get(endpoint.strip('/')))
+        return data['items']
+
+    def _iter_pages(self, endpoint: str, params: Optional[Dict[str, str]] = None) -> Iterator[List[Dict[Any, Any]]]:
+        """Yield the items of each page of the API endpoint, in page order"""
         url = f"{self.base_url}{endpoint}"
-        all_items = []
+        params = self._page_params(params)
         page = 1
         
         while True:
             try:
-                response = requests.get(f"{url}?page={page}&size=100")
-                response.raise_for_status()
+                started = time.perf_counter()
+                response = self._get_with_retries(endpoint, f"{url}?page={page}&size={PAGE_SIZE}", params)
                 data = response.json()
+                rows = self._page_rows(endpoint, data)
+                self._record_page(endpoint, response, len(rows), time.perf_counter() - started)
                 
-                if not data['items']:
+                if not len(rows):
                     break
                     
-                all_items.extend(data['items'])
+                yield rows
                 page += 1
                 
             except requests.exceptions.RequestException as e:
                 logger.error(f"Error fetching data from {url}: {str(e)}")
                 raise
-                
-        return all_items
+
+    def _record_retry(self, endpoint: str, attempt: int, reason: str, delay: float):
+        """Count and log a retried page request"""
+        self.metrics.inc('request_retries_total', endpoint=endpoint.strip('/'), reason=reason)
+        logger.warning(f"Retrying {endpoint} ({reason}) in {delay:.2f}s, attempt {attempt + 1}"
+                       f" of {self.retry_policy.max_attempts}")
+
+    def _get_with_retries(self, endpoint: str, url: str, params: Dict[str, str]) -> requests.Response:
+        """GET a page, retrying throttled, failed and timed-out requests with backoff"""
+        return get_with_retries(
+            requests.get, url, self.retry_policy, params=params,
+            on_retry=lambda attempt, reason, delay: self._record_retry(endpoint, attempt, reason, delay),
+        )
+
+    def fetch_page_table(self, name: str, page: int = 1, size: int = PAGE_SIZE,
+                         params: Optional[Dict[str, str]] = None) -> pa.Table:
+        """Fetch one columnar page of a resource as an Arrow table"""
+        endpoint = self.endpoints[name]
+        started = time.perf_counter()
+        response = self._get_with_retries(endpoint, f"{self.base_url}{endpoint}",
+                                          {**(params or {}), 'page': page, 'size': size, 'format': 'columnar'})
+        table = columnar_to_arrow(response.json()['columns'], RAW_SCHEMAS.get(name))
+        self._record_page(endpoint, response, table.num_rows, time.perf_counter() - started)
+        return table
+
+    def fetch_page_dataframe(self, name: str, page: int = 1, size: int = PAGE_SIZE,
+                             params: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """Fetch one columnar page of a resource as a DataFrame"""
+        return self.fetch_page_table(name, page, size, params).to_pandas()
+
+    def _make_request(self, endpoint: str, params: Optional[Dict[str, str]] = None) -> List[Dict[Any, Any]]:
+        """Make paginated requests to the API endpoint"""
+        return [item for items in self._iter_pages(endpoint, params) for item in items]
+
+    async def _fetch_page(self, client: httpx.AsyncClient, url: str, page: int,
+                          params: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        """Fetch one page of an endpoint with the pooled async client, with its decoded rows"""
+        endpoint = url[len(self.base_url):]
+        started = time.perf_counter()
+        response = await self._send_with_retries(client, endpoint, url, {
+            **self._page_params(params), 'page': page, 'size': PAGE_SIZE
+        })
+        data = response.json()
+        data['rows'] = self._page_rows(endpoint, data)
+        self._record_page(endpoint, response, len(data['rows']), time.perf_counter() - started)
+        return data
+
+    async def _send_with_retries(self, client: httpx.AsyncClient, endpoint: str, url: str,
+                                 params: Dict[str, Any]) -> httpx.Response:
+        """GET a page within the concurrency limit, retrying with backoff and adapting the limit"""
+        attempt = 1
+        while True:
+            retry_after, error, response = None, None, None
+            sent_at = await self._limiter.acquire()
+            try:
+                response = await client.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                # Adapted before the slot is released, so that waiting requests see the new limit
+                if response is not None and response.status_code not in RETRYABLE_STATUS:
+                    self._limiter.on_success(time.monotonic() - sent_at)
+                elif response is not None or error is not None:
+                    self._limiter.on_overload(sent_at)
+                await self._limiter.release()
+
+            if error is None and response.status_code not in RETRYABLE_STATUS:
+                response.raise_for_status()
+                return response
+
+            self.metrics.set('concurrency_limit', self._limiter.current_limit, endpoint=endpoint.strip('/'))
+            if not self.retry_policy.should_retry(attempt):
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+            if error is None:
+                reason = str(response.status_code)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            else:
+                reason = type(error).__name__
+            delay = self.retry_policy.delay(attempt, retry_after)
+            self._record_retry(endpoint, attempt, reason, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _record_page(self, endpoint: str, response, row_count: int, seconds: float):
+        """Record the latency, rows and bytes of one fetched page"""
+        endpoint = endpoint.strip('/')
+        self.metrics.observe('request_seconds', seconds, endpoint=endpoint)
+        self.metrics.inc('pages_fetched_total', endpoint=endpoint)
+        self.metrics.inc('rows_extracted_total', row_count, endpoint=endpoint)
+        self.metrics.inc('bytes_extracted_total', len(response.content), endpoint=endpoint)
+
+    def _track_ids(self) -> Optional[pa.Array]:
+        """The valid track IDs of the run, that listened items must reference"""
+        tracks = self._quarantines.get('tracks')
+        if self.incremental or tracks is None:
+            # An incremental run only sees the tracks updated since the last one
+            return None
+        return tracks.validator.valid_keys()
+
+    def _open_quarantine(self, name: str):
+        """Start validating an endpoint, with its quarantine file next to the raw files"""
+        track_ids = self._track_ids() if name == 'listen_history' else None
+        validator = BatchValidator(name, RAW_SCHEMAS.get(name), track_ids)
+        path = os.path.join(self.output_dir, 'quarantine', f"{name}.parquet")
+        self._quarantines[name] = QuarantineWriter(validator, path)
+
+    def _write_items(self, name: str, writer: ParquetStreamWriter, items):
+        """Append a page (records or an Arrow table) to the raw parquet file, timing the write"""
+        if self.validate:
+            if name not in self._quarantines:
+                self._open_quarantine(name)
+            with self.metrics.timer('validation_seconds_total', endpoint=name):
+                items = self._quarantines[name].validate(items)
+        with self.metrics.timer('parquet_write_seconds_total', endpoint=name):
+            if isinstance(items, pa.Table):
+                writer.write_table(items)
+            else:
+                writer.write(items)
+
+    def _close_writer(self, name: str, writer: ParquetStreamWriter):
+        """Flush the last row group and the footer, timing the write"""
+        with self.metrics.timer('parquet_write_seconds_total', endpoint=name):
+            writer.close()
+        if name in self._quarantines:
+            report = self._quarantines[name].close()
+            self.validation_reports[name] = report.to_dict()
+            for reason, count in self.validation_reports[name]['reasons'].items():
+                self.metrics.inc('rows_rejected_total', count, endpoint=name, reason=reason)
+
+    async def _iter_pages_async(self, client: httpx.AsyncClient, endpoint: str,
+                                params: Optional[Dict[str, str]] = None) -> AsyncIterator[List[Dict[Any, Any]]]:
+        """Yield the items of each page in page order, keeping up to `concurrency` requests in flight"""
+        url = f"{self.base_url}{endpoint}"
+        in_flight = deque()
+        try:
+            first_page = await self._fetch_page(client, url, 1, params)
+            yield first_page['rows']
+
+            page_count = first_page.get('pages')
+            if page_count is None:
+                # No page count advertised: walk the pages until an empty one
+                page, rows = 1, first_page['rows']
+                while len(rows):
+                    page += 1
+                    rows = (await self._fetch_page(client, url, page, params))['rows']
+                    if len(rows):
+                        yield rows
+                return
+
+            pages = iter(range(2, page_count + 1))
+            # Pages are scheduled ahead of the limit, so that a page waiting for a retry does not
+            # stall the others; the limiter decides how many requests are actually sent at once
+            for page in itertools.islice(pages, LOOKAHEAD_WINDOWS * self.max_concurrency):
+                in_flight.append(asyncio.ensure_future(self._fetch_page(client, url, page, params)))
+            while in_flight:
+                data = await in_flight.popleft()
+                for page in itertools.islice(pages, 1):
+                    in_flight.append(asyncio.ensure_future(self._fetch_page(client, url, page, params)))
+                yield data['rows']
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching data from {url}: {str(e)}")
+            raise
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _extract_all_async(self):
+        """Stream every endpoint to parquet through one pooled keep-alive client"""
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        self._limiter = AdaptiveConcurrencyLimiter(self.concurrency, max_limit=self.max_concurrency,
+                                                   latency_threshold=self.latency_threshold)
+        async with httpx.AsyncClient(limits=limits, transport=self.transport) as client:
+            for name, endpoint in self.endpoints.items():
+                logger.info(f"Extracting data from {endpoint} with up to {self._limiter.current_limit} concurrent requests")
+                with self._open_writer(name) as writer:
+                    async for items in self._iter_pages_async(client, endpoint, self._incremental_params(name)):
+                        await asyncio.to_thread(self._write_items, name, writer, items)
+                    await asyncio.to_thread(self._close_writer, name, writer)
+                if self.incremental:
+                    self._update_high_water_mark(name)
+                logger.info(f"Successfully extracted {name} data")
+
+    def _open_writer(self, name: str) -> ParquetStreamWriter:
+        """Open the incremental parquet writer of an endpoint's raw file"""
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        output_path = os.path.join(self.output_dir, f"{name}.parquet")
+        return ParquetStreamWriter(output_path, RAW_SCHEMAS.get(name), self.row_group_size, raw_policy(name))
+
+    def _extract_endpoint(self, name: str, endpoint: str):
+        """Stream the pages of an endpoint into its raw parquet file"""
+        with self._open_writer(name) as writer:
+            for items in self._iter_pages(endpoint, self._incremental_params(name)):
+                self._write_items(name, writer, items)
+            self._close_writer(name, writer)
 
     def _save_to_parquet(self, data: List[Dict], filename: str):
         """Save the data to a parquet file"""
@@ -53,31 +375,117 @@ class MooVitamixDataFeed:
             
         df = pd.DataFrame(data)
         output_path = os.path.join(self.output_dir, f"{filename}.parquet")
-        df.to_parquet(output_path, index=False)
+        policy = raw_policy(filename)
+        df.to_parquet(output_path, index=False, row_group_size=policy.row_group_size,
+                      **policy.writer_options(pa.Schema.from_pandas(df, preserve_index=False)))
         logger.info(f"Saved {len(data)} records to {output_path}")
 
+    def _export_batches(self, name: str, response: requests.Response, output_path: str) -> Iterator[Any]:
+        """Yield the batches of a streamed export response, as records or raw-schema Arrow tables"""
+        if self.export_format == 'ndjson':
+            lines = []
+            for line in response.iter_lines():
+                if line:
+                    lines.append(json.loads(line))
+                if len(lines) == EXPORT_BATCH_SIZE:
+                    yield lines
+                    lines = []
+            yield lines
+            return
+
+        if self.export_format == 'parquet':
+            # Parquet is read from its footer: the body is downloaded before its batches are read
+            download_path = f"{output_path}.download"
+            try:
+                with open(download_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+                with pq.ParquetFile(download_path) as parquet_file:
+                    for batch in parquet_file.iter_batches(batch_size=EXPORT_BATCH_SIZE):
+                        yield to_raw_table(pa.Table.from_batches([batch]), RAW_SCHEMAS[name])
+            finally:
+                if os.path.exists(download_path):
+                    os.remove(download_path)
+            return
+
+        response.raw.decode_content = True
+        for batch in pa.ipc.open_stream(response.raw):
+            yield to_raw_table(pa.Table.from_batches([batch]), RAW_SCHEMAS[name])
+
+    def _write_export_stream(self, name: str, response: requests.Response, output_path: str) -> int:
+        """Write a streamed export response to the raw parquet file, batch by batch
+
+        Every format goes through the writer and validation of the paged mode,
+        so the file has the raw schema and write policy of the endpoint.
+        """
+        with self._open_writer(name) as writer:
+            for items in self._export_batches(name, response, output_path):
+                self._write_items(name, writer, items)
+            self._close_writer(name, writer)
+        return writer.rows_written
+
+    def _stream_export(self, name: str):
+        """Stream the bulk export of a resource straight into a parquet file"""
+        url = f"{self.base_url}/export/{name}"
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        output_path = os.path.join(self.output_dir, f"{name}.parquet")
+
+        try:
+            params = {'format': self.export_format, **self._incremental_params(name)}
+            started = time.perf_counter()
+            with requests.get(url, params=params, stream=True) as response:
+                response.raise_for_status()
+                row_count = self._write_export_stream(name, response, output_path)
+            # Download and parquet write overlap: the stream is written as it arrives
+            self.metrics.observe('request_seconds', time.perf_counter() - started, endpoint=name)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error streaming export from {url}: {str(e)}")
+            raise
+
+        self.metrics.inc('rows_extracted_total', row_count, endpoint=name)
+        self.metrics.inc('bytes_extracted_total', os.path.getsize(output_path), endpoint=name)
+        logger.info(f"Saved {row_count} records to {output_path}")
+
     def extract_all(self):
         """Extract data from all endpoints"""
         try:
-            for name, endpoint in self.endpoints.items():
-                logger.info(f"Extracting data from {endpoint}")
-                data = self._make_request(endpoint)
-                self._save_to_parquet(data, name)
-                logger.info(f"Successfully extracted {name} data")
-                
+            with self.metrics.run():
+                self._extract_all()
         except Exception as e:
             logger.error(f"Error in extract_all: {str(e)}")
             raise
 
+    def _extract_all(self):
+        self._quarantines = {}
+        if self.max_concurrency > 1 and not self.export_format:
+            asyncio.run(self._extract_all_async())
+            return
+        for name, endpoint in self.endpoints.items():
+            logger.info(f"Extracting data from {endpoint}")
+            if self.export_format:
+                self._stream_export(name)
+            else:
+                self._extract_endpoint(name, endpoint)
+            if self.incremental:
+                self._update_high_water_mark(name)
+            logger.info(f"Successfully extracted {name} data")
+
 def main():
+    data_feed = MooVitamixDataFeed(validate=True)
     try:
-        data_feed = MooVitamixDataFeed()
         data_feed.extract_all()
         logger.info("Data extraction completed successfully")
         
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
         return 1
+
+    finally:
+        # Picked up by the loader to record the run, and by the Prometheus textfile collector
+        data_date = os.path.basename(data_feed.output_dir)
+        data_feed.metrics.save_json(os.path.join(DEFAULT_METRICS_DIR, 'runs', data_date, 'extract.json'))
+        data_feed.metrics.write_prometheus(os.path.join(DEFAULT_METRICS_DIR, 'extract.prom'))
         
     return 0
 
@@ -1,151 +1,511 @@
 import duckdb
 import os
+import shutil
 from datetime import datetime
 import logging
-from typing import Optional
+import argparse
+import re
+import time
+import json
+import pyarrow as pa
+from typing import Dict, List, Optional
+
+from src.moovitamix_fastapi.etl.metrics import DEFAULT_METRICS_DIR, PipelineMetrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Dimensions loaded from the raw files: source file, table, key and attribute columns
+DIMENSIONS = {
+    'tracks': {
+        'table': 'dim_tracks',
+        'key': 'track_id',
+        'columns': ['name', 'artist', 'songwriters', 'duration', 'genres', 'album'],
+    },
+    'users': {
+        'table': 'dim_users',
+        'key': 'user_id',
+        'columns': ['first_name', 'last_name', 'email', 'gender', 'favorite_genres'],
+    },
+}
+
+# Versioned, idempotent schema migrations, applied in order and recorded in schema_version
+SCHEMA_MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS dim_tracks (
+            track_id INTEGER,
+            name VARCHAR,
+            artist VARCHAR,
+            songwriters VARCHAR,
+            duration VARCHAR,
+            genres VARCHAR,
+            album VARCHAR,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            etl_updated_at TIMESTAMP,
+            PRIMARY KEY (track_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dim_users (
+            user_id INTEGER,
+            first_name VARCHAR,
+            last_name VARCHAR,
+            email VARCHAR,
+            gender VARCHAR,
+            favorite_genres VARCHAR,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            etl_updated_at TIMESTAMP,
+            PRIMARY KEY (user_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fact_listen_history (
+            user_id INTEGER,
+            track_id INTEGER,
+            listened_at TIMESTAMP,
+            load_date DATE
+        );
+        """,
+    ]),
+    (2, [
+        """
+        CREATE TABLE IF NOT EXISTS dim_tracks_history (
+            track_id INTEGER,
+            name VARCHAR,
+            artist VARCHAR,
+            songwriters VARCHAR,
+            duration VARCHAR,
+            genres VARCHAR,
+            album VARCHAR,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            row_hash VARCHAR,
+            valid_from TIMESTAMP,
+            valid_to TIMESTAMP,
+            is_current BOOLEAN
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dim_users_history (
+            user_id INTEGER,
+            first_name VARCHAR,
+            last_name VARCHAR,
+            email VARCHAR,
+            gender VARCHAR,
+            favorite_genres VARCHAR,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            row_hash VARCHAR,
+            valid_from TIMESTAMP,
+            valid_to TIMESTAMP,
+            is_current BOOLEAN
+        );
+        """,
+    ]),
+    (3, [
+        """
+        CREATE TABLE IF NOT EXISTS agg_user_genre_counts (
+            user_id INTEGER,
+            genre VARCHAR,
+            listen_count BIGINT,
+            PRIMARY KEY (user_id, genre)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS agg_track_play_counts (
+            track_id INTEGER,
+            listen_count BIGINT,
+            PRIMARY KEY (track_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS agg_user_track_counts (
+            user_id INTEGER,
+            track_id INTEGER,
+            listen_count BIGINT,
+            PRIMARY KEY (user_id, track_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS agg_watermark (
+            load_date DATE,
+            fact_rows BIGINT,
+            materialized_at TIMESTAMP,
+            PRIMARY KEY (load_date)
+        );
+        """,
+    ]),
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            run_id VARCHAR,
+            stage VARCHAR,
+            data_date DATE,
+            status VARCHAR,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            duration_seconds DOUBLE,
+            rows BIGINT,
+            bytes BIGINT,
+            metrics VARCHAR,
+            PRIMARY KEY (run_id, stage)
+        );
+        """,
+    ]),
+    # The genre of each listen is kept as of its load, so that a reload retracts exactly what was counted
+    (5, [
+        "ALTER TABLE fact_listen_history ADD COLUMN IF NOT EXISTS genre VARCHAR;",
+        """
+        UPDATE fact_listen_history AS f
+        SET genre = coalesce((SELECT t.genres FROM dim_tracks t WHERE t.track_id = f.track_id), 'Unknown');
+        """,
+        "DELETE FROM agg_user_genre_counts;",
+        """
+        INSERT INTO agg_user_genre_counts (user_id, genre, listen_count)
+        SELECT user_id, genre, count(*)
+        FROM fact_listen_history
+        WHERE load_date IN (SELECT load_date FROM agg_watermark)
+        GROUP BY ALL;
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+# Aggregates maintained from fact_listen_history: key columns and the per-load-date delta query.
+# Each delta counts the listens of the load dates listed in the agg_pending_dates temp table.
+AGGREGATES = {
+    'agg_user_genre_counts': (['user_id', 'genre'], """
+        SELECT f.user_id, f.genre, count(*) AS listen_count
+        FROM fact_listen_history f
+        JOIN agg_pending_dates p USING (load_date)
+        GROUP BY ALL
+    """),
+    'agg_track_play_counts': (['track_id'], """
+        SELECT f.track_id, count(*) AS listen_count
+        FROM fact_listen_history f
+        JOIN agg_pending_dates p USING (load_date)
+        GROUP BY ALL
+    """),
+    'agg_user_track_counts': (['user_id', 'track_id'], """
+        SELECT f.user_id, f.track_id, count(*) AS listen_count
+        FROM fact_listen_history f
+        JOIN agg_pending_dates p USING (load_date)
+        GROUP BY ALL
+    """),
+}
+
+FACT_COLUMNS = ('user_id', 'track_id', 'listened_at', 'load_date')
+FACT_ROW_GROUP_SIZE = 122_880
+
+# Raw files live under <raw_dir>/<YYYY-MM-DD>/<table>.parquet: the directory is the partition column
+DATE_DIR_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+LOAD_DATE_FROM_FILENAME = r"CAST(regexp_extract(filename, '(\d{4}-\d{2}-\d{2})[/\\][^/\\]+$', 1) AS DATE)"
+
+# Read-only snapshots published after each load: <snapshot_dir>/moovitamix-<version>.duckdb,
+# the latest one named in <snapshot_dir>/CURRENT
+SNAPSHOT_MARKER = 'CURRENT'
+DEFAULT_SNAPSHOT_DIR = os.path.join('data', 'duckdb_snapshots')
+SNAPSHOT_PREFIX = 'moovitamix-'
+# Snapshots kept: readers still holding the previous one can finish their queries
+SNAPSHOTS_KEPT = 2
+
+def current_snapshot(snapshot_dir: str) -> Optional[str]:
+    """Path of the latest published snapshot, or None if none was published yet"""
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_MARKER)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir, name) if name else None
+
 class DuckDBLoader:
-    def __init__(self, db_path: str = "moovitamix.duckdb"):
+    def __init__(self, db_path: str = "moovitamix.duckdb", raw_dir: str = os.path.join('data', 'raw'),
+                 scd2: bool = False, fact_parquet_dir: Optional[str] = None,
+                 metrics: Optional[PipelineMetrics] = None, snapshot_dir: Optional[str] = None):
         """Initialize DuckDB connection and create schema"""
         self.db_path = db_path
+        self.raw_dir = raw_dir
+        # Optional hive-partitioned (load_date=YYYY-MM-DD) parquet copy of fact_listen_history
+        self.fact_parquet_dir = fact_parquet_dir
+        # Optional directory of read-only copies of the database, published after each load
+        self.snapshot_dir = snapshot_dir
+        # Keep SCD2 validity ranges of the dimensions in the *_history tables
+        self.scd2 = scd2
+        # Seconds spent on each table (and on the aggregates) by the last load
+        self.last_timings: Dict[str, float] = {}
+        # Per-table load time and row counts of the run
+        self.metrics = metrics or PipelineMetrics('load')
         self.conn = duckdb.connect(db_path)
         self._create_schema()
     
     def _create_schema(self):
-        """Create the database schema if it doesn't exist"""
+        """Apply the pending schema migrations; existing tables and data are kept"""
         try:
-            # Drop existing tables if they exist
-            self.conn.execute("DROP TABLE IF EXISTS dim_tracks;")
-            self.conn.execute("DROP TABLE IF EXISTS dim_users;")
-            self.conn.execute("DROP TABLE IF EXISTS fact_listen_history;")
-            
-            # Create dimensions tables
             self.conn.execute("""
-                CREATE TABLE dim_tracks (
-                    track_id INTEGER,
-                    name VARCHAR,
-                    artist VARCHAR,
-                    songwriters VARCHAR,
-                    duration VARCHAR,
-                    genres VARCHAR,
-                    album VARCHAR,
-                    created_at TIMESTAMP,
-                    updated_at TIMESTAMP,
-                    etl_updated_at TIMESTAMP,
-                    PRIMARY KEY (track_id)
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMP
                 );
             """)
+            current = self.conn.execute("SELECT coalesce(max(version), 0) FROM schema_version;").fetchone()[0]
 
-            self.conn.execute("""
-                CREATE TABLE dim_users (
-                    user_id INTEGER,
-                    first_name VARCHAR,
-                    last_name VARCHAR,
-                    email VARCHAR,
-                    gender VARCHAR,
-                    favorite_genres VARCHAR,
-                    created_at TIMESTAMP,
-                    updated_at TIMESTAMP,
-                    etl_updated_at TIMESTAMP,
-                    PRIMARY KEY (user_id)
-                );
-            """)
-
-            self.conn.execute("""
-                CREATE TABLE fact_listen_history (
-                    user_id INTEGER,
-                    track_id INTEGER,
-                    listened_at TIMESTAMP,
-                    load_date DATE
-                );
-            """)
+            for version, statements in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                self.conn.execute("BEGIN TRANSACTION;")
+                try:
+                    for statement in statements:
+                        self.conn.execute(statement)
+                    self.conn.execute("INSERT INTO schema_version VALUES ($1, now());", [version])
+                    self.conn.execute("COMMIT;")
+                except Exception:
+                    self.conn.execute("ROLLBACK;")
+                    raise
+                logger.info(f"Applied schema migration {version}")
 
-            logger.info("Schema created successfully")
+            logger.info(f"Schema is at version {SCHEMA_VERSION}")
 
         except Exception as e:
             logger.error(f"Error creating schema: {str(e)}")
             raise
 
-    def load_daily_data(self, data_date: Optional[str] = None):
-        """Load daily data from parquet files into DuckDB"""
-        if data_date is None:
-            data_date = datetime.now().strftime('%Y-%m-%d')
-            
-        data_dir = os.path.join('data', 'raw', data_date)
-        
-        logger.info(f"Starting data load for {data_date}")
-        
+    def _stage_dimension(self, name: str, paths: List[str]):
+        """Stage every version of a dimension found in the raw files, one row per key and load date"""
+        dimension = DIMENSIONS[name]
+        columns = dimension['columns']
+        hashed = ", ".join(f"coalesce(CAST({column} AS VARCHAR), '')" for column in columns)
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE stg_{name}_all AS
+            SELECT
+                CAST(id AS INTEGER) AS {dimension['key']},
+                {", ".join(columns)},
+                CAST(created_at AS TIMESTAMP) AS created_at,
+                CAST(updated_at AS TIMESTAMP) AS updated_at,
+                md5(concat_ws('|', {hashed})) AS row_hash,
+                {LOAD_DATE_FROM_FILENAME} AS load_date
+            FROM read_parquet($1, filename = true, union_by_name = true)
+            QUALIFY row_number() OVER (
+                PARTITION BY id, load_date ORDER BY CAST(updated_at AS TIMESTAMP) DESC
+            ) = 1;
+        """, [paths])
+        # The latest version of each key is the one merged into the dimension
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE stg_{name} AS
+            SELECT * FROM stg_{name}_all
+            QUALIFY row_number() OVER (
+                PARTITION BY {dimension['key']} ORDER BY load_date DESC, updated_at DESC
+            ) = 1;
+        """)
+
+    def _upsert_dimension(self, name: str) -> int:
+        """Upsert the staged rows of a dimension, only touching new or changed rows"""
+        dimension = DIMENSIONS[name]
+        table, key = dimension['table'], dimension['key']
+        columns = dimension['columns'] + ['created_at', 'updated_at']
+        changed = " OR ".join(f"{table}.{column} IS DISTINCT FROM excluded.{column}" for column in columns)
+        return self.conn.execute(f"""
+            INSERT INTO {table} ({key}, {", ".join(columns)}, etl_updated_at)
+            SELECT {key}, {", ".join(columns)}, now() AS etl_updated_at
+            FROM stg_{name}
+            ON CONFLICT ({key}) DO UPDATE SET
+                {", ".join(f"{column} = excluded.{column}" for column in columns)},
+                etl_updated_at = excluded.etl_updated_at
+            WHERE {changed};
+        """).fetchone()[0]
+
+    def _apply_scd2(self, name: str) -> int:
+        """Record the staged versions that differ from the previous one as SCD2 validity ranges"""
+        dimension = DIMENSIONS[name]
+        table, key = f"{dimension['table']}_history", dimension['key']
+        columns = dimension['columns'] + ['created_at', 'updated_at']
+        # Order the staged versions after the current one and keep the actual changes
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE stg_{name}_versions AS
+            WITH combined AS (
+                SELECT {key}, {", ".join(columns)}, row_hash, load_date, false AS is_existing
+                FROM stg_{name}_all
+                UNION ALL
+                SELECT {key}, {", ".join(columns)}, row_hash, DATE '0001-01-01', true
+                FROM {table}
+                WHERE is_current
+            )
+            SELECT * EXCLUDE (previous_hash, is_existing)
+            FROM (
+                SELECT *, lag(row_hash) OVER (PARTITION BY {key} ORDER BY load_date) AS previous_hash
+                FROM combined
+            )
+            WHERE NOT is_existing AND row_hash IS DISTINCT FROM previous_hash;
+        """)
+        self.conn.execute(f"""
+            UPDATE {table} AS h
+            SET valid_to = v.first_valid_from, is_current = false
+            FROM (
+                SELECT {key}, min_by(updated_at, load_date) AS first_valid_from
+                FROM stg_{name}_versions
+                GROUP BY {key}
+            ) v
+            WHERE h.{key} = v.{key} AND h.is_current;
+        """)
+        versions = self.conn.execute(f"""
+            INSERT INTO {table} ({key}, {", ".join(columns)}, row_hash, valid_from, valid_to, is_current)
+            SELECT
+                {key}, {", ".join(columns)}, row_hash,
+                updated_at AS valid_from,
+                lead(updated_at) OVER w AS valid_to,
+                lead(updated_at) OVER w IS NULL AS is_current
+            FROM stg_{name}_versions
+            WINDOW w AS (PARTITION BY {key} ORDER BY load_date);
+        """).fetchone()[0]
+        self.conn.execute(f"DROP TABLE stg_{name}_versions;")
+        return versions
+
+    def _load_dimension(self, name: str, paths: List[str]) -> int:
+        """Stage and merge the raw files of one dimension"""
+        self._stage_dimension(name, paths)
+        changed = self._upsert_dimension(name)
+        if self.scd2:
+            versions = self._apply_scd2(name)
+            logger.info(f"Opened {versions} new {name} history versions")
+        self.conn.execute(f"DROP TABLE stg_{name};")
+        self.conn.execute(f"DROP TABLE stg_{name}_all;")
+        return changed
+
+    def _load_facts(self, paths: List[str]) -> int:
+        """Replace the listen history of the load dates covered by the raw files
+
+        Rows are inserted sorted on (load_date, listened_at), so the min/max
+        statistics of each row group are narrow and date-window filters can
+        skip most of them. Each listen keeps the genre of its track at load
+        time: run after the dimensions are upserted.
+        """
+        self.conn.execute(f"""
+            DELETE FROM fact_listen_history
+            WHERE load_date IN (
+                SELECT DISTINCT {LOAD_DATE_FROM_FILENAME}
+                FROM read_parquet($1, filename = true)
+            );
+        """, [paths])
+        return self.conn.execute(f"""
+            INSERT INTO fact_listen_history (user_id, track_id, listened_at, load_date, genre)
+            SELECT h.user_id, h.track_id, h.listened_at, h.load_date, coalesce(t.genres, 'Unknown') as genre
+            FROM (
+                SELECT
+                    user_id,
+                    unnest(items) as track_id,
+                    CAST(created_at AS TIMESTAMP) as listened_at,
+                    {LOAD_DATE_FROM_FILENAME} as load_date
+                FROM read_parquet($1, filename = true)
+            ) h
+            LEFT JOIN dim_tracks t USING (track_id)
+            ORDER BY load_date, listened_at, user_id;
+        """, [paths]).fetchone()[0]
+
+    def _retract_aggregates(self, paths: List[str]):
+        """Take the materialized listens of the load dates covered by the raw files out of the aggregates
+
+        Run before the facts are replaced: the deltas count the stored fact
+        rows, genre included, so exactly what was added is taken out.
+        """
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE agg_pending_dates AS
+            SELECT load_date FROM agg_watermark
+            WHERE load_date IN (
+                SELECT DISTINCT {LOAD_DATE_FROM_FILENAME}
+                FROM read_parquet($1, filename = true)
+            );
+        """, [paths])
+        self._apply_aggregate_deltas(retract=True)
+        self.conn.execute("DELETE FROM agg_watermark WHERE load_date IN (SELECT load_date FROM agg_pending_dates);")
+        self.conn.execute("DROP TABLE agg_pending_dates;")
+
+    def _apply_aggregate_deltas(self, retract: bool = False):
+        """Add (or retract) the listens of the agg_pending_dates load dates to every aggregate"""
+        for table, (keys, delta) in AGGREGATES.items():
+            if retract:
+                self.conn.execute(f"""
+                    UPDATE {table} AS a
+                    SET listen_count = a.listen_count - d.listen_count
+                    FROM ({delta}) d
+                    WHERE {" AND ".join(f"a.{key} = d.{key}" for key in keys)};
+                """)
+                self.conn.execute(f"DELETE FROM {table} WHERE listen_count <= 0;")
+            else:
+                self.conn.execute(f"""
+                    INSERT INTO {table} ({", ".join(keys)}, listen_count)
+                    {delta}
+                    ON CONFLICT ({", ".join(keys)}) DO UPDATE
+                    SET listen_count = {table}.listen_count + excluded.listen_count;
+                """)
+
+    def materialize_aggregates(self) -> List[str]:
+        """Fold the listens of not yet materialized load dates into the aggregate tables
+
+        The materialized load dates are recorded in agg_watermark, so running
+        this again without new data has no effect. Returns the dates applied.
+        """
+        self.conn.execute("""
+            CREATE OR REPLACE TEMP TABLE agg_pending_dates AS
+            SELECT load_date, count(*) AS fact_rows
+            FROM fact_listen_history
+            WHERE load_date NOT IN (SELECT load_date FROM agg_watermark)
+            GROUP BY load_date;
+        """)
+        pending = [
+            row[0].strftime('%Y-%m-%d')
+            for row in self.conn.execute("SELECT load_date FROM agg_pending_dates ORDER BY load_date;").fetchall()
+        ]
+        if pending:
+            self._apply_aggregate_deltas()
+            self.conn.execute("""
+                INSERT INTO agg_watermark (load_date, fact_rows, materialized_at)
+                SELECT load_date, fact_rows, now() FROM agg_pending_dates;
+            """)
+            logger.info(f"Materialized aggregates for {len(pending)} load dates")
+        self.conn.execute("DROP TABLE agg_pending_dates;")
+        return pending
+
+    def _load_dates(self, data_dates: List[str]) -> Dict[str, int]:
+        """Load the raw files of several dates in one transaction, one statement per table"""
+        loaded = {}
+        self.last_timings = {}
         try:
             # Start transaction
             self.conn.execute("BEGIN TRANSACTION;")
-            
-            # Load tracks
-            tracks_path = os.path.join(data_dir, 'tracks.parquet')
-            if os.path.exists(tracks_path):
-                # Direct insert for tracks
-                self.conn.execute("""
-                    INSERT INTO dim_tracks 
-                    SELECT 
-                        id as track_id,
-                        name,
-                        artist,
-                        songwriters,
-                        duration,
-                        genres,
-                        album,
-                        created_at,
-                        updated_at,
-                        now() as etl_updated_at
-                    FROM read_parquet($1);
-                """, [tracks_path])
-                logger.info("Tracks loaded successfully")
-            else:
-                logger.warning(f"Tracks file not found: {tracks_path}")
-
-            # Load users
-            users_path = os.path.join(data_dir, 'users.parquet')
-            if os.path.exists(users_path):
-                # Direct insert for users
-                self.conn.execute("""
-                    INSERT INTO dim_users 
-                    SELECT 
-                        id as user_id,
-                        first_name,
-                        last_name,
-                        email,
-                        gender,
-                        favorite_genres,
-                        created_at,
-                        updated_at,
-                        now() as etl_updated_at
-                    FROM read_parquet($1);
-                """, [users_path])
-                logger.info("Users loaded successfully")
-            else:
-                logger.warning(f"Users file not found: {users_path}")
-
-            # Load listen history
-            history_path = os.path.join(data_dir, 'listen_history.parquet')
-            if os.path.exists(history_path):
-                self.conn.execute("""
-                    INSERT INTO fact_listen_history (user_id, track_id, listened_at, load_date)
-                    SELECT 
-                        h.user_id,
-                        unnest(h.items) as track_id,
-                        h.created_at as listened_at,
-                        current_date as load_date
-                    FROM read_parquet($1) h;
-                """, [history_path])
-                logger.info("Listen history loaded successfully")
-            else:
-                logger.warning(f"Listen history file not found: {history_path}")
+
+            # Facts of already materialized dates are about to be replaced: take them out of the aggregates
+            fact_paths = [os.path.join(self.raw_dir, data_date, 'listen_history.parquet') for data_date in data_dates]
+            fact_paths = [path for path in fact_paths if os.path.exists(path)]
+            if fact_paths:
+                self._retract_aggregates(fact_paths)
+
+            for name in list(DIMENSIONS) + ['listen_history']:
+                paths = [os.path.join(self.raw_dir, data_date, f'{name}.parquet') for data_date in data_dates]
+                missing = [path for path in paths if not os.path.exists(path)]
+                for path in missing:
+                    logger.warning(f"{name} file not found: {path}")
+                paths = [path for path in paths if path not in missing]
+                if not paths:
+                    continue
+
+                started = time.perf_counter()
+                if name in DIMENSIONS:
+                    loaded[name] = self._load_dimension(name, paths)
+                else:
+                    loaded[name] = self._load_facts(paths)
+                self.last_timings[name] = time.perf_counter() - started
+                logger.info(f"{name} loaded successfully from {len(paths)} files ({loaded[name]} rows inserted or updated)")
+
+            # Keep the aggregates in step with the facts, in the same transaction
+            started = time.perf_counter()
+            self.materialize_aggregates()
+            self.last_timings['aggregates'] = time.perf_counter() - started
 
             # Commit transaction
             self.conn.execute("COMMIT;")
-            logger.info(f"Successfully loaded data for {data_date}")
             
         except Exception as e:
             logger.error(f"Error loading data: {str(e)}")
@@ -156,6 +516,140 @@ class DuckDBLoader:
                 logger.error(f"Error during rollback: {str(rollback_error)}")
             raise e
 
+        for name, seconds in self.last_timings.items():
+            self.metrics.inc('load_seconds_total', seconds, table=name)
+        for name, rows in loaded.items():
+            self.metrics.inc('rows_loaded_total', rows, table=name)
+
+        if self.fact_parquet_dir and 'listen_history' in loaded:
+            self.export_fact_partitions(data_dates)
+        if self.snapshot_dir:
+            self.publish_snapshot()
+        return loaded
+
+    def publish_snapshot(self) -> str:
+        """Copy the committed database into snapshot_dir and mark it as current, returning its version"""
+        if not self.snapshot_dir:
+            raise ValueError("snapshot_dir is not configured")
+        if self.db_path == ':memory:':
+            raise ValueError("An in-memory database cannot be snapshotted")
+
+        # Readers never open the loader's file: DuckDB locks it against other processes
+        self.conn.execute("CHECKPOINT;")
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        snapshot_name = f"{SNAPSHOT_PREFIX}{version}.duckdb"
+        snapshot_path = os.path.join(self.snapshot_dir, snapshot_name)
+        shutil.copyfile(self.db_path, f"{snapshot_path}.tmp")
+        os.replace(f"{snapshot_path}.tmp", snapshot_path)
+
+        marker_path = os.path.join(self.snapshot_dir, SNAPSHOT_MARKER)
+        with open(f"{marker_path}.tmp", 'w') as f:
+            f.write(snapshot_name)
+        os.replace(f"{marker_path}.tmp", marker_path)
+
+        snapshots = sorted(
+            entry for entry in os.listdir(self.snapshot_dir)
+            if entry.startswith(SNAPSHOT_PREFIX) and entry.endswith('.duckdb')
+        )
+        for entry in snapshots[:-SNAPSHOTS_KEPT]:
+            os.remove(os.path.join(self.snapshot_dir, entry))
+        logger.info(f"Published snapshot {snapshot_path}")
+        return version
+
+    def load_daily_data(self, data_date: Optional[str] = None) -> Dict[str, int]:
+        """Load daily data from parquet files into DuckDB, returning the rows touched per table"""
+        if data_date is None:
+            data_date = datetime.now().strftime('%Y-%m-%d')
+            
+        logger.info(f"Starting data load for {data_date}")
+        loaded = self._load_dates([data_date])
+        logger.info(f"Successfully loaded data for {data_date}")
+        return loaded
+
+    def available_dates(self, start_date: str, end_date: str) -> List[str]:
+        """List the raw data directories dated within [start_date, end_date]"""
+        if not os.path.isdir(self.raw_dir):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.raw_dir)
+            if DATE_DIR_PATTERN.fullmatch(entry) and start_date <= entry <= end_date
+            and os.path.isdir(os.path.join(self.raw_dir, entry))
+        )
+
+    def backfill(self, start_date: str, end_date: str) -> Dict[str, int]:
+        """Load every raw date within [start_date, end_date] as one partitioned dataset"""
+        data_dates = self.available_dates(start_date, end_date)
+        if not data_dates:
+            logger.warning(f"No raw data found between {start_date} and {end_date}")
+            return {}
+
+        logger.info(f"Starting backfill of {len(data_dates)} dates from {data_dates[0]} to {data_dates[-1]}")
+        loaded = self._load_dates(data_dates)
+        logger.info(f"Successfully backfilled data from {start_date} to {end_date}")
+        return loaded
+
+    def export_fact_partitions(self, data_dates: List[str]):
+        """Rewrite the parquet partitions of fact_listen_history for the given load dates"""
+        if not self.fact_parquet_dir:
+            raise ValueError("fact_parquet_dir is not configured")
+
+        for data_date in data_dates:
+            if not DATE_DIR_PATTERN.fullmatch(data_date):
+                raise ValueError(f"Invalid load date: {data_date}")
+            partition_dir = os.path.join(self.fact_parquet_dir, f"load_date={data_date}")
+            if os.path.isdir(partition_dir):
+                shutil.rmtree(partition_dir)
+            count = self.conn.execute(
+                "SELECT count(*) FROM fact_listen_history WHERE load_date = CAST($1 AS DATE);", [data_date]
+            ).fetchone()[0]
+            if count == 0:
+                continue
+
+            os.makedirs(partition_dir)
+            partition_path = os.path.join(partition_dir, 'data.parquet').replace("'", "''")
+            # COPY does not take prepared parameters: the date is validated against DATE_DIR_PATTERN
+            self.conn.execute(f"""
+                COPY (
+                    SELECT user_id, track_id, listened_at
+                    FROM fact_listen_history
+                    WHERE load_date = DATE '{data_date}'
+                    ORDER BY listened_at, user_id
+                ) TO '{partition_path}' (FORMAT PARQUET, ROW_GROUP_SIZE {FACT_ROW_GROUP_SIZE});
+            """)
+            logger.info(f"Exported {count} listen history rows to {partition_path}")
+
+    def query_listen_history(self, start_date: str, end_date: str, columns: Optional[List[str]] = None,
+                             source: str = 'table') -> pa.Table:
+        """Read the listen history of load dates within [start_date, end_date]
+
+        With source='table' the filter is answered from the sorted DuckDB table,
+        whose row-group min/max statistics let the scan skip other dates. With
+        source='parquet' only the matching load_date partitions of the parquet
+        layer are opened, and their row groups are pruned on statistics too.
+        """
+        columns = columns or ['user_id', 'track_id', 'listened_at', 'load_date']
+        unknown = set(columns) - set(FACT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown listen history columns: {sorted(unknown)}")
+
+        if source == 'table':
+            relation = "fact_listen_history"
+        elif source == 'parquet':
+            if not self.fact_parquet_dir:
+                raise ValueError("fact_parquet_dir is not configured")
+            pattern = os.path.join(self.fact_parquet_dir, 'load_date=*', '*.parquet').replace("'", "''")
+            relation = f"read_parquet('{pattern}', hive_partitioning = true, hive_types = {{'load_date': DATE}})"
+        else:
+            raise ValueError(f"Unknown source: {source}")
+
+        return self.conn.execute(f"""
+            SELECT {", ".join(columns)}
+            FROM {relation}
+            WHERE load_date BETWEEN CAST($1 AS DATE) AND CAST($2 AS DATE)
+            ORDER BY load_date, listened_at, user_id;
+        """, [start_date, end_date]).to_arrow_table()
+
     def verify_data(self):
         """Verify that data was loaded correctly"""
         try:
@@ -170,6 +664,8 @@ class DuckDBLoader:
                        f"Tracks: {counts[0]}\n"
                        f"Users: {counts[1]}\n"
                        f"Listen History: {counts[2]}")
+            for table, count in zip(['dim_tracks', 'dim_users', 'fact_listen_history'], counts):
+                self.metrics.set('table_rows', count, table=table)
             
             # Show sample data
             logger.info("\nSample tracks:")
@@ -181,24 +677,69 @@ class DuckDBLoader:
             logger.error(f"Error verifying data: {str(e)}")
             raise
 
+    def record_run(self, metrics: PipelineMetrics, data_date: Optional[str] = None):
+        """Write a pipeline run and its metrics to pipeline_runs, replacing a previous record of it"""
+        rows = metrics.total('rows_extracted_total') + metrics.total('rows_loaded_total')
+        self.conn.execute("""
+            INSERT OR REPLACE INTO pipeline_runs
+            VALUES ($1, $2, CAST($3 AS DATE), $4, $5, $6, $7, $8, $9, $10);
+        """, [
+            metrics.run_id, metrics.stage, data_date, metrics.status,
+            metrics.started_at, metrics.finished_at, metrics.duration_seconds,
+            int(rows), int(metrics.total('bytes_extracted_total')), json.dumps(metrics.to_dict()),
+        ])
+        logger.info(f"Recorded {metrics.stage} run {metrics.run_id} ({metrics.status})")
+
     def close(self):
         """Close the database connection"""
         if self.conn:
             self.conn.close()
             logger.info("Database connection closed")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load raw MooVitamix parquet files into DuckDB")
+    parser.add_argument('--date', help="Date to load (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--start', help="First date of a backfill (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Last date of a backfill (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--db-path', default="moovitamix.duckdb", help="DuckDB database file")
+    parser.add_argument('--raw-dir', default=os.path.join('data', 'raw'), help="Root of the raw date directories")
+    parser.add_argument('--scd2', action='store_true', help="Keep SCD2 history of the dimensions")
+    parser.add_argument('--snapshot-dir', help="Publish a read-only copy of the database here after the load")
+    parser.add_argument('--metrics-dir', default=DEFAULT_METRICS_DIR,
+                        help="Where run metrics are read (extract) and written (Prometheus text files)")
+    return parser.parse_args(argv)
+
+def record_runs(loader: DuckDBLoader, metrics_dir: str, data_date: Optional[str]):
+    """Record the load run and the extract run of the same date, if its metrics were saved"""
+    extract_path = os.path.join(metrics_dir, 'runs', data_date or '', 'extract.json')
+    if data_date and os.path.exists(extract_path):
+        loader.record_run(PipelineMetrics.load_json(extract_path), data_date)
+    loader.record_run(loader.metrics, data_date)
+    loader.metrics.write_prometheus(os.path.join(metrics_dir, 'load.prom'))
+
+def main(argv=None):
+    args = parse_args(argv)
     loader = None
+    data_date = None if args.start else (args.date or datetime.now().strftime('%Y-%m-%d'))
     try:
-        loader = DuckDBLoader()
-        loader.load_daily_data()
-        loader.verify_data()
+        loader = DuckDBLoader(db_path=args.db_path, raw_dir=args.raw_dir, scd2=args.scd2,
+                              snapshot_dir=args.snapshot_dir)
+        with loader.metrics.run():
+            if args.start:
+                loader.backfill(args.start, args.end or datetime.now().strftime('%Y-%m-%d'))
+            else:
+                loader.load_daily_data(data_date)
+            loader.verify_data()
         return 0
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
         return 1
     finally:
         if loader:
+            try:
+                record_runs(loader, args.metrics_dir, data_date)
+            except Exception as e:
+                logger.error(f"Error recording pipeline run: {str(e)}")
             loader.close()
 
 if __name__ == "__main__":
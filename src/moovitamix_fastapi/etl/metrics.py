@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'moovitamix_'
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_METRICS_DIR = os.path.join('data', 'metrics')
+
+# Help text of the known metrics, shown in the Prometheus file
+METRIC_HELP = {
+    'request_seconds': 'Latency of API page requests',
+    'pages_fetched_total': 'API pages fetched',
+    'request_retries_total': 'API page requests retried, per cause',
+    'concurrency_limit': 'Adaptive limit on concurrent API page requests',
+    'rows_extracted_total': 'Rows extracted from the API',
+    'bytes_extracted_total': 'Response bytes received from the API',
+    'parquet_write_seconds_total': 'Time spent writing raw parquet files',
+    'validation_seconds_total': 'Time spent validating extracted pages',
+    'rows_rejected_total': 'Extracted rows quarantined by validation, per failed check',
+    'load_seconds_total': 'Time spent loading a table into DuckDB',
+    'rows_loaded_total': 'Rows inserted or updated in a DuckDB table',
+    'table_rows': 'Rows in a DuckDB table after the run',
+    'run_duration_seconds': 'Wall time of the pipeline run',
+    'run_finished_timestamp_seconds': 'Unix time at which the pipeline run finished',
+    'run_success': '1 if the pipeline run succeeded, 0 otherwise',
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            total += count
+            yield _format_value(bound), total
+        yield '+Inf', self.count
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'buckets': list(self.buckets),
+            'bucket_counts': self.bucket_counts,
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Histogram':
+        histogram = cls(tuple(data['buckets']))
+        histogram.bucket_counts = list(data['bucket_counts'])
+        histogram.sum = data['sum']
+        histogram.count = data['count']
+        return histogram
+
+
+class PipelineMetrics:
+    """Counters, gauges and histograms of one pipeline run, labelled per endpoint or table
+
+    A run is identified by ``run_id`` and the ``stage`` it covers (extract,
+    load...). It can be written as a Prometheus text file and is recorded in
+    the ``pipeline_runs`` table by ``DuckDBLoader.record_run``.
+    """
+
+    def __init__(self, stage: str, run_id: Optional[str] = None):
+        self.stage = stage
+        self.run_id = run_id or uuid.uuid4().hex
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.status = 'pending'
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add value to a counter"""
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge"""
+        with self._lock:
+            self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record one value in a histogram"""
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def merge(self, other: 'PipelineMetrics'):
+        """Add the metrics of another part of the run (e.g. one extraction shard) to these
+
+        Counters and histograms are summed, gauges take the other's value and
+        the run spans both time ranges.
+        """
+        with self._lock:
+            for name, values in other.counters.items():
+                series = self.counters.setdefault(name, {})
+                for key, value in values.items():
+                    series[key] = series.get(key, 0) + value
+            for name, values in other.gauges.items():
+                self.gauges.setdefault(name, {}).update(values)
+            for name, values in other.histograms.items():
+                series = self.histograms.setdefault(name, {})
+                for key, histogram in values.items():
+                    if key not in series:
+                        series[key] = Histogram(histogram.buckets)
+                    merged = series[key]
+                    if merged.buckets != histogram.buckets:
+                        raise ValueError(f"Cannot merge {name}: different histogram buckets")
+                    merged.bucket_counts = [a + b for a, b in zip(merged.bucket_counts, histogram.bucket_counts)]
+                    merged.sum += histogram.sum
+                    merged.count += histogram.count
+            started = [at for at in (self.started_at, other.started_at) if at is not None]
+            finished = [at for at in (self.finished_at, other.finished_at) if at is not None]
+            self.started_at = min(started) if started else None
+            self.finished_at = max(finished) if finished else None
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Add the time spent in the block to a seconds counter"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def run(self):
+        """Time the whole run and record whether it succeeded"""
+        self.started_at = datetime.now()
+        self.status = 'running'
+        try:
+            yield self
+            self.status = 'success'
+        except Exception:
+            self.status = 'failed'
+            raise
+        finally:
+            self.finished_at = datetime.now()
+
+    @property
+    def duration_seconds(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def total(self, name: str) -> float:
+        """Sum of a counter or gauge over all its labels"""
+        series = self.counters.get(name) or self.gauges.get(name) or {}
+        return sum(series.values())
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        stage = ('stage', self.stage)
+        lines = []
+
+        def header(name, metric_type):
+            full_name = f"{METRIC_PREFIX}{name}"
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            return full_name
+
+        run_gauges = {}
+        if self.duration_seconds is not None:
+            run_gauges['run_duration_seconds'] = self.duration_seconds
+            run_gauges['run_finished_timestamp_seconds'] = self.finished_at.timestamp()
+            run_gauges['run_success'] = 1 if self.status == 'success' else 0
+        for name, value in run_gauges.items():
+            full_name = header(name, 'gauge')
+            lines.append(f"{full_name}{_format_labels((stage,))} {_format_value(value)}")
+
+        with self._lock:
+            for metric_type, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    full_name = header(name, metric_type)
+                    for labels, value in sorted(series.items()):
+                        lines.append(f"{full_name}{_format_labels((stage,) + labels)} {_format_value(value)}")
+
+            for name, series in sorted(self.histograms.items()):
+                full_name = header(name, 'histogram')
+                for labels, histogram in sorted(series.items(), key=lambda item: item[0]):
+                    labels = (stage,) + labels
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', bound))} {count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Atomically write the Prometheus text file (for the node exporter textfile collector)"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote {self.stage} metrics to {path}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        def series(metrics, encode=lambda value: value):
+            return {
+                name: [{'labels': dict(labels), 'value': encode(value)} for labels, value in values.items()]
+                for name, values in metrics.items()
+            }
+
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'stage': self.stage,
+                'status': self.status,
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'counters': series(self.counters),
+                'gauges': series(self.gauges),
+                'histograms': series(self.histograms, Histogram.to_dict),
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PipelineMetrics':
+        metrics = cls(data['stage'], data['run_id'])
+        metrics.status = data['status']
+        metrics.started_at = datetime.fromisoformat(data['started_at']) if data['started_at'] else None
+        metrics.finished_at = datetime.fromisoformat(data['finished_at']) if data['finished_at'] else None
+        for name, values in data['counters'].items():
+            metrics.counters[name] = {_labels(v['labels']): v['value'] for v in values}
+        for name, values in data['gauges'].items():
+            metrics.gauges[name] = {_labels(v['labels']): v['value'] for v in values}
+        for name, values in data['histograms'].items():
+            metrics.histograms[name] = {_labels(v['labels']): Histogram.from_dict(v['value']) for v in values}
+        return metrics
+
+    def save_json(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load_json(cls, path: str) -> 'PipelineMetrics':
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,209 @@
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 100_000
+DEFAULT_COMPRESSION = 'zstd'
+
+# Schemas of the raw files, as served by the API (timestamps are ISO strings)
+RAW_SCHEMAS = {
+    'tracks': pa.schema([
+        ('id', pa.int64()),
+        ('name', pa.string()),
+        ('artist', pa.string()),
+        ('songwriters', pa.string()),
+        ('duration', pa.string()),
+        ('genres', pa.string()),
+        ('album', pa.string()),
+        ('created_at', pa.string()),
+        ('updated_at', pa.string()),
+    ]),
+    'users': pa.schema([
+        ('id', pa.int64()),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('email', pa.string()),
+        ('gender', pa.string()),
+        ('favorite_genres', pa.string()),
+        ('created_at', pa.string()),
+        ('updated_at', pa.string()),
+    ]),
+    'listen_history': pa.schema([
+        ('user_id', pa.int64()),
+        ('items', pa.list_(pa.int64())),
+        ('created_at', pa.string()),
+        ('updated_at', pa.string()),
+    ]),
+}
+
+
+
+class ParquetPolicy:
+    """How a parquet file is written: codec and level, dictionary columns, sort keys and row-group size.
+
+    ``dictionary_columns`` lists the only columns to dictionary-encode (the
+    low-cardinality ones); ``None`` leaves every column to the writer default.
+    ``sort_keys`` order the rows of a whole file (see ``write_parquet``): a
+    stream keeps its arrival order.
+    """
+
+    def __init__(self, compression: str = DEFAULT_COMPRESSION, compression_level: Optional[int] = None,
+                 dictionary_columns: Optional[Sequence[str]] = None, sort_keys: Sequence[str] = (),
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        if row_group_size < 1:
+            raise ValueError("row_group_size must be at least 1")
+        self.compression = compression
+        self.compression_level = compression_level
+        self.dictionary_columns = None if dictionary_columns is None else list(dictionary_columns)
+        self.sort_keys = list(sort_keys)
+        self.row_group_size = row_group_size
+
+    def replace(self, **changes) -> 'ParquetPolicy':
+        """A copy of the policy with some settings changed"""
+        settings = {
+            'compression': self.compression,
+            'compression_level': self.compression_level,
+            'dictionary_columns': self.dictionary_columns,
+            'sort_keys': self.sort_keys,
+            'row_group_size': self.row_group_size,
+        }
+        settings.update(changes)
+        return ParquetPolicy(**settings)
+
+    def writer_options(self, schema: Optional[pa.Schema] = None) -> Dict[str, Any]:
+        """Keyword arguments of pq.ParquetWriter (and pq.write_table) for this policy"""
+        use_dictionary = True
+        if self.dictionary_columns is not None:
+            use_dictionary = [
+                name for name in self.dictionary_columns if schema is None or name in schema.names
+            ]
+        return {
+            'compression': self.compression,
+            'compression_level': self.compression_level,
+            'use_dictionary': use_dictionary,
+        }
+
+    def sort(self, table: pa.Table) -> pa.Table:
+        """Order the rows of a table by the sort keys it holds"""
+        keys = [(name, 'ascending') for name in self.sort_keys if name in table.column_names]
+        return table.sort_by(keys) if keys else table
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'compression': self.compression,
+            'compression_level': self.compression_level,
+            'dictionary_columns': self.dictionary_columns,
+            'sort_keys': self.sort_keys,
+            'row_group_size': self.row_group_size,
+        }
+
+
+# Encoding of the raw files: genres and genders take a few values, and names, artists and
+# albums repeat over many rows; IDs and timestamps are near-unique and left plain
+RAW_POLICIES = {
+    'tracks': ParquetPolicy(dictionary_columns=['genres', 'artist', 'songwriters', 'album'], sort_keys=['id']),
+    'users': ParquetPolicy(dictionary_columns=['gender', 'favorite_genres', 'first_name', 'last_name'],
+                           sort_keys=['id']),
+    'listen_history': ParquetPolicy(dictionary_columns=[], sort_keys=['user_id', 'updated_at']),
+}
+
+
+def raw_policy(name: str) -> ParquetPolicy:
+    """Write policy of a raw file, with the codec overridable from the environment"""
+    policy = RAW_POLICIES.get(name, ParquetPolicy())
+    compression = os.environ.get('MOOVITAMIX_PARQUET_COMPRESSION')
+    level = os.environ.get('MOOVITAMIX_PARQUET_COMPRESSION_LEVEL')
+    if compression:
+        policy = policy.replace(compression=compression, compression_level=None)
+    if level:
+        policy = policy.replace(compression_level=int(level))
+    return policy
+
+
+def write_parquet(table: pa.Table, path: str, policy: ParquetPolicy):
+    """Write a whole table sorted and encoded per the policy, replacing the file atomically"""
+    table = policy.sort(table)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=policy.row_group_size, **policy.writer_options(table.schema))
+    os.replace(tmp_path, path)
+
+
+class ParquetStreamWriter:
+    """Append records to a parquet file one row group at a time.
+
+    Records (or Arrow tables) are buffered until ``row_group_size`` rows are
+    pending, then written as a row group, so memory stays bounded by one row
+    group whatever the size of the file. Without a ``schema``, the schema of
+    the first batch is used for the whole file. The codec and dictionary
+    columns come from ``policy``; rows keep their arrival order.
+    """
+
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None,
+                 row_group_size: Optional[int] = None, policy: Optional[ParquetPolicy] = None):
+        policy = policy or ParquetPolicy()
+        if row_group_size is not None:
+            policy = policy.replace(row_group_size=row_group_size)
+        self.path = path
+        self.schema = schema
+        self.policy = policy
+        self.row_group_size = policy.row_group_size
+        self.rows_written = 0
+        self._pending: List[pa.Table] = []
+        self._pending_rows = 0
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _flush(self, table: pa.Table):
+        """Write a table as one row group"""
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self.schema, **self.policy.writer_options(self.schema))
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows_written += table.num_rows
+
+    def write(self, records: List[Dict[str, Any]]):
+        """Buffer records, writing every full row group"""
+        if records:
+            self.write_table(pa.Table.from_pylist(records, schema=self.schema))
+
+    def write_table(self, table: pa.Table):
+        """Buffer an Arrow table, writing every full row group"""
+        if self.schema is None:
+            self.schema = table.schema
+        elif table.schema != self.schema:
+            table = table.select(self.schema.names).cast(self.schema)
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+
+        if self._pending_rows < self.row_group_size:
+            return
+        pending = pa.concat_tables(self._pending)
+        while pending.num_rows >= self.row_group_size:
+            self._flush(pending.slice(0, self.row_group_size))
+            pending = pending.slice(self.row_group_size)
+        self._pending, self._pending_rows = [pending], pending.num_rows
+
+    def close(self):
+        """Write the remaining records and the file footer"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._pending_rows:
+            pending, self._pending, self._pending_rows = pa.concat_tables(self._pending), [], 0
+            self._flush(pending)
+        if self._writer is None:
+            # Nothing was written: still produce a valid (empty) file
+            schema = self.schema or pa.schema([])
+            self._writer = pq.ParquetWriter(self.path, schema, **self.policy.writer_options(schema))
+        self._writer.close()
+        logger.info(f"Wrote {self.rows_written} records to {self.path}")
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: throttling and transient server errors
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+class RetryPolicy:
+    """Per-request retries with capped, fully jittered exponential backoff.
+
+    Attempt ``n`` (from 1) waits a uniform random time in
+    ``[0, min(max_delay, base_delay * 2 ** (n - 1))]``, so clients failing
+    together do not retry together. A ``Retry-After`` from the server replaces
+    the backoff, capped at ``max_delay``.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 rng: Optional[random.Random] = None):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retrying after the given failed attempt"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+
+def get_with_retries(get: Callable[..., requests.Response], url: str, policy: RetryPolicy,
+                     on_retry: Optional[Callable[[int, str, float], None]] = None, **kwargs) -> requests.Response:
+    """GET with requests, retrying throttled, failed and timed-out requests per the policy.
+
+    ``on_retry(attempt, reason, delay)`` is called before each wait.
+    """
+    attempt = 1
+    while True:
+        retry_after = None
+        try:
+            response = get(url, **kwargs)
+            if response.status_code not in RETRYABLE_STATUS or not policy.should_retry(attempt):
+                response.raise_for_status()
+                return response
+            reason = str(response.status_code)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if not policy.should_retry(attempt):
+                raise
+            reason = type(e).__name__
+        delay = policy.delay(attempt, retry_after)
+        if on_retry is not None:
+            on_retry(attempt, reason, delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on the number of requests in flight.
+
+    Every request answered within ``latency_threshold`` seconds raises the
+    limit by ``1 / limit`` (one more slot per window of healthy requests), up
+    to ``max_limit``; an overloaded or failed request multiplies it by
+    ``backoff``, down to ``min_limit``. Only requests sent after the last
+    decrease can decrease it again, so a burst of failures from one window
+    lowers the limit once.
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int = 1, max_limit: Optional[int] = None,
+                 latency_threshold: float = 1.0, backoff: float = 0.75):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit or initial_limit, initial_limit)
+        self.limit = float(max(min_limit, initial_limit))
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.in_flight = 0
+        self._last_decrease = float('-inf')
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> float:
+        """Wait for a free slot; returns the time the request is sent at"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency <= self.latency_threshold and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self, sent_at: float):
+        if sent_at < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        limit = max(self.min_limit, self.limit * self.backoff)
+        if int(limit) != self.current_limit:
+            logger.info(f"Lowering concurrency from {self.current_limit} to {int(limit)}")
+        self.limit = limit
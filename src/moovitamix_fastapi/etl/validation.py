@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import typing
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.moovitamix_fastapi.classes_out import ListenHistoryOut, TracksOut, UsersOut
+from src.moovitamix_fastapi.etl.parquet_writer import RAW_SCHEMAS, ParquetStreamWriter
+
+logger = logging.getLogger(__name__)
+
+# Model of each extracted resource and its primary key (None: no key)
+RESOURCE_RULES = {
+    'tracks': (TracksOut, 'id'),
+    'users': (UsersOut, 'id'),
+    'listen_history': (ListenHistoryOut, None),
+}
+# Timestamps of the raw files are ISO 8601 strings, with or without a zone offset
+ISO_TIMESTAMP_PATTERN = r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:?\d{2})?$'
+ZONE_OFFSET_PATTERN = r'(Z|[+-]\d{2}:?\d{2})$'
+PARSED_TIMESTAMP = pa.timestamp('us', tz='UTC')
+
+# Schema of the quarantine files: the rejected record as JSON and the checks it failed
+QUARANTINE_SCHEMA = pa.schema([
+    ('record', pa.string()),
+    ('reasons', pa.list_(pa.string())),
+])
+
+Rows = Union[List[Dict[str, Any]], pa.Table]
+ARROW_ERRORS = (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError)
+
+
+def non_nullable_fields(model) -> List[str]:
+    """Fields of a pydantic model whose annotation does not accept None"""
+    return [
+        name for name, field in model.model_fields.items()
+        if type(None) not in typing.get_args(field.annotation)
+    ]
+
+
+def _coerce_column(values: List[Any], data_type: pa.DataType) -> Tuple[pa.Array, np.ndarray]:
+    """Build a typed array, nulling (and flagging) the values of the wrong type"""
+    try:
+        return pa.array(values, data_type), np.zeros(len(values), dtype=bool)
+    except ARROW_ERRORS:
+        pass
+
+    # Slow path, only for a column holding at least one bad value
+    coerced, bad = [], np.zeros(len(values), dtype=bool)
+    for position, value in enumerate(values):
+        try:
+            pa.array([value], data_type)
+            coerced.append(value)
+        except ARROW_ERRORS:
+            coerced.append(None)
+            bad[position] = True
+    return pa.array(coerced, data_type), bad
+
+
+def parse_timestamps(column: pa.ChunkedArray) -> Tuple[pa.ChunkedArray, np.ndarray]:
+    """Parse ISO timestamp strings as UTC; returns the timestamps and the unparseable rows"""
+    well_formed = pc.fill_null(pc.match_substring_regex(column, ISO_TIMESTAMP_PATTERN), True)
+    column = pc.if_else(well_formed, column, pa.scalar(None, pa.string()))
+    # Timestamps without an offset are taken as UTC
+    column = pc.if_else(pc.match_substring_regex(column, ZONE_OFFSET_PATTERN),
+                        column, pc.binary_join_element_wise(column, '+00:00', ''))
+    bad = ~np.asarray(well_formed)
+    try:
+        return pc.cast(column, PARSED_TIMESTAMP), bad
+    except pa.ArrowInvalid:
+        pass
+
+    # Slow path: a well-formed but impossible date (e.g. February 30)
+    parsed = []
+    for position, value in enumerate(column.to_pylist()):
+        try:
+            parsed.append(pc.cast(pa.scalar(value), PARSED_TIMESTAMP))
+        except pa.ArrowInvalid:
+            parsed.append(pa.scalar(None, PARSED_TIMESTAMP))
+            bad[position] = True
+    return pa.chunked_array([pa.array([scalar.value for scalar in parsed], PARSED_TIMESTAMP)]), bad
+
+
+class ValidationReport:
+    """Row counts of the validation of one resource, per failed check"""
+
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.rejected = 0
+        self.reasons: Counter = Counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'valid': self.valid,
+            'rejected': self.rejected,
+            'reasons': {reason: count for reason, count in sorted(self.reasons.items()) if count},
+        }
+
+
+class BatchValidator:
+    """Validate the batches of one resource with vectorized Arrow compute.
+
+    Checks the types of the raw schema, nulls in the non-nullable fields of
+    the resource model, primary-key uniqueness (across every batch),
+    ``updated_at >= created_at`` and, given ``track_ids``, that every listened
+    item is a known track. Each batch is split into a table of its valid rows
+    and the quarantine rows of the rejected ones.
+    """
+
+    def __init__(self, name: str, schema: Optional[pa.Schema] = None, track_ids: Optional[pa.Array] = None):
+        model, self.key = RESOURCE_RULES[name]
+        self.name = name
+        self.schema = schema or RAW_SCHEMAS[name]
+        self.required = [field for field in non_nullable_fields(model) if field in self.schema.names]
+        self.track_ids = track_ids
+        self.report = ValidationReport()
+        self._valid_keys: List[np.ndarray] = []
+
+    def _to_table(self, rows: Rows) -> Tuple[pa.Table, Dict[str, np.ndarray]]:
+        """Build the typed table of a batch, with the mistyped rows of each column"""
+        arrays, type_errors = [], {}
+        for field in self.schema:
+            if isinstance(rows, pa.Table):
+                if field.name not in rows.column_names:
+                    arrays.append(pa.nulls(rows.num_rows, field.type))
+                    continue
+                column = rows.column(field.name)
+                if column.type == field.type:
+                    arrays.append(column)
+                    continue
+                values = column.to_pylist()
+            else:
+                values = [row.get(field.name) for row in rows]
+
+            array, bad = _coerce_column(values, field.type)
+            arrays.append(array)
+            if bad.any():
+                type_errors[field.name] = bad
+        return pa.Table.from_arrays(arrays, schema=self.schema), type_errors
+
+    def _duplicate_keys(self, table: pa.Table) -> np.ndarray:
+        """Rows whose key was already seen, earlier in the batch or in a previous one"""
+        column = table.column(self.key)
+        present = ~np.asarray(pc.is_null(column))
+        keys = column.to_numpy(zero_copy_only=False)[present].astype(np.int64)
+        repeated = np.ones(len(keys), dtype=bool)
+        repeated[np.unique(keys, return_index=True)[1]] = False
+        if self._valid_keys:
+            repeated |= np.isin(keys, self._seen_keys())
+        duplicate = np.zeros(table.num_rows, dtype=bool)
+        duplicate[np.flatnonzero(present)[repeated]] = True
+        return duplicate
+
+    def _seen_keys(self) -> np.ndarray:
+        """The keys of every valid row so far, merged into one array"""
+        if len(self._valid_keys) > 1:
+            self._valid_keys = [np.concatenate(self._valid_keys)]
+        return self._valid_keys[0]
+
+    def _dangling_items(self, table: pa.Table) -> np.ndarray:
+        """Rows listing at least one item that is not a known track"""
+        items = table.column('items')
+        unknown = ~np.asarray(pc.fill_null(pc.is_in(pc.list_flatten(items), value_set=self.track_ids), False))
+        dangling = np.zeros(table.num_rows, dtype=bool)
+        dangling[np.asarray(pc.list_parent_indices(items))[unknown]] = True
+        return dangling
+
+    def validate(self, rows: Rows) -> Tuple[pa.Table, List[Dict[str, Any]]]:
+        """Split a batch into its valid rows (as a table) and its quarantine rows"""
+        table, type_errors = self._to_table(rows)
+        failures: Dict[str, np.ndarray] = {f'type:{name}': bad for name, bad in type_errors.items()}
+
+        for name in self.required:
+            failures[f'null:{name}'] = np.asarray(pc.is_null(table.column(name)))
+
+        if 'created_at' in table.column_names and 'updated_at' in table.column_names:
+            created_at, failures['format:created_at'] = parse_timestamps(table.column('created_at'))
+            updated_at, failures['format:updated_at'] = parse_timestamps(table.column('updated_at'))
+            failures['order:updated_at'] = np.asarray(pc.fill_null(pc.less(updated_at, created_at), False))
+
+        if self.key is not None:
+            failures[f'duplicate:{self.key}'] = self._duplicate_keys(table)
+
+        if self.track_ids is not None and 'items' in table.column_names:
+            failures['reference:items'] = self._dangling_items(table)
+
+        rejected = np.zeros(table.num_rows, dtype=bool)
+        for bad in failures.values():
+            rejected |= bad
+        valid = table.filter(pa.array(~rejected))
+        if self.key is not None:
+            self._valid_keys.append(valid.column(self.key).to_numpy(zero_copy_only=False).astype(np.int64))
+
+        self.report.rows += table.num_rows
+        self.report.valid += valid.num_rows
+        self.report.rejected += int(rejected.sum())
+        for reason, bad in failures.items():
+            self.report.reasons[reason] += int(bad.sum())
+        return valid, self._quarantine_rows(rows, rejected, failures)
+
+    @staticmethod
+    def _quarantine_rows(rows: Rows, rejected: np.ndarray, failures: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """The rejected records as JSON, with the checks they failed"""
+        positions = np.flatnonzero(rejected)
+        if not len(positions):
+            return []
+        if isinstance(rows, pa.Table):
+            records = rows.take(pa.array(positions)).to_pylist()
+        else:
+            records = [rows[position] for position in positions]
+        return [
+            {
+                'record': json.dumps(record, default=str),
+                'reasons': [reason for reason, bad in failures.items() if bad[position]],
+            }
+            for position, record in zip(positions, records)
+        ]
+
+    def valid_keys(self) -> pa.Array:
+        """The keys of every valid row so far"""
+        if not self._valid_keys:
+            return pa.array([], pa.int64())
+        return pa.array(self._seen_keys(), pa.int64())
+
+
+class QuarantineWriter:
+    """Validate the batches of a resource, appending the rejected rows to its quarantine file.
+
+    The quarantine file of a previous run is removed, and a new one is only
+    created once a row is rejected.
+    """
+
+    def __init__(self, validator: BatchValidator, path: str):
+        self.validator = validator
+        self.path = path
+        self._writer: Optional[ParquetStreamWriter] = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    def validate(self, rows: Rows) -> pa.Table:
+        """Return the valid rows of a batch, quarantining the others"""
+        valid, quarantine = self.validator.validate(rows)
+        if quarantine:
+            if self._writer is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._writer = ParquetStreamWriter(self.path, QUARANTINE_SCHEMA)
+            self._writer.write(quarantine)
+        return valid
+
+    def close(self) -> ValidationReport:
+        """Close the quarantine file and log the validation report"""
+        if self._writer is not None:
+            self._writer.close()
+        report = self.validator.report
+        if report.rejected:
+            reasons = ', '.join(f"{reason}={count}" for reason, count in report.to_dict()['reasons'].items())
+            logger.warning(f"{self.validator.name}: {report.rejected} of {report.rows} rows "
+                           f"quarantined to {self.path} ({reasons})")
+        else:
+            logger.info(f"{self.validator.name}: all {report.rows} rows passed validation")
+        return report
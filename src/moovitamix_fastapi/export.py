@@ -0,0 +1,142 @@
+"""
+Streaming bulk export of the served datasets.
+
+Rows are converted into Arrow record batches one batch at a time and each
+batch is encoded and yielded as soon as it is ready, so a full export never
+builds the whole response body in memory.
+"""
+
+import json
+from enum import Enum
+from typing import Iterable, Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Default and maximum number of rows per exported record batch.
+DEFAULT_EXPORT_BATCH_SIZE = 10000
+MAX_EXPORT_BATCH_SIZE = 100000
+
+
+class ExportFormat(str, Enum):
+    arrow = "arrow"
+    ndjson = "ndjson"
+    parquet = "parquet"
+
+
+MEDIA_TYPES = {
+    ExportFormat.arrow: "application/vnd.apache.arrow.stream",
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.parquet: "application/vnd.apache.parquet",
+}
+
+FILE_EXTENSIONS = {
+    ExportFormat.arrow: "arrows",
+    ExportFormat.ndjson: "ndjson",
+    ExportFormat.parquet: "parquet",
+}
+
+
+class _ChunkSink:
+    """Write-only file object that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.closed = False
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_table_batches(table: pa.Table, schema: pa.Schema, batch_size: int) -> Iterator[pa.RecordBatch]:
+    """
+    Split an Arrow table into record batches of ``batch_size`` rows.
+
+    Each batch is cast to ``schema`` on its own, so dictionary-encoded columns
+    are decoded one batch at a time.
+
+    Args:
+        table (pa.Table): The rows to split.
+        schema (pa.Schema): The schema of the batches.
+        batch_size (int): The maximum number of rows per batch.
+
+    Yields:
+        pa.RecordBatch: The batches, in row order.
+
+    """
+    for start in range(0, table.num_rows, batch_size):
+        chunk = table.slice(start, batch_size).cast(schema).combine_chunks()
+        yield from chunk.to_batches()
+
+
+def _encode_arrow(batches: Iterable[pa.RecordBatch], schema: pa.Schema) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _encode_parquet(batches: Iterable[pa.RecordBatch], schema: pa.Schema) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _encode_ndjson(batches: Iterable[pa.RecordBatch], schema: pa.Schema) -> Iterator[bytes]:
+    for batch in batches:
+        lines = [
+            json.dumps(row, default=lambda value: value.isoformat())
+            for row in batch.to_pylist()
+        ]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+_ENCODERS = {
+    ExportFormat.arrow: _encode_arrow,
+    ExportFormat.ndjson: _encode_ndjson,
+    ExportFormat.parquet: _encode_parquet,
+}
+
+
+def encode_batches(
+    batches: Iterable[pa.RecordBatch], schema: pa.Schema, export_format: ExportFormat
+) -> Iterator[bytes]:
+    """
+    Encode record batches into a byte stream of the requested format.
+
+    Args:
+        batches (Iterable[pa.RecordBatch]): The batches to encode.
+        schema (pa.Schema): The schema shared by every batch.
+        export_format (ExportFormat): The output format.
+
+    Yields:
+        bytes: The encoded stream, one chunk per batch (empty chunks skipped).
+
+    """
+    for chunk in _ENCODERS[export_format](batches, schema):
+        if chunk:
+            yield chunk
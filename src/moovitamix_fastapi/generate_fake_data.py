@@ -3,9 +3,146 @@ The following script is reserved for the core functionality of the technical
 test and must not be modified.
 """
 
+import datetime
 import random
+from typing import Optional
 
-from src.moovitamix_fastapi.classes_out import ListenHistoryOut, TracksOut, UsersOut
+import numpy as np
+import pyarrow as pa
+from faker import Faker
+
+from src.moovitamix_fastapi.classes_out import (
+    ListenHistoryOut,
+    TracksOut,
+    UsersOut,
+    gender_list,
+    genre_list,
+)
+from src.moovitamix_fastapi.id_allocator import IdAllocator
+
+# Number of distinct Faker values drawn once per pool in bulk mode.
+POOL_SIZE = 1024
+# Number of track IDs sampled per listen history entry.
+TRACKS_PER_HISTORY = 5
+EPOCH = datetime.datetime(1970, 1, 1)
+
+TRACKS_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("name", pa.string()),
+        ("artist", pa.string()),
+        ("songwriters", pa.string()),
+        ("duration", pa.string()),
+        ("genres", pa.string()),
+        ("album", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ]
+)
+
+USERS_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("first_name", pa.string()),
+        ("last_name", pa.string()),
+        ("email", pa.string()),
+        ("gender", pa.string()),
+        ("favorite_genres", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ]
+)
+
+LISTEN_HISTORY_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.int64()),
+        ("items", pa.list_(pa.int64())),
+        ("created_at", pa.timestamp("us")),
+        ("updated_at", pa.timestamp("us")),
+    ]
+)
+
+
+def table_to_models(table: pa.Table, model):
+    """
+    Convert an Arrow table into a list of pydantic models.
+
+    Args:
+        table (pa.Table): The table to convert, usually a slice of a bulk table.
+        model: The pydantic model class matching the table schema.
+
+    Returns:
+        list: One model instance per row.
+
+    """
+    return [model(**row) for row in table.to_pylist()]
+
+
+def sample_distinct(rng, population, n_rows, k):
+    """
+    Draw ``k`` distinct values from ``population`` for each of ``n_rows`` rows.
+
+    The whole matrix is drawn in one vectorized call; the (rare) rows that
+    contain a repeated value are redrawn until every row is distinct.
+
+    Args:
+        rng (np.random.Generator): The random generator to draw from.
+        population (np.ndarray): The values to sample from.
+        n_rows (int): The number of rows to draw.
+        k (int): The number of distinct values per row.
+
+    Returns:
+        np.ndarray: An ``(n_rows, k)`` array of sampled values.
+
+    """
+    if k > len(population):
+        raise ValueError("Sample larger than population or is negative")
+
+    picks = rng.integers(0, len(population), size=(n_rows, k))
+    while True:
+        ordered = np.sort(picks, axis=1)
+        duplicated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not duplicated.any():
+            break
+        picks[duplicated] = rng.integers(
+            0, len(population), size=(int(duplicated.sum()), k)
+        )
+
+    return population[picks]
+
+
+class BulkFakeData:
+    """
+    Columnar fake data produced by ``FakeDataGenerator.generate_bulk_data``.
+
+    Each table is an Arrow table; pydantic models are only built on demand.
+
+    Args:
+        tracks (pa.Table): The generated tracks.
+        users (pa.Table): The generated users.
+        listen_history (pa.Table): The generated listen history.
+
+    """
+
+    def __init__(self, tracks, users, listen_history):
+        self.tracks = tracks
+        self.users = users
+        self.listen_history = listen_history
+
+    def to_models(self):
+        """
+        Convert the tables into pydantic models.
+
+        Returns:
+            tuple: The same ``(tracks, users, listen_history)`` lists as
+            ``FakeDataGenerator.generate_fake_data``.
+
+        """
+        return (
+            table_to_models(self.tracks, TracksOut),
+            table_to_models(self.users, UsersOut),
+            table_to_models(self.listen_history, ListenHistoryOut),
+        )
 
 
 class FakeDataGenerator:
@@ -16,11 +153,13 @@ class FakeDataGenerator:
 
     Args:
         data_range_observations (int): The number of observations to generate for each data type.
+        seed (int, optional): Seed used by the bulk mode, for reproducible data.
 
     """
 
-    def __init__(self, data_range_observations):
+    def __init__(self, data_range_observations, seed: Optional[int] = None):
         self.data_range_observations = data_range_observations
+        self.seed = seed
 
     def generate_fake_data(self):
         """
@@ -42,9 +181,10 @@ class FakeDataGenerator:
             for _ in range(self.data_range_observations)
         ]
 
+        track_ids = [track.id for track in tracks]
         for index, item in enumerate(listen_history):
             random_tracks = random.sample(
-                [track.id for track in tracks], 5
+                track_ids, TRACKS_PER_HISTORY
             )  # pick 5 random track IDs per user
             listen_history[index] = ListenHistoryOut(
                 user_id=users[index].id,
@@ -54,3 +194,110 @@ class FakeDataGenerator:
             )
 
         return tracks, users, listen_history
+
+    def generate_bulk_data(self, now: Optional[datetime.datetime] = None):
+        """
+        Generate fake data for tracks, users, and listen history as columns.
+
+        Faker is only called to fill small value pools; every column is then
+        drawn from those pools with batched NumPy sampling, so the cost is
+        linear in ``data_range_observations``.
+
+        Args:
+            now (datetime.datetime, optional): Upper bound of the generated
+                timestamps. Defaults to the current time.
+
+        Returns:
+            BulkFakeData: The generated tracks, users and listen history tables.
+
+        """
+        n = self.data_range_observations
+        if now is None:
+            now = datetime.datetime.now()
+
+        rng = np.random.default_rng(self.seed)
+        fake = Faker()
+        if self.seed is not None:
+            fake.seed_instance(self.seed)
+
+        words = np.array([fake.word() for _ in range(POOL_SIZE)], dtype=object)
+        names = np.array([fake.name() for _ in range(POOL_SIZE)], dtype=object)
+        first_names = np.array(
+            [fake.first_name() for _ in range(POOL_SIZE)], dtype=object
+        )
+        last_names = np.array(
+            [fake.last_name() for _ in range(POOL_SIZE)], dtype=object
+        )
+        emails = np.array([fake.email() for _ in range(POOL_SIZE)], dtype=object)
+        durations = np.array(
+            [f"{m:02d}:{s:02d}" for m in range(60) for s in range(60)], dtype=object
+        )
+        genders = np.array(gender_list(), dtype=object)
+        genres = np.array(genre_list(), dtype=object)
+
+        # Timestamps are naive, like Faker's, so they are kept as naive
+        # microseconds since the epoch.
+        now_us = (now - EPOCH) // datetime.timedelta(microseconds=1)
+        one_year_us = 365 * 24 * 3600 * 1_000_000
+
+        def pick(pool):
+            return pa.array(pool[rng.integers(0, len(pool), size=n)], pa.string())
+
+        def timestamps():
+            # created_at within two years, updated_at between it and now
+            created = rng.integers(now_us - 2 * one_year_us, now_us, size=n)
+            updated = created + (rng.random(size=n) * (now_us - created)).astype(np.int64)
+            return (
+                pa.array(created, pa.timestamp("us")),
+                pa.array(updated, pa.timestamp("us")),
+            )
+
+        track_ids = IdAllocator(seed=int(rng.integers(2**63))).allocate_many(n)
+        user_ids = IdAllocator(seed=int(rng.integers(2**63))).allocate_many(n)
+
+        tracks = pa.Table.from_arrays(
+            [
+                pa.array(track_ids, pa.int64()),
+                pick(words),
+                pick(names),
+                pick(names),
+                pick(durations),
+                pick(words),
+                pick(words),
+                *timestamps(),
+            ],
+            schema=TRACKS_SCHEMA,
+        )
+
+        users = pa.Table.from_arrays(
+            [
+                pa.array(user_ids, pa.int64()),
+                pick(first_names),
+                pick(last_names),
+                pick(emails),
+                pick(genders),
+                pick(genres),
+                *timestamps(),
+            ],
+            schema=USERS_SCHEMA,
+        )
+
+        history_created, history_updated = timestamps()
+        items = sample_distinct(rng, track_ids, n, TRACKS_PER_HISTORY)
+        offsets = np.arange(0, n * TRACKS_PER_HISTORY + 1, TRACKS_PER_HISTORY)
+
+        listen_history = pa.Table.from_arrays(
+            [
+                pa.array(user_ids, pa.int64()),
+                pa.ListArray.from_arrays(
+                    pa.array(offsets, pa.int32()),
+                    pa.array(items.ravel(), pa.int64()),
+                ),
+                history_created,
+                history_updated,
+            ],
+            schema=LISTEN_HISTORY_SCHEMA,
+        )
+
+        return BulkFakeData(tracks, users, listen_history)
+
@@ -0,0 +1,111 @@
+"""
+Seeded, collision-free ID allocation.
+
+IDs are produced by running a counter through a keyed Feistel bijection over
+the configured range, so every ID is unique without keeping a set of the IDs
+already handed out, and each allocation costs O(1).
+"""
+
+import secrets
+import threading
+from typing import Optional
+
+import numpy as np
+
+# Largest ID that fits a signed 64-bit integer column.
+MAX_ID_64 = 2**63 - 1
+# Largest ID that fits the INTEGER columns of the DuckDB schema.
+MAX_ID_32 = 2**31 - 1
+
+_MASK64 = 2**64 - 1
+_ROUNDS = 4
+
+
+def _mix(z):
+    """SplitMix64 finalizer, for Python ints or uint64 NumPy arrays."""
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _MASK64
+    return z ^ (z >> 31)
+
+
+class IdAllocator:
+    """
+    Allocate unique, pseudo-random IDs from ``[min_id, max_id]``.
+
+    The allocator maps the n-th allocation through a seeded Feistel network
+    (with cycle walking to stay inside the range), so the same seed always
+    yields the same sequence of IDs.
+
+    Args:
+        min_id (int): The smallest ID that may be allocated.
+        max_id (int): The largest ID that may be allocated, at most ``2**63 - 1``.
+        seed (int, optional): The permutation key. Defaults to a random seed.
+
+    """
+
+    def __init__(
+        self, min_id: int = 1, max_id: int = MAX_ID_32, seed: Optional[int] = None
+    ):
+        if not 0 <= min_id <= max_id <= MAX_ID_64:
+            raise ValueError(
+                f"Invalid ID range [{min_id}, {max_id}], expected 0 <= min_id <= max_id <= {MAX_ID_64}"
+            )
+
+        self.min_id = min_id
+        self.max_id = max_id
+        self.size = max_id - min_id + 1
+        self.seed = secrets.randbits(64) if seed is None else seed
+
+        bits = max((self.size - 1).bit_length(), 2)
+        self._half_bits = (bits + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._keys = [
+            _mix((self.seed + 0x9E3779B97F4A7C15 * (i + 1)) & _MASK64)
+            for i in range(_ROUNDS)
+        ]
+        self._next_index = 0
+        self._lock = threading.Lock()
+
+    def _feistel(self, x):
+        left, right = x >> self._half_bits, x & self._half_mask
+        for key in self._keys:
+            left, right = right, left ^ (_mix(right ^ key) & self._half_mask)
+        return (left << self._half_bits) | right
+
+    def permute(self, index: int) -> int:
+        """Return the ID at position ``index`` of the seeded permutation."""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Index {index} is outside the ID range")
+
+        value = self._feistel(index)
+        while value >= self.size:
+            value = self._feistel(value)
+        return value + self.min_id
+
+    def permute_many(self, indices: np.ndarray) -> np.ndarray:
+        """Vectorized ``permute`` for an array of positions."""
+        values = self._feistel(np.asarray(indices, dtype=np.uint64))
+        outside = values >= self.size
+        while outside.any():
+            values[outside] = self._feistel(values[outside])
+            outside = values >= self.size
+        return (values + np.uint64(self.min_id)).astype(np.int64)
+
+    def _reserve(self, count: int) -> int:
+        with self._lock:
+            start = self._next_index
+            if start + count > self.size:
+                raise ValueError(
+                    f"ID range [{self.min_id}, {self.max_id}] is exhausted"
+                )
+            self._next_index = start + count
+        return start
+
+    def allocate(self) -> int:
+        """Allocate the next ID."""
+        return self.permute(self._reserve(1))
+
+    def allocate_many(self, count: int) -> np.ndarray:
+        """Allocate the next ``count`` IDs as an ``int64`` array."""
+        start = self._reserve(count)
+        return self.permute_many(np.arange(start, start + count, dtype=np.uint64))
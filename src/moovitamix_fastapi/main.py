@@ -1,19 +1,64 @@
+import datetime
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Optional
+
 from src.moovitamix_fastapi.classes_out import TracksOut, UsersOut, ListenHistoryOut
-from src.moovitamix_fastapi.generate_fake_data import FakeDataGenerator
-from fastapi import FastAPI, Query
+from src.moovitamix_fastapi.dataset import Dataset, DatasetLoader
+from src.moovitamix_fastapi.export import (
+    DEFAULT_EXPORT_BATCH_SIZE,
+    FILE_EXTENSIONS,
+    MAX_EXPORT_BATCH_SIZE,
+    MEDIA_TYPES,
+    ExportFormat,
+    encode_batches,
+    iter_table_batches,
+)
+from src.moovitamix_fastapi.page_cache import PageCache, etag_matches
+from src.moovitamix_fastapi.pagination import (
+    DEFAULT_CURSOR_SIZE,
+    MAX_CURSOR_SIZE,
+    CursorPage,
+)
+from src.moovitamix_fastapi.recommendations import (
+    DEFAULT_LIMIT,
+    MAX_LIMIT,
+    RecommendationService,
+    RecommendationsOut,
+    RecommendedTrack,
+    listen_history_pairs,
+)
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi_pagination import Page, add_pagination, paginate
+from fastapi_pagination.api import resolve_params
 
 Page = Page.with_custom_options(
     size=Query(100, ge=1, le=100),
 )
 
+dataset_loader = DatasetLoader()
+recommendation_service = RecommendationService.from_env(
+    lambda: listen_history_pairs(dataset_loader.get().listen_history.table)
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    dataset_loader.start()
+    recommendation_service.start()
+    yield
+    recommendation_service.stop()
+
+
 app = FastAPI(
     title="MooVitamix",
     description="A music recommendation system.",
     version="1.1",
     docs_url=None,
+    lifespan=lifespan,
 )
 
 
@@ -31,27 +76,169 @@ async def overridden_swagger():
     )
 
 
-data_range_observations = 1000
-generator = FakeDataGenerator(data_range_observations)
-tracks, users, listen_history = generator.generate_fake_data()
+async def get_dataset() -> Dataset:
+    """Return the served dataset, waiting off the event loop while it is built"""
+    if dataset_loader.ready:
+        return dataset_loader.get()
+    return await run_in_threadpool(dataset_loader.get)
+
+
+CursorQuery = Query(None, description="Key of the last row already read.")
+CursorSizeQuery = Query(DEFAULT_CURSOR_SIZE, ge=1, le=MAX_CURSOR_SIZE)
+page_cache = PageCache()
+
+
+class PageFormat(str, Enum):
+    json = "json"
+    columnar = "columnar"
+
+
+PageFormatQuery = Query(
+    PageFormat.json,
+    description="`columnar` returns `{\"columns\": {name: [values]}, ...}` instead of a list of objects.",
+)
+
+
+def cached_page_response(
+    request: Request,
+    resource: str,
+    format: PageFormat,
+    updated_since: Optional[datetime.datetime],
+    updated_before: Optional[datetime.datetime],
+    dataset: Dataset,
+) -> Response:
+    """Serve a page from the pre-encoded page cache, answering 304 on a matching ETag"""
+    data = dataset.resources[resource]
+    params = resolve_params()
+
+    def build_page() -> bytes:
+        if format is PageFormat.columnar:
+            # Encoded from the Arrow table: no model is built for the rows of the page
+            return data.columnar_page(params.page, params.size, updated_since, updated_before)
+        return paginate(data.select(updated_since, updated_before)).model_dump_json().encode()
+
+    key = (resource, format.value, params.page, params.size, updated_since, updated_before)
+    page = page_cache.get_or_build(key, build_page)
+    headers = {"ETag": page.etag}
+    if etag_matches(request.headers.get("if-none-match"), page.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
+
+UpdatedSinceQuery = Query(
+    None, description="Only rows with `updated_at` greater than or equal to this time."
+)
+UpdatedBeforeQuery = Query(
+    None, description="Only rows with `updated_at` strictly before this time."
+)
 
 
 @app.get("/tracks", tags=["HTTP methods"])
-async def get_tracks() -> Page[TracksOut]:
-    return paginate(tracks)
+async def get_tracks(
+    request: Request,
+    updated_since: Optional[datetime.datetime] = UpdatedSinceQuery,
+    updated_before: Optional[datetime.datetime] = UpdatedBeforeQuery,
+    format: PageFormat = PageFormatQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> Page[TracksOut]:
+    return cached_page_response(request, "tracks", format, updated_since, updated_before, dataset)
 
 
 @app.get("/users", tags=["HTTP methods"])
-async def get_users() -> Page[UsersOut]:
-    return paginate(users)
+async def get_users(
+    request: Request,
+    updated_since: Optional[datetime.datetime] = UpdatedSinceQuery,
+    updated_before: Optional[datetime.datetime] = UpdatedBeforeQuery,
+    format: PageFormat = PageFormatQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> Page[UsersOut]:
+    return cached_page_response(request, "users", format, updated_since, updated_before, dataset)
 
 
 @app.get("/listen_history", tags=["HTTP methods"])
-async def get_listen_history() -> Page[ListenHistoryOut]:
-    return paginate(listen_history)
+async def get_listen_history(
+    request: Request,
+    updated_since: Optional[datetime.datetime] = UpdatedSinceQuery,
+    updated_before: Optional[datetime.datetime] = UpdatedBeforeQuery,
+    format: PageFormat = PageFormatQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> Page[ListenHistoryOut]:
+    return cached_page_response(request, "listen_history", format, updated_since, updated_before, dataset)
+
+
+@app.get("/tracks/cursor", tags=["Cursor pagination"])
+async def get_tracks_cursor(
+    cursor: Optional[int] = CursorQuery,
+    size: int = CursorSizeQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> CursorPage[TracksOut]:
+    return dataset.tracks.cursor_page(cursor, size)
+
+
+@app.get("/users/cursor", tags=["Cursor pagination"])
+async def get_users_cursor(
+    cursor: Optional[int] = CursorQuery,
+    size: int = CursorSizeQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> CursorPage[UsersOut]:
+    return dataset.users.cursor_page(cursor, size)
+
+
+@app.get("/listen_history/cursor", tags=["Cursor pagination"])
+async def get_listen_history_cursor(
+    cursor: Optional[int] = CursorQuery,
+    size: int = CursorSizeQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> CursorPage[ListenHistoryOut]:
+    return dataset.listen_history.cursor_page(cursor, size)
+
+
+class ExportResource(str, Enum):
+    tracks = "tracks"
+    users = "users"
+    listen_history = "listen_history"
+
+
+@app.get("/export/{resource}", tags=["Bulk export"])
+async def export_resource(
+    resource: ExportResource,
+    format: ExportFormat = Query(ExportFormat.arrow),
+    batch_size: int = Query(DEFAULT_EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE),
+    updated_since: Optional[datetime.datetime] = UpdatedSinceQuery,
+    updated_before: Optional[datetime.datetime] = UpdatedBeforeQuery,
+    dataset: Dataset = Depends(get_dataset),
+) -> StreamingResponse:
+    data = dataset.resources[resource.value]
+    table = data.select_table(updated_since, updated_before)
+    batches = iter_table_batches(table, data.schema, batch_size)
+    filename = f"{resource.value}.{FILE_EXTENSIONS[format]}"
+    return StreamingResponse(
+        encode_batches(batches, data.schema, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/recommendations/{user_id}", tags=["Recommendations"])
+async def get_recommendations(
+    user_id: int,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+) -> RecommendationsOut:
+    if recommendation_service.ready:
+        index = recommendation_service.get()
+    else:
+        index = await run_in_threadpool(recommendation_service.get)
+    items = index.recommend(user_id, limit)
+    if items is None:
+        raise HTTPException(status_code=404, detail=f"No listen history for user {user_id}")
+    return RecommendationsOut(
+        user_id=user_id,
+        items=[RecommendedTrack(track_id=track_id, score=score) for track_id, score in items],
+    )
+
 
 @app.get("/health", tags=["Health Check"])
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "dataset": dataset_loader.status}
 
 add_pagination(app)
@@ -0,0 +1,112 @@
+"""
+Cache of pre-encoded response pages.
+
+The served dataset does not change after startup, so the JSON body of a page
+only needs to be validated and serialized once. Bodies are kept in an LRU
+cache bounded by their total size and identified by a strong ETag.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+# Default budget for the cached response bodies, in bytes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def compute_etag(body: bytes) -> str:
+    """Return the strong ETag of a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Tell whether an ``If-None-Match`` header matches ``etag``."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in ("*", etag):
+            return True
+    return False
+
+
+class CachedPage:
+    """
+    An encoded response body and its ETag.
+
+    Args:
+        body (bytes): The encoded response body.
+
+    """
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = compute_etag(body)
+
+
+class PageCache:
+    """
+    LRU cache of encoded pages with a byte-size budget.
+
+    Args:
+        max_bytes (int): The maximum total size of the cached bodies. Bodies
+            larger than the budget are returned but never cached.
+
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, CachedPage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CachedPage]:
+        """Return the cached page for ``key``, marking it as recently used."""
+        with self._lock:
+            page = self._entries.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key: Hashable, body: bytes) -> CachedPage:
+        """Cache ``body`` under ``key``, evicting least recently used pages."""
+        page = CachedPage(body)
+        if len(body) > self.max_bytes:
+            return page
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous.body)
+            self._entries[key] = page
+            self.current_bytes += len(body)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted.body)
+        return page
+
+    def get_or_build(self, key: Hashable, build: Callable[[], bytes]) -> CachedPage:
+        """Return the cached page for ``key``, building and caching it on a miss."""
+        page = self.get(key)
+        if page is None:
+            page = self.put(key, build())
+        return page
+
+    def clear(self):
+        """Drop every cached page."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
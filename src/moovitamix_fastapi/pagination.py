@@ -0,0 +1,180 @@
+"""
+Keyset (cursor) pagination and time-window filtering for the data endpoints.
+
+Rows are addressed through an index sorted on their key, so a page is a
+binary search for the cursor followed by a slice, whatever the page number.
+"""
+
+import datetime
+from typing import Generic, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+# Default and maximum number of rows per cursor page.
+DEFAULT_CURSOR_SIZE = 1000
+MAX_CURSOR_SIZE = 5000
+
+T = TypeVar("T")
+
+
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T] = Field()
+    size: int = Field()
+    next_cursor: Optional[int] = Field(
+        description="Key of the last row of the page, to pass as `cursor` for the next page. Null on the last page."
+    )
+
+
+def take_rows(rows: Sequence[T], positions: np.ndarray) -> List[T]:
+    """Return the rows at ``positions``; column stores build them in one pass."""
+    rows_at = getattr(rows, "rows_at", None)
+    if rows_at is not None:
+        return rows_at(positions)
+    return [rows[position] for position in positions]
+
+
+class KeysetIndex:
+    """
+    Sorted index over the keys of a dataset.
+
+    Args:
+        keys (Sequence[int]): The key of each row, in storage order.
+
+    """
+
+    def __init__(self, keys: Sequence[int]):
+        keys = np.asarray(keys, dtype=np.int64)
+        self.positions = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.positions]
+
+    @classmethod
+    def from_sorted(cls, positions: np.ndarray, sorted_keys: np.ndarray) -> "KeysetIndex":
+        """Wrap a precomputed sort, such as one memory-mapped from a shared file."""
+        index = cls.__new__(cls)
+        index.positions = positions
+        index.sorted_keys = sorted_keys
+        return index
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+    def seek(self, cursor: Optional[int], size: int) -> Tuple[np.ndarray, Optional[int]]:
+        """
+        Find the rows following ``cursor`` in key order.
+
+        Args:
+            cursor (int, optional): The last key already read, or None to start
+                from the first row.
+            size (int): The maximum number of rows to return.
+
+        Returns:
+            tuple: The storage positions of the page rows and the cursor of the
+            next page (None when the page is the last one).
+
+        """
+        start = 0
+        if cursor is not None:
+            start = int(np.searchsorted(self.sorted_keys, cursor, side="right"))
+        stop = min(start + size, len(self.sorted_keys))
+
+        next_cursor = None
+        if stop < len(self.sorted_keys):
+            next_cursor = int(self.sorted_keys[stop - 1])
+        return self.positions[start:stop], next_cursor
+
+    def page(self, rows: Sequence[T], cursor: Optional[int], size: int) -> CursorPage[T]:
+        """Build the ``CursorPage`` of ``rows`` following ``cursor``."""
+        positions, next_cursor = self.seek(cursor, size)
+        return CursorPage(
+            items=take_rows(rows, positions),
+            size=size,
+            next_cursor=next_cursor,
+        )
+
+
+class RowsView(Sequence):
+    """
+    Read-only view of ``rows`` at the given storage ``positions``.
+
+    Slicing the view only materializes the requested rows, so it can be
+    handed to ``paginate`` without copying the whole selection.
+    """
+
+    def __init__(self, rows: Sequence[T], positions: np.ndarray):
+        self.rows = rows
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return take_rows(self.rows, self.positions[index])
+        return self.rows[self.positions[index]]
+
+
+def _to_datetime64(value: datetime.datetime) -> np.datetime64:
+    # The served timestamps are naive local times.
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return np.datetime64(value, "us")
+
+
+class TimeIndex:
+    """
+    Index of a dataset sorted on ``updated_at``.
+
+    Args:
+        timestamps (Sequence[datetime.datetime]): The ``updated_at`` of each
+            row, in storage order.
+
+    """
+
+    def __init__(self, timestamps: Sequence[datetime.datetime]):
+        timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+        self.positions = np.argsort(timestamps, kind="stable")
+        self.sorted_timestamps = timestamps[self.positions]
+
+    @classmethod
+    def from_sorted(cls, positions: np.ndarray, sorted_timestamps: np.ndarray) -> "TimeIndex":
+        """Wrap a precomputed sort, such as one memory-mapped from a shared file."""
+        index = cls.__new__(cls)
+        index.positions = positions
+        index.sorted_timestamps = sorted_timestamps
+        return index
+
+    def window(
+        self,
+        updated_since: Optional[datetime.datetime] = None,
+        updated_before: Optional[datetime.datetime] = None,
+    ) -> np.ndarray:
+        """
+        Find the rows with ``updated_since <= updated_at < updated_before``.
+
+        Args:
+            updated_since (datetime.datetime, optional): Inclusive lower bound.
+            updated_before (datetime.datetime, optional): Exclusive upper bound.
+
+        Returns:
+            np.ndarray: The storage positions of the matching rows, ordered by
+            ``updated_at``.
+
+        """
+        start, stop = 0, len(self.sorted_timestamps)
+        if updated_since is not None:
+            start = int(np.searchsorted(self.sorted_timestamps, _to_datetime64(updated_since), side="left"))
+        if updated_before is not None:
+            stop = int(np.searchsorted(self.sorted_timestamps, _to_datetime64(updated_before), side="left"))
+        return self.positions[start:max(start, stop)]
+
+    def select(
+        self,
+        rows: Sequence[T],
+        updated_since: Optional[datetime.datetime] = None,
+        updated_before: Optional[datetime.datetime] = None,
+    ) -> Sequence[T]:
+        """Return ``rows`` unchanged without bounds, else a ``RowsView`` of the window."""
+        if updated_since is None and updated_before is None:
+            return rows
+        return RowsView(rows, self.window(updated_since, updated_before))
@@ -0,0 +1,278 @@
+"""
+Item-item recommendations from listen history.
+
+Listens are turned into a sparse user x track matrix; the cosine similarity
+between tracks is computed with one sparse matrix product and only the top-K
+neighbours of each track are kept. A user's recommendations are then the
+product of their listen vector with that neighbour matrix.
+"""
+
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import scipy.sparse as sp
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 50
+# Tracks whose similarities are computed together while building the index
+SIMILARITY_BLOCK_SIZE = 1024
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# Seconds between two checks of the DuckDB data version
+DEFAULT_REFRESH_INTERVAL = 60.0
+
+
+class RecommendedTrack(BaseModel):
+    track_id: int = Field()
+    score: float = Field()
+
+
+class RecommendationsOut(BaseModel):
+    user_id: int = Field()
+    items: List[RecommendedTrack] = Field()
+
+
+class ItemSimilarityIndex:
+    """
+    Top-K item-item cosine similarity index.
+
+    Args:
+        user_ids (np.ndarray): The user of each listen.
+        track_ids (np.ndarray): The track of each listen.
+        counts (np.ndarray, optional): The number of listens of each pair.
+            Defaults to one listen per pair.
+        top_k (int): The number of neighbours kept per track.
+        cache_size (int): The number of users whose recommendations are cached.
+
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        track_ids: np.ndarray,
+        counts: Optional[np.ndarray] = None,
+        top_k: int = DEFAULT_TOP_K,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self.user_keys, user_rows = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        self.track_keys, track_cols = np.unique(np.asarray(track_ids, dtype=np.int64), return_inverse=True)
+        if counts is None:
+            counts = np.ones(len(user_rows), dtype=np.float32)
+
+        # Duplicate (user, track) pairs are summed by the CSR conversion.
+        self.listens = sp.csr_matrix(
+            (np.asarray(counts, dtype=np.float32), (user_rows, track_cols)),
+            shape=(len(self.user_keys), len(self.track_keys)),
+        )
+        self.neighbours = self._top_k_neighbours(self.listens, top_k)
+        self.recommend = lru_cache(maxsize=cache_size)(self._recommend)
+
+    @staticmethod
+    def _top_k_neighbours(
+        listens: sp.csr_matrix, top_k: int, block_size: int = SIMILARITY_BLOCK_SIZE
+    ) -> sp.csr_matrix:
+        """
+        Keep the ``top_k`` most similar tracks of each track, as a CSR matrix.
+
+        Similarities are computed for ``block_size`` tracks at a time, so only
+        one block of the track x track product is held in memory.
+        """
+        norms = np.sqrt(np.asarray(listens.multiply(listens).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        normalized = (listens @ sp.diags(1.0 / norms)).tocsc()
+        n_tracks = normalized.shape[1]
+
+        kept_rows, kept_cols, kept_scores = [], [], []
+        for start in range(0, n_tracks, block_size):
+            block = (normalized[:, start:start + block_size].T @ normalized).tocoo()
+            rows = block.row + start
+            off_diagonal = rows != block.col
+            rows, cols, scores = rows[off_diagonal], block.col[off_diagonal], block.data[off_diagonal]
+
+            # Rank the neighbours of every track of the block at once: by row, score, then track.
+            order = np.lexsort((cols, -scores, rows))
+            rows, cols, scores = rows[order], cols[order], scores[order]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+            keep = rank < top_k
+            kept_rows.append(rows[keep])
+            kept_cols.append(cols[keep])
+            kept_scores.append(scores[keep])
+
+        if not kept_rows:
+            return sp.csr_matrix((n_tracks, n_tracks), dtype=np.float32)
+        return sp.csr_matrix(
+            (np.concatenate(kept_scores), (np.concatenate(kept_rows), np.concatenate(kept_cols))),
+            shape=(n_tracks, n_tracks),
+        )
+
+    def _recommend(self, user_id: int, limit: int) -> Optional[Tuple[Tuple[int, float], ...]]:
+        row = np.searchsorted(self.user_keys, user_id)
+        if row >= len(self.user_keys) or self.user_keys[row] != user_id:
+            return None
+
+        history = self.listens.getrow(row)
+        scores = (history @ self.neighbours).tocoo()
+        unheard = ~np.isin(scores.col, history.indices)
+        cols, values = scores.col[unheard], scores.data[unheard].astype(np.float64)
+
+        # Highest score first, ties broken by track id for stable results.
+        best = np.lexsort((self.track_keys[cols], -values))[:limit]
+        return tuple(
+            (int(self.track_keys[cols[i]]), float(values[i])) for i in best
+        )
+
+
+def listen_history_pairs(table: pa.Table) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten the listen history table into (user_id, track_id) listen pairs."""
+    items = table.column("items").combine_chunks()
+    lengths = np.diff(items.offsets.to_numpy())
+    user_ids = np.repeat(table.column("user_id").to_numpy(), lengths)
+    track_ids = items.flatten().to_numpy()
+    return user_ids, track_ids
+
+
+def duckdb_pairs(db_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read the (user_id, track_id, listen_count) aggregate from the DuckDB warehouse."""
+    import duckdb
+
+    with duckdb.connect(db_path, read_only=True) as conn:
+        table = conn.execute(
+            "SELECT user_id, track_id, listen_count FROM agg_user_track_counts"
+        ).to_arrow_table()
+    return (
+        table.column("user_id").to_numpy(),
+        table.column("track_id").to_numpy(),
+        table.column("listen_count").to_numpy(),
+    )
+
+
+def snapshot_pairs(snapshot_dir: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read the listen pairs from the latest snapshot published by the loader."""
+    from src.moovitamix_fastapi.etl.db_loader import current_snapshot
+
+    path = current_snapshot(snapshot_dir)
+    if path is None:
+        raise FileNotFoundError(f"No DuckDB snapshot published in {snapshot_dir}")
+    return duckdb_pairs(path)
+
+
+def snapshot_version(snapshot_dir: str) -> Optional[str]:
+    """Return the data version of the warehouse: the latest published snapshot."""
+    from src.moovitamix_fastapi.etl.db_loader import current_snapshot
+
+    path = current_snapshot(snapshot_dir)
+    return None if path is None else os.path.basename(path)
+
+
+class RecommendationService:
+    """
+    Own the current ``ItemSimilarityIndex`` and rebuild it in the background.
+
+    Args:
+        load_pairs (Callable): Return the ``(user_ids, track_ids[, counts])``
+            arrays to build the index from.
+        version (Callable, optional): Return the current data version; the index
+            is rebuilt whenever it changes. Without it the index is built once.
+        refresh_interval (float): Seconds between two version checks.
+
+    """
+
+    def __init__(
+        self,
+        load_pairs: Callable[[], Tuple[np.ndarray, ...]],
+        version: Optional[Callable[[], Optional[str]]] = None,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        top_k: int = DEFAULT_TOP_K,
+    ):
+        self.load_pairs = load_pairs
+        self.version = version
+        self.refresh_interval = refresh_interval
+        self.top_k = top_k
+        self.index: Optional[ItemSimilarityIndex] = None
+        self.index_version: Optional[str] = None
+        self.error: Optional[Exception] = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, load_api_pairs: Callable[[], Tuple[np.ndarray, ...]]) -> "RecommendationService":
+        """
+        Build the service configured by the environment.
+
+        ``MOOVITAMIX_RECOMMENDATION_SOURCE`` is ``api`` (the served listen
+        history, the default) or ``duckdb``, which reads the latest warehouse
+        snapshot published in ``MOOVITAMIX_DUCKDB_SNAPSHOT_DIR`` and follows
+        its loads; the loader's own database file is never opened.
+        """
+        top_k = int(os.environ.get("MOOVITAMIX_RECOMMENDATION_TOP_K", DEFAULT_TOP_K))
+        if os.environ.get("MOOVITAMIX_RECOMMENDATION_SOURCE", "api") == "duckdb":
+            snapshot_dir = os.environ.get("MOOVITAMIX_DUCKDB_SNAPSHOT_DIR", os.path.join("data", "duckdb_snapshots"))
+            return cls(
+                lambda: snapshot_pairs(snapshot_dir),
+                version=lambda: snapshot_version(snapshot_dir),
+                top_k=top_k,
+            )
+        return cls(load_api_pairs, top_k=top_k)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def rebuild(self):
+        """Build a new index and swap it in."""
+        version = self.version() if self.version else None
+        started = time.perf_counter()
+        index = ItemSimilarityIndex(*self.load_pairs(), top_k=self.top_k)
+        self.index, self.index_version = index, version
+        logger.info(
+            f"Recommendation index of {len(index.track_keys)} tracks built "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def _run(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Error building recommendation index: {str(e)}")
+            self.error = e
+        finally:
+            self._ready.set()
+
+        while self.version is not None and not self._stop.wait(self.refresh_interval):
+            try:
+                if self.version() != self.index_version:
+                    self.rebuild()
+                    self.error = None
+            except Exception as e:
+                logger.error(f"Error refreshing recommendation index: {str(e)}")
+
+    def start(self):
+        """Start building (and refreshing) the index in a background thread, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="recommendation-index", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self) -> ItemSimilarityIndex:
+        """Return the current index, starting the build and waiting for it if needed."""
+        self.start()
+        self._ready.wait()
+        if self.index is None:
+            raise RuntimeError("Recommendation index construction failed") from self.error
+        return self.index
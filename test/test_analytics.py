@@ -0,0 +1,119 @@
+import os
+
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+from src.moovitamix_fastapi import analytics_main
+from src.moovitamix_fastapi.analytics import AnalyticsService, SnapshotUnavailable
+from src.moovitamix_fastapi.etl.db_loader import DuckDBLoader
+from test.test_db_loader import track, user, write_raw_day
+
+
+def read_stream(body: bytes) -> pa.Table:
+    return pa.ipc.open_stream(body).read_all()
+
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    raw_dir = str(tmp_path / "raw")
+    write_raw_day(
+        raw_dir, "2024-12-12",
+        [track(1, "one", "2024-12-01T00:00:00"), track(2, "two", "2024-12-01T00:00:00")],
+        [user(10, "a@example.com", "2024-12-01T00:00:00")],
+        [{"user_id": 10, "items": [1, 2], "created_at": "2024-12-11T10:00:00", "updated_at": "2024-12-11T10:00:00"}],
+    )
+    write_raw_day(
+        raw_dir, "2024-12-13",
+        [track(3, "three", "2024-12-13T00:00:00")],
+        [user(10, "a@example.com", "2024-12-01T00:00:00")],
+        [{"user_id": 10, "items": [3], "created_at": "2024-12-12T10:00:00", "updated_at": "2024-12-12T10:00:00"}],
+    )
+    return raw_dir
+
+
+@pytest.fixture
+def loader(tmp_path, raw_dir):
+    loader = DuckDBLoader(db_path=str(tmp_path / "live.duckdb"), raw_dir=raw_dir,
+                          snapshot_dir=str(tmp_path / "snapshots"))
+    yield loader
+    loader.close()
+
+
+@pytest.fixture
+def client(loader, monkeypatch):
+    monkeypatch.setattr(analytics_main, "analytics_service", AnalyticsService(loader.snapshot_dir, pool_size=2))
+    return TestClient(analytics_main.app)
+
+
+def test_no_snapshot_is_unavailable(tmp_path):
+    with pytest.raises(SnapshotUnavailable):
+        AnalyticsService(str(tmp_path / "missing")).current()
+
+
+def test_results_are_cached_per_data_version(loader, client):
+    loader.load_daily_data("2024-12-12")
+    first = client.get("/features/top_tracks", params={"limit": 10})
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    assert "etag" not in first.headers
+    assert read_stream(first.content).column("track_id").to_pylist() == [1, 2]
+
+    cached = client.get("/features/top_tracks", params={"limit": 10})
+    assert cached.content == first.content
+    assert cached.headers["x-data-version"] == first.headers["x-data-version"]
+    assert client.get(
+        "/features/top_tracks", params={"limit": 10}, headers={"If-None-Match": cached.headers["etag"]}
+    ).status_code == 304
+
+    # The next committed load publishes a new snapshot: the cached result is not served again
+    loader.load_daily_data("2024-12-13")
+    fresh = client.get("/features/top_tracks", params={"limit": 10})
+    assert fresh.headers["x-data-version"] != first.headers["x-data-version"]
+    assert "etag" not in fresh.headers
+    assert read_stream(fresh.content).column("track_id").to_pylist() == [1, 2, 3]
+
+
+def test_parameterized_feature_queries(loader, client):
+    loader.backfill("2024-12-12", "2024-12-13")
+    genres = read_stream(client.get("/features/user_genre_counts", params={"user_id": 10}).content)
+    assert genres.to_pylist() == [{"user_id": 10, "genre": "Rock", "listen_count": 3}]
+    assert read_stream(client.get("/features/user_genre_counts", params={"user_id": 11}).content).num_rows == 0
+
+    daily = read_stream(client.get(
+        "/features/daily_listens", params={"start_date": "2024-12-13", "end_date": "2024-12-13"}
+    ).content)
+    assert daily.column("listens").to_pylist() == [1]
+    assert client.get("/features/daily_listens", params={"start_date": "not a date"}).status_code == 422
+
+
+def test_snapshot_is_served_while_the_loader_is_connected(loader, client):
+    loader.load_daily_data("2024-12-12")
+    assert client.get("/health").json()["status"] == "healthy"
+    # The loader still writes to its own file while the service reads the snapshot
+    loader.load_daily_data("2024-12-13")
+    assert os.path.exists(loader.db_path)
+    assert client.get("/features/user_track_counts").status_code == 200
+
+
+def test_discarded_results_give_their_cursor_back(loader):
+    loader.load_daily_data("2024-12-12")
+    service = AnalyticsService(loader.snapshot_dir, pool_size=2, cursor_timeout=0.1)
+    for _ in range(3):
+        service.query("top_tracks", {"limit": 1})
+    assert service.current().free_cursors == 2
+    assert service.current().refs == 0
+
+
+def test_retired_snapshot_is_closed_once_its_queries_are_done(loader):
+    loader.load_daily_data("2024-12-12")
+    service = AnalyticsService(loader.snapshot_dir, pool_size=1)
+    result = service.query("user_track_counts", {})
+    old = service.current()
+
+    # A new snapshot retires the pool still streaming the result
+    loader.load_daily_data("2024-12-13")
+    assert service.current() is not old and old.retired and old.refs == 1
+    assert read_stream(b"".join(result.chunks)).num_rows == 2
+    assert old.refs == 0
+    assert read_stream(b"".join(service.query("user_track_counts", {}).chunks)).num_rows == 3
@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.moovitamix_fastapi.classes_out import ListenHistoryOut, TracksOut
+from src.moovitamix_fastapi.column_store import ColumnStore
+from src.moovitamix_fastapi.generate_fake_data import FakeDataGenerator, table_to_models
+
+data = FakeDataGenerator(200, seed=7).generate_bulk_data()
+
+
+def test_rows_match_validated_models():
+    store = ColumnStore(data.tracks, TracksOut, dictionary_columns=("genres",))
+    expected = table_to_models(data.tracks, TracksOut)
+
+    assert len(store) == len(expected)
+    assert store[0] == expected[0]
+    assert store[-1] == expected[-1]
+    assert store[10:15] == expected[10:15]
+    assert store[-3:] == expected[-3:] and store[::-97] == expected[::-97]
+    assert store[len(store) + 5:] == []
+    assert store.rows_at(np.array([5, 3])) == [expected[5], expected[3]]
+
+
+def test_listen_items_are_read_from_offsets():
+    store = ColumnStore(data.listen_history, ListenHistoryOut)
+    expected = table_to_models(data.listen_history, ListenHistoryOut)
+
+    assert [row.items for row in store[:20]] == [row.items for row in expected[:20]]
+
+
+def test_dictionary_columns_are_encoded():
+    store = ColumnStore(data.tracks, TracksOut, dictionary_columns=("genres",))
+    assert str(store.table.schema.field("genres").type).startswith("dictionary")
+    assert [row.genres for row in store[:10]] == data.tracks.column("genres").to_pylist()[:10]
@@ -0,0 +1,23 @@
+import datetime
+
+import orjson
+import pyarrow as pa
+
+from src.moovitamix_fastapi.columnar import columnar_to_arrow, columnar_to_dataframe, encode_columnar_page
+
+
+def test_encode_and_decode_round_trip():
+    schema = pa.schema([("id", pa.int64()), ("items", pa.list_(pa.int64())), ("updated_at", pa.timestamp("us"))])
+    table = pa.table({
+        "id": [1, 2],
+        "items": [[1], []],
+        "updated_at": [datetime.datetime(2024, 12, 12, 1, 2, 3, 4), datetime.datetime(2024, 12, 12)],
+    }, schema=schema)
+
+    document = orjson.loads(encode_columnar_page(table, total=5, page=1, size=2))
+    assert document["pages"] == 3
+    assert document["columns"]["updated_at"] == ["2024-12-12T01:02:03.000004", "2024-12-12T00:00:00.000000"]
+
+    decoded = columnar_to_arrow(document["columns"], schema)
+    assert decoded.equals(table)
+    assert columnar_to_dataframe(document["columns"])["id"].tolist() == [1, 2]
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.moovitamix_fastapi.etl.compaction import compact_month, daily_files
+
+
+def write_day(raw_dir, data_date, user_ids):
+    day_dir = raw_dir / data_date
+    day_dir.mkdir(parents=True)
+    rows = [{"id": user_id, "gender": "Agender", "created_at": f"{data_date}T00:00:00",
+             "updated_at": f"{data_date}T00:00:00"} for user_id in user_ids]
+    pd.DataFrame(rows).to_parquet(day_dir / "users.parquet", index=False)
+
+
+def test_compaction_merges_a_month_into_one_sorted_file(tmp_path):
+    raw_dir, compact_dir = tmp_path / "raw", tmp_path / "compacted"
+    write_day(raw_dir, "2024-12-02", [5, 1])
+    write_day(raw_dir, "2024-12-01", [3, 2])
+    write_day(raw_dir, "2025-01-01", [9])
+
+    report = compact_month(str(raw_dir), "2024-12", str(compact_dir), names=["users"])
+
+    monthly = pq.read_table(compact_dir / "2024-12" / "users.parquet")
+    assert monthly.column("id").to_pylist() == [1, 2, 3, 5]
+    assert monthly.column("data_date").to_pylist() == ["2024-12-02", "2024-12-01", "2024-12-01", "2024-12-02"]
+    users = report["tables"]["users"]
+    assert (users["files"], users["rows"]) == (2, 4)
+    assert users["bytes_before"] > 0 and users["bytes_after"] > 0
+    assert {"full_scan_seconds_before", "full_scan_seconds_after", "key_lookup_seconds_after"} <= set(users)
+    with open(compact_dir / "2024-12" / "report.json") as f:
+        assert json.load(f)["tables"]["users"]["rows"] == 4
+
+
+def test_compaction_can_remove_the_daily_files(tmp_path):
+    raw_dir = tmp_path / "raw"
+    write_day(raw_dir, "2024-12-01", [1])
+
+    compact_month(str(raw_dir), "2024-12", str(tmp_path / "compacted"), names=["users"], delete_daily=True)
+
+    assert daily_files(str(raw_dir), "2024-12", "users") == []
+    assert os.path.exists(tmp_path / "compacted" / "2024-12" / "users.parquet")
@@ -1,32 +1,44 @@
+import io
+import json
 import os
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, patch
+import httpx
+import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime
 
-from src.moovitamix_fastapi.etl.data_feed import MooVitamixDataFeed  
+from src.moovitamix_fastapi.etl.data_feed import MooVitamixDataFeed
+from src.moovitamix_fastapi.etl.parquet_writer import RAW_SCHEMAS
 
 @pytest.fixture
 def data_feed():
     return MooVitamixDataFeed(base_url="http://test-api")  
 
+def json_response(payload):
+    """A requests response carrying a JSON payload, as returned by requests.get"""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(payload).encode()
+    return response
+
 @pytest.fixture
 def mock_response():
-    mock = Mock()
-    mock.json.return_value = {
+    return json_response({
         "items": [
             {"id": 1, "name": "Test Track", "artist": "Test Artist"},
             {"id": 2, "name": "Test Track 2", "artist": "Test Artist 2"}
         ]
-    }
-    return mock
+    })
 
 def test_make_request_successful(data_feed, mock_response):
     """Test successful API request with pagination"""
     with patch('requests.get') as mock_get:
         mock_get.side_effect = [
             mock_response,
-            Mock(json=lambda: {"items": []})
+            json_response({"items": []})
         ]
         
         result = data_feed._make_request('/tracks')
@@ -75,11 +87,11 @@ def test_extract_all_integration(data_feed, mock_response, tmp_path):
         # Mock successful responses for all endpoints
         mock_get.side_effect = [
             mock_response, 
-            Mock(json=lambda: {"items": []}),  
+            json_response({"items": []}),  
             mock_response,  
-            Mock(json=lambda: {"items": []}), 
+            json_response({"items": []}), 
             mock_response,  
-            Mock(json=lambda: {"items": []})   
+            json_response({"items": []})   
         ]
         
         data_feed.extract_all()
@@ -90,4 +102,287 @@ def test_extract_all_integration(data_feed, mock_response, tmp_path):
         assert os.path.exists(os.path.join(str(tmp_path), "listen_history.parquet"))
         
         # Verify mock calls
-        assert mock_get.call_count == 6
\ No newline at end of file
+        assert mock_get.call_count == 6
+
+def test_extract_all_streams_arrow_export(tmp_path):
+    """Test the bulk export client mode writes the Arrow stream to parquet under the raw schemas"""
+    data_feed = MooVitamixDataFeed(base_url="http://test-api", export_format="arrow")
+    data_feed.output_dir = str(tmp_path)
+
+    table = pa.table({
+        "id": [1, 2, 3],
+        "name": ["a", "b", "c"],
+        "created_at": pa.array([datetime(2024, 12, 12)] * 3, pa.timestamp("us")),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=2)
+    payload = sink.getvalue().to_pybytes()
+
+    def fake_get(url, params=None, stream=False):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.raw = io.BytesIO(payload)
+        return response
+
+    with patch('requests.get', side_effect=fake_get) as mock_get:
+        data_feed.extract_all()
+
+    assert mock_get.call_args_list[0].args[0] == "http://test-api/export/tracks"
+    tracks = pq.read_table(os.path.join(str(tmp_path), "tracks.parquet"))
+    assert tracks.schema.equals(RAW_SCHEMAS["tracks"])
+    assert tracks.column("id").to_pylist() == [1, 2, 3]
+    assert tracks.column("created_at").to_pylist() == ["2024-12-12T00:00:00.000000"] * 3
+
+def test_ndjson_export_is_written_under_the_raw_schemas(tmp_path):
+    """Test that NDJSON exports, even empty ones, are typed by the raw schemas"""
+    data_feed = MooVitamixDataFeed(base_url="http://test-api", export_format="ndjson")
+    data_feed.output_dir = str(tmp_path)
+    payloads = {
+        "tracks": [b'{"id": 1, "name": "a", "created_at": "2024-12-12T00:00:00"}', b""],
+        "users": [],
+        "listen_history": [b'{"user_id": 1, "items": [1, 2]}'],
+    }
+
+    def fake_get(url, params=None, stream=False):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = payloads[url.rsplit("/", 1)[-1]]
+        return response
+
+    with patch('requests.get', side_effect=fake_get):
+        data_feed.extract_all()
+
+    for name, schema in RAW_SCHEMAS.items():
+        assert pq.read_schema(os.path.join(str(tmp_path), f"{name}.parquet")).equals(schema)
+    tracks = pq.read_table(os.path.join(str(tmp_path), "tracks.parquet"))
+    assert tracks.column("created_at").to_pylist() == ["2024-12-12T00:00:00"]
+    assert pq.read_metadata(os.path.join(str(tmp_path), "users.parquet")).num_rows == 0
+
+def test_parquet_export_is_rewritten_with_the_raw_policy(tmp_path):
+    """Test that a parquet export is validated and written with the raw schema and codec, not copied"""
+    data_feed = MooVitamixDataFeed(base_url="http://test-api", export_format="parquet", validate=True)
+    data_feed.endpoints = {"tracks": "/tracks"}
+    data_feed.output_dir = str(tmp_path)
+
+    table = pa.table({
+        "id": [1, 2, 2],
+        "name": ["a", "b", "c"],
+        "artist": ["x"] * 3,
+        "songwriters": ["s"] * 3,
+        "duration": ["03:00"] * 3,
+        "genres": ["Pop"] * 3,
+        "album": ["b"] * 3,
+        "created_at": pa.array([datetime(2024, 12, 1)] * 3, pa.timestamp("us")),
+        "updated_at": pa.array([datetime(2024, 12, 12)] * 3, pa.timestamp("us")),
+    })
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="snappy")
+    payload = sink.getvalue().to_pybytes()
+
+    def fake_get(url, params=None, stream=False):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [payload[:100], payload[100:]]
+        return response
+
+    with patch('requests.get', side_effect=fake_get):
+        data_feed.extract_all()
+
+    parquet_file = pq.ParquetFile(os.path.join(str(tmp_path), "tracks.parquet"))
+    assert parquet_file.schema_arrow.equals(RAW_SCHEMAS["tracks"])
+    assert parquet_file.metadata.row_group(0).column(0).compression == "ZSTD"
+    assert parquet_file.read().column("id").to_pylist() == [1, 2]
+    assert data_feed.validation_reports["tracks"]["reasons"] == {"duplicate:id": 1}
+    # The downloaded export is removed once rewritten
+    assert sorted(os.listdir(str(tmp_path))) == ["quarantine", "tracks.parquet"]
+
+def test_incremental_extraction_uses_high_water_mark(tmp_path):
+    """Test that a second incremental run only asks for rows updated since the last one"""
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", incremental=True, state_path=str(tmp_path / "state.json")
+    )
+    data_feed.output_dir = str(tmp_path)
+    page = json_response({"items": [
+        {"id": 1, "updated_at": "2024-12-01T10:00:00"},
+        {"id": 2, "updated_at": "2024-12-11T08:30:00.500000"},
+    ]})
+
+    with patch('requests.get') as mock_get:
+        mock_get.side_effect = [page, json_response({"items": []})] * 3
+        data_feed.extract_all()
+        assert mock_get.call_args_list[0].kwargs["params"] == {}
+
+        mock_get.side_effect = [page, json_response({"items": []})] * 3
+        data_feed.extract_all()
+        assert mock_get.call_args_list[6].kwargs["params"] == {
+            "updated_since": "2024-12-11T08:30:00.500000"
+        }
+
+def test_concurrent_extraction_keeps_page_order(tmp_path):
+    """Test the async extractor fetches every advertised page and keeps them in order"""
+    requested_pages = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        requested_pages.append(page)
+        items = [{"id": page * 10 + i} for i in range(2)]
+        return httpx.Response(200, json={"items": items, "total": 8, "page": page, "size": 2, "pages": 4})
+
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=3, transport=httpx.MockTransport(handler)
+    )
+    data_feed.output_dir = str(tmp_path)
+    data_feed.extract_all()
+
+    assert sorted(requested_pages) == [1, 1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4]
+    df = pd.read_parquet(os.path.join(str(tmp_path), "users.parquet"))
+    assert df["id"].tolist() == [10, 11, 20, 21, 30, 31, 40, 41]
+
+def test_extraction_records_per_endpoint_metrics(tmp_path):
+    """Test that pages, rows, bytes and latencies are recorded per endpoint"""
+    def handler(request):
+        page = int(request.url.params["page"])
+        items = [{"id": page * 10 + i} for i in range(2)]
+        return httpx.Response(200, json={"items": items, "total": 4, "page": page, "size": 2, "pages": 2})
+
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=2, transport=httpx.MockTransport(handler)
+    )
+    data_feed.output_dir = str(tmp_path)
+    data_feed.extract_all()
+
+    metrics = data_feed.metrics
+    assert metrics.status == "success"
+    assert metrics.counters["pages_fetched_total"][(("endpoint", "tracks"),)] == 2
+    assert metrics.total("rows_extracted_total") == 12
+    assert metrics.total("bytes_extracted_total") > 0
+    assert metrics.histograms["request_seconds"][(("endpoint", "users"),)].count == 2
+    assert set(dict(labels)["endpoint"] for labels in metrics.counters["parquet_write_seconds_total"]) == {
+        "tracks", "users", "listen_history"
+    }
+
+def test_columnar_extraction_writes_arrow_tables(tmp_path):
+    """Test that columnar pages are requested and written without going through records"""
+    formats = set()
+
+    def handler(request):
+        formats.add(request.url.params.get("format"))
+        page = int(request.url.params["page"])
+        columns = {
+            "user_id": [page, page + 10],
+            "items": [[1, 2], [3]],
+            "created_at": ["2024-12-12T00:00:00.000000"] * 2,
+            "updated_at": ["2024-12-12T00:00:00.000000"] * 2,
+        }
+        return httpx.Response(200, json={"columns": columns, "total": 4, "page": page, "size": 2, "pages": 2})
+
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=2, columnar=True, transport=httpx.MockTransport(handler)
+    )
+    data_feed.endpoints = {"listen_history": "/listen_history"}
+    data_feed.output_dir = str(tmp_path)
+    data_feed.extract_all()
+
+    assert formats == {"columnar"}
+    df = pd.read_parquet(os.path.join(str(tmp_path), "listen_history.parquet"))
+    assert df["user_id"].tolist() == [1, 11, 2, 12]
+    assert [list(items) for items in df["items"]] == [[1, 2], [3], [1, 2], [3]]
+
+def test_fetch_page_dataframe_goes_through_the_table_path(data_feed):
+    """Test that a single columnar page is fetched once, with its metrics, as a table or a DataFrame"""
+    columns = {name: ["x", "y"] for name in RAW_SCHEMAS["tracks"].names}
+    columns["id"] = [1, 2]
+    page = json_response({"columns": columns})
+    with patch('requests.get', return_value=page) as mock_get:
+        df = data_feed.fetch_page_dataframe("tracks", page=2, size=2)
+
+    assert mock_get.call_args.kwargs["params"] == {"page": 2, "size": 2, "format": "columnar"}
+    assert df["id"].tolist() == [1, 2]
+    assert list(df.columns) == RAW_SCHEMAS["tracks"].names
+    assert data_feed.metrics.total("rows_extracted_total") == 2
+
+def test_validation_quarantines_failing_rows(tmp_path):
+    """Test that rows failing validation go to the quarantine file instead of the raw file"""
+    pages = {
+        "/tracks": [
+            {"id": 1, "name": "a", "artist": "x", "songwriters": "s", "duration": "3:00", "genres": "Pop",
+             "album": "b", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-02T00:00:00"},
+            {"id": 1, "name": "dup", "artist": "x", "songwriters": "s", "duration": "3:00", "genres": "Pop",
+             "album": "b", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-02T00:00:00"},
+        ],
+        "/listen_history": [
+            {"user_id": 7, "items": [1], "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"},
+            {"user_id": 8, "items": [1, 99], "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"},
+        ],
+    }
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        items = pages[request.url.path] if page == 1 else []
+        return httpx.Response(200, json={"items": items, "total": len(items), "page": page, "size": 100, "pages": 1})
+
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=2, validate=True, transport=httpx.MockTransport(handler)
+    )
+    data_feed.endpoints = {"tracks": "/tracks", "listen_history": "/listen_history"}
+    data_feed.output_dir = str(tmp_path)
+    data_feed.extract_all()
+
+    assert pd.read_parquet(os.path.join(str(tmp_path), "tracks.parquet"))["name"].tolist() == ["a"]
+    assert pd.read_parquet(os.path.join(str(tmp_path), "listen_history.parquet"))["user_id"].tolist() == [7]
+    quarantine = pd.read_parquet(os.path.join(str(tmp_path), "quarantine", "listen_history.parquet"))
+    assert [list(reasons) for reasons in quarantine["reasons"]] == [["reference:items"]]
+    assert data_feed.validation_reports["tracks"] == {
+        "rows": 2, "valid": 1, "rejected": 1, "reasons": {"duplicate:id": 1}
+    }
+    assert data_feed.metrics.total("rows_rejected_total") == 2
+
+def test_failed_pages_are_retried_on_their_own(tmp_path):
+    """Test that a throttled page is retried alone instead of restarting the endpoint"""
+    from src.moovitamix_fastapi.etl.retry import RetryPolicy
+
+    requested_pages = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        requested_pages.append(page)
+        if page == 2 and requested_pages.count(2) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        items = [{"id": page * 10 + i} for i in range(2)]
+        return httpx.Response(200, json={"items": items, "total": 6, "page": page, "size": 2, "pages": 3})
+
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=2, retry_policy=RetryPolicy(base_delay=0.0),
+        transport=httpx.MockTransport(handler)
+    )
+    data_feed.endpoints = {"users": "/users"}
+    data_feed.output_dir = str(tmp_path)
+    data_feed.extract_all()
+
+    assert sorted(requested_pages) == [1, 2, 2, 3]
+    assert pd.read_parquet(os.path.join(str(tmp_path), "users.parquet"))["id"].tolist() == [10, 11, 20, 21, 30, 31]
+    assert data_feed.metrics.counters["request_retries_total"][(("endpoint", "users"), ("reason", "429"))] == 1
+    assert data_feed.metrics.gauges["concurrency_limit"][(("endpoint", "users"),)] == 1
+
+def test_served_dataset_passes_validation(tmp_path, monkeypatch):
+    """Test that extracting the dataset served by the API quarantines no row"""
+    from src.moovitamix_fastapi import main
+    from src.moovitamix_fastapi.dataset import DatasetLoader, DatasetSettings
+    from src.moovitamix_fastapi.page_cache import PageCache
+
+    settings = DatasetSettings.from_env()
+    settings.data_dir = str(tmp_path / "dataset")
+    monkeypatch.setattr(main, "dataset_loader", DatasetLoader(settings))
+    monkeypatch.setattr(main, "page_cache", PageCache())
+    data_feed = MooVitamixDataFeed(
+        base_url="http://test-api", concurrency=2, validate=True, transport=httpx.ASGITransport(app=main.app)
+    )
+    data_feed.output_dir = str(tmp_path / "raw")
+    data_feed.extract_all()
+
+    assert set(data_feed.validation_reports) == set(data_feed.endpoints)
+    for name, report in data_feed.validation_reports.items():
+        assert report["rows"] > 0
+        assert report["rejected"] == 0, (name, report["reasons"])
+    assert not os.path.exists(os.path.join(data_feed.output_dir, "quarantine"))
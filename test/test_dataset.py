@@ -0,0 +1,40 @@
+import datetime
+
+import pyarrow as pa
+
+from src.moovitamix_fastapi.dataset import DEFAULT_REFERENCE_TIME, Dataset, DatasetSettings
+from src.moovitamix_fastapi.generate_fake_data import FakeDataGenerator
+
+
+def test_dataset_files_are_built_once_and_memory_mapped(tmp_path, mocker):
+    settings = DatasetSettings(300, 3, datetime.datetime(2024, 12, 12), data_dir=str(tmp_path))
+    generate = mocker.spy(FakeDataGenerator, "generate_bulk_data")
+
+    first = Dataset(settings)
+    allocated = pa.total_allocated_bytes()
+    second = Dataset(settings)
+
+    assert generate.call_count == 1
+    # The second worker maps the same files: no row buffer is allocated
+    assert pa.total_allocated_bytes() == allocated
+    assert second.tracks.rows[:50] == first.tracks.rows[:50]
+    assert second.listen_history.cursor_page(None, 20) == first.listen_history.cursor_page(None, 20)
+
+
+def test_indexes_are_read_from_the_shared_files(tmp_path):
+    settings = DatasetSettings(300, 3, datetime.datetime(2024, 12, 12), data_dir=str(tmp_path))
+    dataset = Dataset(settings)
+
+    ids = [row.id for row in dataset.users.cursor_page(None, 300).items]
+    assert ids == sorted(row.id for row in dataset.users.rows)
+
+    since = sorted(row.updated_at for row in dataset.users.rows)[250]
+    assert len(dataset.users.select(since)) == 50
+
+def test_settings_default_to_a_fixed_reference_time(monkeypatch):
+    monkeypatch.delenv("MOOVITAMIX_REFERENCE_TIME", raising=False)
+
+    assert DatasetSettings.from_env().reference_time == DEFAULT_REFERENCE_TIME
+
+    monkeypatch.setenv("MOOVITAMIX_REFERENCE_TIME", "2025-01-02T03:04:05")
+    assert DatasetSettings.from_env().reference_time == datetime.datetime(2025, 1, 2, 3, 4, 5)
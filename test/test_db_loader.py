@@ -0,0 +1,238 @@
+import os
+from datetime import date
+import duckdb
+import pytest
+import pandas as pd
+
+from src.moovitamix_fastapi.etl.db_loader import SCHEMA_VERSION, DuckDBLoader
+
+def write_raw_day(raw_dir, data_date, tracks, users, listen_history):
+    """Write one day of raw parquet files"""
+    day_dir = os.path.join(raw_dir, data_date)
+    os.makedirs(day_dir, exist_ok=True)
+    pd.DataFrame(tracks).to_parquet(os.path.join(day_dir, "tracks.parquet"), index=False)
+    pd.DataFrame(users).to_parquet(os.path.join(day_dir, "users.parquet"), index=False)
+    pd.DataFrame(listen_history).to_parquet(os.path.join(day_dir, "listen_history.parquet"), index=False)
+
+def track(track_id, name, updated_at):
+    return {"id": track_id, "name": name, "artist": "artist", "songwriters": "writer",
+            "duration": "03:30", "genres": "Rock", "album": "album",
+            "created_at": "2024-01-01T00:00:00", "updated_at": updated_at}
+
+def user(user_id, email, updated_at):
+    return {"id": user_id, "first_name": "first", "last_name": "last", "email": email,
+            "gender": "Agender", "favorite_genres": "Jazz",
+            "created_at": "2024-01-01T00:00:00", "updated_at": updated_at}
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    raw_dir = str(tmp_path / "raw")
+    write_raw_day(
+        raw_dir, "2024-12-12",
+        [track(1, "one", "2024-12-01T00:00:00"), track(2, "two", "2024-12-01T00:00:00")],
+        [user(10, "a@example.com", "2024-12-01T00:00:00")],
+        [{"user_id": 10, "items": [1, 2], "created_at": "2024-12-11T10:00:00", "updated_at": "2024-12-11T10:00:00"}],
+    )
+    write_raw_day(
+        raw_dir, "2024-12-13",
+        [track(1, "one", "2024-12-01T00:00:00"), track(2, "two (remastered)", "2024-12-13T00:00:00"),
+         track(3, "three", "2024-12-13T00:00:00")],
+        [user(10, "a@example.com", "2024-12-01T00:00:00")],
+        [{"user_id": 10, "items": [3], "created_at": "2024-12-12T10:00:00", "updated_at": "2024-12-12T10:00:00"}],
+    )
+    return raw_dir
+
+@pytest.fixture
+def loader(tmp_path, raw_dir):
+    loader = DuckDBLoader(db_path=str(tmp_path / "test.duckdb"), raw_dir=raw_dir, scd2=True)
+    yield loader
+    loader.close()
+
+def test_schema_creation_is_idempotent(tmp_path, loader, raw_dir):
+    """Test that reconnecting keeps the loaded data and the schema version"""
+    loader.load_daily_data("2024-12-12")
+    loader.close()
+
+    reopened = DuckDBLoader(db_path=loader.db_path, raw_dir=raw_dir)
+    assert reopened.conn.execute("SELECT max(version) FROM schema_version").fetchone()[0] == SCHEMA_VERSION
+    assert reopened.conn.execute("SELECT count(*) FROM dim_tracks").fetchone()[0] == 2
+    reopened.close()
+
+def test_reloading_same_day_is_idempotent(loader):
+    """Test that a second load of the same day neither fails nor duplicates rows"""
+    loader.load_daily_data("2024-12-12")
+    loaded = loader.load_daily_data("2024-12-12")
+
+    assert loaded["tracks"] == 0
+    assert loaded["users"] == 0
+    assert loader.conn.execute("SELECT count(*) FROM fact_listen_history").fetchone()[0] == 2
+    assert set(loader.last_timings) == {"tracks", "users", "listen_history", "aggregates"}
+
+def test_daily_load_upserts_changed_rows_and_keeps_history(loader):
+    """Test that only new or changed rows are merged and SCD2 versions are kept"""
+    loader.load_daily_data("2024-12-12")
+    loaded = loader.load_daily_data("2024-12-13")
+
+    assert loaded["tracks"] == 2
+    assert loader.conn.execute("SELECT name FROM dim_tracks WHERE track_id = 2").fetchone()[0] == "two (remastered)"
+
+    history = loader.conn.execute("""
+        SELECT name, valid_to IS NULL, is_current FROM dim_tracks_history
+        WHERE track_id = 2 ORDER BY valid_from
+    """).fetchall()
+    assert history == [("two", False, False), ("two (remastered)", True, True)]
+    assert loader.conn.execute("SELECT count(*) FROM fact_listen_history").fetchone()[0] == 3
+
+def test_backfill_matches_sequential_daily_loads(tmp_path, loader, raw_dir):
+    """Test that a one-pass backfill yields the same tables as loading each day in turn"""
+    loader.load_daily_data("2024-12-12")
+    loader.load_daily_data("2024-12-13")
+
+    backfilled = DuckDBLoader(db_path=str(tmp_path / "backfill.duckdb"), raw_dir=raw_dir, scd2=True)
+    loaded = backfilled.backfill("2024-12-01", "2024-12-31")
+    assert loaded["listen_history"] == 3
+
+    for query in [
+        "SELECT * EXCLUDE (etl_updated_at) FROM dim_tracks ORDER BY track_id",
+        "SELECT * FROM dim_tracks_history ORDER BY track_id, valid_from",
+        "SELECT * FROM fact_listen_history ORDER BY load_date, track_id",
+    ]:
+        assert backfilled.conn.execute(query).fetchall() == loader.conn.execute(query).fetchall()
+    backfilled.close()
+
+def test_listen_history_window_from_table_and_partitions(tmp_path, raw_dir):
+    """Test that date-window queries return the same rows from the table and the parquet layer"""
+    fact_dir = str(tmp_path / "fact_listen_history")
+    loader = DuckDBLoader(db_path=str(tmp_path / "window.duckdb"), raw_dir=raw_dir, fact_parquet_dir=fact_dir)
+    loader.backfill("2024-12-12", "2024-12-13")
+
+    assert sorted(os.listdir(fact_dir)) == ["load_date=2024-12-12", "load_date=2024-12-13"]
+    from_table = loader.query_listen_history("2024-12-13", "2024-12-13", ["user_id", "track_id", "load_date"])
+    from_parquet = loader.query_listen_history(
+        "2024-12-13", "2024-12-13", ["user_id", "track_id", "load_date"], source="parquet"
+    )
+    assert from_table.to_pylist() == from_parquet.to_pylist()
+    assert from_table.column("track_id").to_pylist() == [3]
+    loader.close()
+
+def test_aggregates_are_maintained_incrementally(loader):
+    """Test that incremental aggregates match a full recompute and re-runs have no effect"""
+    loader.load_daily_data("2024-12-12")
+    loader.load_daily_data("2024-12-13")
+    loader.load_daily_data("2024-12-13")
+    assert loader.materialize_aggregates() == []
+
+    expected = loader.conn.execute("""
+        SELECT user_id, track_id, count(*) FROM fact_listen_history GROUP BY ALL ORDER BY ALL
+    """).fetchall()
+    assert loader.conn.execute("SELECT * FROM agg_user_track_counts ORDER BY ALL").fetchall() == expected
+    assert loader.conn.execute("SELECT * FROM agg_track_play_counts ORDER BY ALL").fetchall() == [(1, 1), (2, 1), (3, 1)]
+    assert loader.conn.execute("SELECT * FROM agg_user_genre_counts").fetchall() == [(10, "Rock", 3)]
+    assert [row[0] for row in loader.conn.execute("SELECT load_date FROM agg_watermark ORDER BY 1").fetchall()] == [
+        date(2024, 12, 12), date(2024, 12, 13)
+    ]
+
+def test_load_run_is_recorded_in_pipeline_runs(loader, tmp_path):
+    """Test that a load run and its per-table metrics are written to pipeline_runs and a Prometheus file"""
+    with loader.metrics.run():
+        loader.load_daily_data("2024-12-12")
+        loader.verify_data()
+    loader.record_run(loader.metrics, "2024-12-12")
+    loader.record_run(loader.metrics, "2024-12-12")
+
+    runs = loader.conn.execute("SELECT stage, status, rows, metrics FROM pipeline_runs").fetchall()
+    assert len(runs) == 1
+    stage, status, rows, metrics = runs[0]
+    assert (stage, status) == ("load", "success")
+    assert rows == loader.metrics.total("rows_loaded_total")
+    assert '"table_rows"' in metrics
+
+    path = str(tmp_path / "load.prom")
+    loader.metrics.write_prometheus(path)
+    with open(path) as f:
+        assert 'moovitamix_load_seconds_total{stage="load",table="listen_history"}' in f.read()
+
+def test_each_load_publishes_a_readable_snapshot(tmp_path, raw_dir):
+    """Test that snapshots are readable while the loader holds its connection, and old ones are pruned"""
+    snapshot_dir = str(tmp_path / "snapshots")
+    loader = DuckDBLoader(db_path=str(tmp_path / "snap.duckdb"), raw_dir=raw_dir, snapshot_dir=snapshot_dir)
+    for data_date in ["2024-12-12", "2024-12-13", "2024-12-13"]:
+        loader.load_daily_data(data_date)
+
+    snapshots = sorted(entry for entry in os.listdir(snapshot_dir) if entry.endswith(".duckdb"))
+    with open(os.path.join(snapshot_dir, "CURRENT")) as f:
+        current = f.read()
+    assert len(snapshots) == 2 and current == snapshots[-1]
+    with duckdb.connect(os.path.join(snapshot_dir, current), read_only=True) as conn:
+        assert conn.execute("SELECT count(*) FROM dim_tracks").fetchone()[0] == 3
+    loader.close()
+
+def test_reload_after_genre_change_matches_full_recompute(tmp_path):
+    """Test that reloading a date whose track genres changed retracts the listens from the old genres"""
+    raw_dir = str(tmp_path / "raw")
+    listens = [{"user_id": 10, "items": [1, 2], "created_at": "2024-12-11T10:00:00", "updated_at": "2024-12-11T10:00:00"}]
+    users = [user(10, "a@example.com", "2024-12-01T00:00:00")]
+    write_raw_day(raw_dir, "2024-12-12", [track(1, "one", "2024-12-01T00:00:00"), track(2, "two", "2024-12-01T00:00:00")],
+                  users, listens)
+    loader = DuckDBLoader(db_path=str(tmp_path / "genres.duckdb"), raw_dir=raw_dir)
+    loader.load_daily_data("2024-12-12")
+
+    write_raw_day(raw_dir, "2024-12-12", [dict(track(1, "one", "2024-12-12T00:00:00"), genres="Jazz"),
+                                          track(2, "two", "2024-12-01T00:00:00")], users, listens)
+    loader.load_daily_data("2024-12-12")
+
+    recomputed = loader.conn.execute(
+        "SELECT user_id, genre, count(*) FROM fact_listen_history GROUP BY ALL ORDER BY ALL"
+    ).fetchall()
+    assert recomputed == [(10, "Jazz", 1), (10, "Rock", 1)]
+    assert loader.conn.execute("SELECT * FROM agg_user_genre_counts ORDER BY ALL").fetchall() == recomputed
+    loader.close()
+
+def test_reload_retracts_the_genres_counted_at_load_time(tmp_path):
+    """Test that a genre changed by a later date does not leak into the retraction of a reloaded date"""
+    raw_dir = str(tmp_path / "raw")
+    users = [user(10, "a@example.com", "2024-12-01T00:00:00")]
+    write_raw_day(raw_dir, "2024-12-12", [track(1, "one", "2024-12-01T00:00:00")], users,
+                  [{"user_id": 10, "items": [1], "created_at": "2024-12-11T10:00:00", "updated_at": "2024-12-11T10:00:00"}])
+    write_raw_day(raw_dir, "2024-12-13", [dict(track(1, "one", "2024-12-13T00:00:00"), genres="Jazz")], users,
+                  [{"user_id": 10, "items": [1], "created_at": "2024-12-12T10:00:00", "updated_at": "2024-12-12T10:00:00"}])
+    loader = DuckDBLoader(db_path=str(tmp_path / "genres.duckdb"), raw_dir=raw_dir)
+    for data_date in ("2024-12-12", "2024-12-13", "2024-12-12"):
+        loader.load_daily_data(data_date)
+
+    recomputed = loader.conn.execute(
+        "SELECT user_id, genre, count(*) FROM fact_listen_history GROUP BY ALL ORDER BY ALL"
+    ).fetchall()
+    # The reload counts its listens under the genre of its own tracks file, the other date keeps Jazz
+    assert recomputed == [(10, "Jazz", 1), (10, "Rock", 1)]
+    assert loader.conn.execute("SELECT * FROM agg_user_genre_counts ORDER BY ALL").fetchall() == recomputed
+    loader.close()
+
+def test_genre_migration_backfills_the_facts(tmp_path, raw_dir, monkeypatch):
+    """Test that upgrading a database stores a genre on the existing facts and recounts the genre aggregate"""
+    from src.moovitamix_fastapi.etl import db_loader
+
+    db_path = str(tmp_path / "upgrade.duckdb")
+    with monkeypatch.context() as patch:
+        patch.setattr(db_loader, "SCHEMA_MIGRATIONS", db_loader.SCHEMA_MIGRATIONS[:4])
+        DuckDBLoader(db_path=db_path, raw_dir=raw_dir).close()
+    with duckdb.connect(db_path) as conn:
+        conn.execute("INSERT INTO dim_tracks (track_id, genres) VALUES (1, 'Rock');")
+        conn.execute("""
+            INSERT INTO fact_listen_history VALUES
+                (10, 1, TIMESTAMP '2024-12-11 10:00:00', DATE '2024-12-12'),
+                (10, 2, TIMESTAMP '2024-12-11 10:00:00', DATE '2024-12-12');
+        """)
+        conn.execute("INSERT INTO agg_watermark VALUES (DATE '2024-12-12', 2, now());")
+        conn.execute("INSERT INTO agg_user_genre_counts VALUES (10, 'Rock', 1), (10, 'Unknown', 1);")
+
+    upgraded = DuckDBLoader(db_path=db_path, raw_dir=raw_dir)
+    assert upgraded.conn.execute("SELECT track_id, genre FROM fact_listen_history ORDER BY ALL").fetchall() == [
+        (1, "Rock"), (2, "Unknown")
+    ]
+    assert upgraded.conn.execute("SELECT * FROM agg_user_genre_counts ORDER BY ALL").fetchall() == [
+        (10, "Rock", 1), (10, "Unknown", 1)
+    ]
+    upgraded.load_daily_data("2024-12-12")
+    assert upgraded.conn.execute("SELECT * FROM agg_user_genre_counts").fetchall() == [(10, "Rock", 2)]
+    upgraded.close()
@@ -0,0 +1,32 @@
+from benchmarks.etl_benchmark import bytes_on_disk, compare_results
+
+
+def results(extract_rate, load_rate):
+    return {"runs": [{
+        "size": 1000,
+        "export_format": None,
+        "concurrency": 1,
+        "stages": {
+            "extract": {"rows_per_second": extract_rate},
+            "load": {"rows_per_second": load_rate},
+        },
+    }]}
+
+
+def test_compare_results_flags_throughput_drops():
+    """Test that only stages slower than the threshold are reported as regressions"""
+    comparisons = compare_results(results(1000, 1000), results(950, 500), threshold=0.1)
+
+    by_stage = {comparison["stage"]: comparison for comparison in comparisons}
+    assert not by_stage["extract"]["regression"]
+    assert by_stage["load"]["regression"]
+    assert by_stage["load"]["ratio"] == 0.5
+
+
+def test_bytes_on_disk_sums_directory(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(b"x" * 5)
+
+    assert bytes_on_disk(str(tmp_path)) == 15
+    assert bytes_on_disk(str(tmp_path / "a")) == 10
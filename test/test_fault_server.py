@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+
+from benchmarks.fault_server import FaultInjectionMiddleware, run_extraction, stand_in_app
+
+
+def test_fault_injection_fails_a_share_of_requests():
+    app = FaultInjectionMiddleware(stand_in_app(10), error_rate=0.5, statuses=[429], retry_after=1, seed=1)
+    client = TestClient(app)
+    responses = [client.get("/tracks") for _ in range(40)]
+
+    failed = [response for response in responses if response.status_code == 429]
+    assert 0 < len(failed) < 40
+    assert len(failed) == app.injected
+    assert all(response.headers["retry-after"] == "1" for response in failed)
+    assert client.get("/health").status_code == 200
+
+
+def test_extraction_completes_under_injected_faults():
+    result = run_extraction(2000, error_rate=0.2, concurrency=2, max_concurrency=8, latency=0.0)
+    assert result["complete"]
+    assert result["injected_faults"] > 0
+    assert result["retries"] == result["injected_faults"]
@@ -0,0 +1,33 @@
+from src.moovitamix_fastapi.classes_out import ListenHistoryOut, TracksOut, UsersOut
+from src.moovitamix_fastapi.generate_fake_data import FakeDataGenerator
+
+# Testing the bulk (columnar) mode
+def test_generate_bulk_data_shapes():
+    data = FakeDataGenerator(200, seed=42).generate_bulk_data()
+    assert data.tracks.num_rows == 200
+    assert data.users.num_rows == 200
+    assert data.listen_history.num_rows == 200
+
+    track_ids = set(data.tracks.column("id").to_pylist())
+    assert len(track_ids) == 200
+    assert len(set(data.users.column("id").to_pylist())) == 200
+    assert data.listen_history.column("user_id").to_pylist() == data.users.column("id").to_pylist()
+    for items in data.listen_history.column("items").to_pylist():
+        assert len(items) == 5
+        assert len(set(items)) == 5
+        assert set(items) <= track_ids
+
+def test_generate_bulk_data_is_seeded():
+    first = FakeDataGenerator(50, seed=7).generate_bulk_data()
+    second = FakeDataGenerator(50, seed=7).generate_bulk_data()
+    assert first.tracks.drop_columns(["created_at", "updated_at"]).equals(
+        second.tracks.drop_columns(["created_at", "updated_at"])
+    )
+    assert first.listen_history.column("items").equals(second.listen_history.column("items"))
+
+def test_bulk_data_to_models():
+    tracks, users, listen_history = FakeDataGenerator(10, seed=1).generate_bulk_data().to_models()
+    assert isinstance(tracks[0], TracksOut)
+    assert isinstance(users[0], UsersOut)
+    assert isinstance(listen_history[0], ListenHistoryOut)
+    assert listen_history[0].created_at <= listen_history[0].updated_at
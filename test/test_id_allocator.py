@@ -0,0 +1,20 @@
+import pytest
+
+from src.moovitamix_fastapi.id_allocator import IdAllocator
+
+def test_allocate_is_a_permutation_of_the_range():
+    allocator = IdAllocator(min_id=10, max_id=1009, seed=3)
+    ids = [allocator.allocate() for _ in range(1000)]
+    assert sorted(ids) == list(range(10, 1010))
+
+def test_allocate_many_matches_allocate():
+    scalar = IdAllocator(seed=11)
+    vector = IdAllocator(seed=11)
+    assert [scalar.allocate() for _ in range(500)] == vector.allocate_many(500).tolist()
+    assert vector.permute(0) == IdAllocator(seed=11).allocate()
+
+def test_allocate_raises_when_range_is_exhausted():
+    allocator = IdAllocator(min_id=1, max_id=3, seed=0)
+    allocator.allocate_many(3)
+    with pytest.raises(ValueError):
+        allocator.allocate()
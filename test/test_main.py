@@ -0,0 +1,102 @@
+import datetime
+
+import pyarrow as pa
+from fastapi.testclient import TestClient
+
+from src.moovitamix_fastapi.dataset import Dataset
+from src.moovitamix_fastapi.main import app, dataset_loader, page_cache
+
+client = TestClient(app)
+tracks = dataset_loader.get().tracks.rows
+
+def test_tracks_cursor_pagination_reads_every_row_once():
+    ids = []
+    cursor = None
+    while True:
+        params = {"size": 300}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/tracks/cursor", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        ids.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == sorted(track.id for track in tracks)
+
+def test_export_streams_arrow_batches():
+    response = client.get("/export/tracks", params={"format": "arrow", "batch_size": 250})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+
+    reader = pa.ipc.open_stream(response.content)
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [250, 250, 250, 250]
+    assert pa.Table.from_batches(batches).column("id").to_pylist() == [track.id for track in tracks]
+
+def test_tracks_updated_since_filters_with_time_index():
+    since = sorted(track.updated_at for track in tracks)[900]
+    response = client.get("/tracks", params={"updated_since": since.isoformat(), "size": 100})
+    page = response.json()
+    assert page["total"] == 100
+    assert [item["id"] for item in page["items"]] == [
+        track.id for track in sorted(tracks, key=lambda track: track.updated_at)[900:]
+    ]
+
+def test_pages_are_cached_and_honour_if_none_match():
+    first = client.get("/users", params={"page": 3, "size": 50})
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert len(first.json()["items"]) == 50
+
+    second = client.get("/users", params={"page": 3, "size": 50}, headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+    assert ("users", "json", 3, 50, None, None) in page_cache._entries
+
+def test_columnar_page_matches_json_page():
+    params = {"page": 2, "size": 100}
+    rows = client.get("/listen_history", params=params).json()
+    columnar = client.get("/listen_history", params={**params, "format": "columnar"})
+    assert columnar.status_code == 200
+    page = columnar.json()
+
+    assert {key: page[key] for key in ("total", "page", "size", "pages")} == {
+        key: rows[key] for key in ("total", "page", "size", "pages")
+    }
+    assert page["columns"]["user_id"] == [row["user_id"] for row in rows["items"]]
+    assert page["columns"]["items"] == [row["items"] for row in rows["items"]]
+    assert [datetime.datetime.fromisoformat(value) for value in page["columns"]["updated_at"]] == [
+        datetime.datetime.fromisoformat(row["updated_at"]) for row in rows["items"]
+    ]
+    assert len(columnar.content) < len(client.get("/listen_history", params=params).content)
+
+def test_columnar_page_applies_updated_filters():
+    since = sorted(track.updated_at for track in tracks)[990]
+    page = client.get("/tracks", params={"format": "columnar", "updated_since": since.isoformat()}).json()
+    assert page["total"] == 10
+    assert sorted(page["columns"]["id"]) == sorted(track.id for track in tracks if track.updated_at >= since)
+
+def test_dataset_is_deterministic_for_a_seed():
+    other = Dataset(dataset_loader.settings)
+    assert [track.id for track in other.tracks.rows] == [track.id for track in tracks]
+    assert other.listen_history.rows[0] == dataset_loader.get().listen_history.rows[0]
+
+def test_health_reports_dataset_status():
+    assert client.get("/health").json() == {"status": "healthy", "dataset": "ready"}
+
+def test_recommendations_route():
+    listen_history = dataset_loader.get().listen_history.rows
+    user_id = listen_history[0].user_id
+    heard = {track_id for row in listen_history if row.user_id == user_id for track_id in row.items}
+
+    response = client.get(f"/recommendations/{user_id}", params={"limit": 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user_id"] == user_id
+    assert len(body["items"]) <= 5
+    assert not heard & {item["track_id"] for item in body["items"]}
+
+    assert client.get("/recommendations/-1").status_code == 404
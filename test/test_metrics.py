@@ -0,0 +1,54 @@
+from src.moovitamix_fastapi.etl.metrics import Histogram, PipelineMetrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value)
+
+    assert list(histogram.cumulative_counts()) == [("0.1", 1), ("1", 3), ("+Inf", 4)]
+    assert histogram.sum == 4.25
+
+
+def test_prometheus_text_format():
+    metrics = PipelineMetrics("load", run_id="run-1")
+    with metrics.run():
+        metrics.inc("rows_loaded_total", 3, table="dim_tracks")
+        metrics.set("table_rows", 10, table='quo"ted')
+        metrics.observe("request_seconds", 0.2, endpoint="tracks")
+
+    text = metrics.to_prometheus()
+    assert "# TYPE moovitamix_rows_loaded_total counter" in text
+    assert 'moovitamix_rows_loaded_total{stage="load",table="dim_tracks"} 3' in text
+    assert 'moovitamix_table_rows{stage="load",table="quo\\"ted"} 10' in text
+    assert 'moovitamix_request_seconds_bucket{stage="load",endpoint="tracks",le="+Inf"} 1' in text
+    assert 'moovitamix_run_success{stage="load"} 1' in text
+
+
+def test_json_round_trip(tmp_path):
+    metrics = PipelineMetrics("extract")
+    with metrics.run():
+        metrics.inc("pages_fetched_total", endpoint="users")
+        metrics.observe("request_seconds", 0.01, endpoint="users")
+
+    path = str(tmp_path / "extract.json")
+    metrics.save_json(path)
+    loaded = PipelineMetrics.load_json(path)
+
+    assert loaded.to_dict() == metrics.to_dict()
+    assert loaded.to_prometheus() == metrics.to_prometheus()
+
+
+def test_merge_sums_the_shards_of_a_run():
+    merged = PipelineMetrics("extract", run_id="run-1")
+    for pages in (2, 3):
+        shard = PipelineMetrics("extract", run_id="run-1")
+        with shard.run():
+            shard.inc("pages_fetched_total", pages, endpoint="tracks")
+            shard.observe("request_seconds", 0.2, endpoint="tracks")
+        merged.merge(shard)
+
+    assert merged.total("pages_fetched_total") == 5
+    histogram = merged.histograms["request_seconds"][(("endpoint", "tracks"),)]
+    assert (histogram.count, histogram.sum) == (2, 0.4)
+    assert merged.started_at < merged.finished_at
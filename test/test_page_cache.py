@@ -0,0 +1,19 @@
+from src.moovitamix_fastapi.page_cache import PageCache, etag_matches
+
+def test_page_cache_evicts_least_recently_used_within_budget():
+    cache = PageCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"5678")
+    assert cache.get("a") is not None
+    cache.put("c", b"90ab")
+
+    assert cache.get("b") is None
+    assert cache.get("a").body == b"1234"
+    assert cache.current_bytes == 8
+
+def test_etag_matches_lists_and_weak_validators():
+    etag = PageCache().put("a", b"body").etag
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
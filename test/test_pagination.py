@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from src.moovitamix_fastapi.pagination import KeysetIndex, TimeIndex
+
+def test_seek_walks_keys_in_order():
+    index = KeysetIndex([30, 10, 50, 20, 40])
+    positions, cursor = index.seek(None, 2)
+    assert positions.tolist() == [1, 3]
+    assert cursor == 20
+
+    positions, cursor = index.seek(cursor, 2)
+    assert positions.tolist() == [0, 4]
+    assert cursor == 40
+
+    positions, cursor = index.seek(cursor, 2)
+    assert positions.tolist() == [2]
+    assert cursor is None
+
+def test_page_returns_rows_after_cursor():
+    rows = ["c", "a", "b"]
+    page = KeysetIndex([3, 1, 2]).page(rows, 1, 10)
+    assert page.items == ["b", "c"]
+    assert page.next_cursor is None
+
+def test_time_index_window_uses_half_open_bounds():
+    timestamps = [datetime(2024, 1, day) for day in (3, 1, 4, 2)]
+    index = TimeIndex(timestamps)
+    assert index.window().tolist() == [1, 3, 0, 2]
+    assert index.window(datetime(2024, 1, 2), datetime(2024, 1, 4)).tolist() == [3, 0]
+    assert index.window(datetime(2024, 1, 5)).tolist() == []
@@ -0,0 +1,89 @@
+import duckdb
+import numpy as np
+
+from src.moovitamix_fastapi.recommendations import (
+    ItemSimilarityIndex,
+    RecommendationService,
+    snapshot_pairs,
+    snapshot_version,
+)
+
+
+def build_index(**kwargs):
+    # Users 1 and 2 share tracks 10 and 20; user 2 also listened to track 30.
+    user_ids = np.array([1, 1, 2, 2, 2, 3])
+    track_ids = np.array([10, 20, 10, 20, 30, 40])
+    return ItemSimilarityIndex(user_ids, track_ids, **kwargs)
+
+
+def test_neighbours_are_cosine_similarities_without_self():
+    index = build_index()
+    neighbours = index.neighbours.toarray()
+
+    assert np.allclose(np.diag(neighbours), 0)
+    # Tracks 10 and 20 are heard by the same two users
+    assert np.isclose(neighbours[0, 1], 1.0)
+    # Track 30 is heard by one of the two users of track 10
+    assert np.isclose(neighbours[0, 2], 1 / np.sqrt(2))
+    assert neighbours[0, 3] == 0
+
+
+def test_top_k_bounds_neighbours_per_track():
+    index = build_index(top_k=1)
+    assert np.diff(index.neighbours.indptr).max() == 1
+    # The best neighbour of track 10 is kept
+    assert index.neighbours[0, 1] > 0
+
+
+def test_recommend_excludes_heard_tracks_and_caches():
+    index = build_index()
+
+    [(track_id, score)] = index.recommend(1, 10)
+    assert track_id == 30
+    assert np.isclose(score, 2 / np.sqrt(2))
+    assert index.recommend(3, 10) == ()
+    assert index.recommend(99, 10) is None
+
+    index.recommend(1, 10)
+    assert index.recommend.cache_info().hits == 1
+
+
+def publish(snapshot_dir, name, rows):
+    """Write a snapshot holding the given agg_user_track_counts rows and mark it as current"""
+    with duckdb.connect(str(snapshot_dir / name)) as conn:
+        conn.execute("CREATE TABLE agg_user_track_counts (user_id INTEGER, track_id INTEGER, listen_count BIGINT)")
+        conn.executemany("INSERT INTO agg_user_track_counts VALUES (?, ?, ?)", rows)
+    (snapshot_dir / "CURRENT").write_text(name)
+
+
+def test_service_rebuilds_from_duckdb_snapshots_when_a_load_is_published(tmp_path):
+    snapshot_dir = tmp_path / "snapshots"
+    snapshot_dir.mkdir()
+    assert snapshot_version(str(snapshot_dir)) is None
+    publish(snapshot_dir, "moovitamix-1.duckdb", [(1, 10, 3), (2, 10, 1), (2, 20, 1)])
+
+    service = RecommendationService(
+        lambda: snapshot_pairs(str(snapshot_dir)),
+        version=lambda: snapshot_version(str(snapshot_dir)),
+        refresh_interval=0.01,
+    )
+    service.rebuild()
+    assert service.index.recommend(1, 5)[0][0] == 20
+    first = service.index
+
+    publish(snapshot_dir, "moovitamix-2.duckdb", [(1, 10, 3), (2, 10, 1), (2, 20, 1), (3, 30, 1)])
+    assert snapshot_version(str(snapshot_dir)) != service.index_version
+    service.rebuild()
+    assert service.index is not first
+    assert service.index.recommend(3, 5) == ()
+
+
+def test_blocked_similarity_matches_a_single_block():
+    rng = np.random.default_rng(0)
+    user_ids = rng.integers(0, 50, 2000)
+    track_ids = rng.integers(0, 300, 2000)
+    index = ItemSimilarityIndex(user_ids, track_ids, top_k=5)
+    blocked = ItemSimilarityIndex._top_k_neighbours(index.listens, 5, block_size=7)
+    single = ItemSimilarityIndex._top_k_neighbours(index.listens, 5, block_size=len(index.track_keys))
+    assert (blocked != single).nnz == 0
+    assert np.all(np.diff(blocked.indptr) <= 5)
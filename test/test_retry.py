@@ -0,0 +1,104 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from src.moovitamix_fastapi.etl.retry import (
+    AdaptiveConcurrencyLimiter,
+    RetryPolicy,
+    get_with_retries,
+    parse_retry_after,
+)
+
+
+def test_parse_retry_after_accepts_seconds_and_dates():
+    now = datetime(2024, 12, 12, 0, 0, 0, tzinfo=timezone.utc)
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Thu, 12 Dec 2024 00:00:10 GMT", now=now) == 10.0
+    assert parse_retry_after("Wed, 11 Dec 2024 00:00:00 GMT", now=now) == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, rng=random.Random(0))
+    delays = [policy.delay(attempt) for attempt in range(1, 8) for _ in range(20)]
+    assert all(0 <= delay <= 5.0 for delay in delays)
+    assert len(set(delays)) == len(delays)
+    assert policy.delay(1, retry_after=60) == 5.0
+    assert policy.delay(1, retry_after=2) == 2
+
+
+def response(status, headers=None):
+    mock = Mock(status_code=status, headers=headers or {})
+    if status >= 400:
+        mock.raise_for_status.side_effect = requests.exceptions.HTTPError(str(status))
+    return mock
+
+
+def test_get_with_retries_honours_retry_after():
+    get = Mock(side_effect=[
+        response(503, {"Retry-After": "2"}),
+        requests.exceptions.ConnectionError("reset"),
+        response(200),
+    ])
+    retries = []
+    with patch("time.sleep") as sleep:
+        result = get_with_retries(get, "http://api/tracks", RetryPolicy(base_delay=0.0),
+                                  on_retry=lambda *retry: retries.append(retry), params={"page": 1})
+
+    assert result.status_code == 200
+    assert [(attempt, reason) for attempt, reason, _ in retries] == [(1, "503"), (2, "ConnectionError")]
+    assert sleep.call_args_list[0].args == (2.0,)
+    assert get.call_args.kwargs == {"params": {"page": 1}}
+
+
+def test_get_with_retries_gives_up_and_does_not_retry_client_errors():
+    with patch("time.sleep"):
+        with pytest.raises(requests.exceptions.HTTPError):
+            get_with_retries(Mock(return_value=response(500)), "http://api", RetryPolicy(max_attempts=3))
+
+    get = Mock(return_value=response(404))
+    with pytest.raises(requests.exceptions.HTTPError):
+        get_with_retries(get, "http://api", RetryPolicy())
+    assert get.call_count == 1
+
+
+def test_limiter_increases_additively_and_decreases_once_per_window():
+    limiter = AdaptiveConcurrencyLimiter(4, max_limit=8, latency_threshold=0.5)
+    for _ in range(4):
+        limiter.on_success(0.1)
+    assert limiter.current_limit == 4
+    limiter.on_success(0.1)
+    assert limiter.current_limit == 5
+    limiter.on_success(2.0)
+    assert limiter.current_limit == 5
+
+    sent_at = 0.0
+    limiter.on_overload(sent_at)
+    assert limiter.current_limit == 3
+    # Another failure of a request sent before the decrease does not lower it again
+    limiter.on_overload(sent_at)
+    assert limiter.current_limit == 3
+
+
+def test_limiter_bounds_requests_in_flight():
+    limiter = AdaptiveConcurrencyLimiter(2)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.release()
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(10)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
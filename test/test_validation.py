@@ -0,0 +1,81 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.moovitamix_fastapi.etl.validation import BatchValidator, QuarantineWriter, non_nullable_fields
+from src.moovitamix_fastapi.classes_out import ListenHistoryOut
+
+
+def user(id, **fields):
+    row = {"id": id, "first_name": "a", "last_name": "b", "email": "a@b.c", "gender": "Agender",
+           "favorite_genres": "Pop", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-02T00:00:00"}
+    row.update(fields)
+    return row
+
+
+def test_non_nullable_fields_follow_the_model():
+    assert non_nullable_fields(ListenHistoryOut) == ["created_at", "updated_at"]
+
+
+def test_validator_flags_each_check():
+    validator = BatchValidator("users")
+    valid, quarantine = validator.validate([
+        user(1),
+        user(2, first_name=None),
+        user("three"),
+        user(4, updated_at="2023-12-31T00:00:00"),
+        user(5, created_at="yesterday"),
+        user(1),
+    ])
+
+    assert valid.column("id").to_pylist() == [1]
+    assert [row["reasons"] for row in quarantine] == [
+        ["null:first_name"],
+        ["type:id", "null:id"],
+        ["order:updated_at"],
+        ["format:created_at"],
+        ["duplicate:id"],
+    ]
+    assert validator.report.to_dict()["rejected"] == 5
+
+
+def test_duplicates_are_detected_across_batches_and_tables():
+    validator = BatchValidator("users")
+    validator.validate([user(1), user(2)])
+    table = pa.Table.from_pylist([user(2), user(3)])
+    valid, quarantine = validator.validate(table)
+
+    assert valid.column("id").to_pylist() == [3]
+    assert quarantine[0]["reasons"] == ["duplicate:id"]
+    assert validator.valid_keys().to_pylist() == [1, 2, 3]
+
+
+def test_timestamp_offsets_are_compared_in_utc():
+    validator = BatchValidator("users")
+    valid, _ = validator.validate([
+        user(1, created_at="2024-01-01T10:00:00+02:00", updated_at="2024-01-01T09:00:00Z"),
+        user(2, created_at="2024-01-01T10:00:00Z", updated_at="2024-01-01T09:00:00Z"),
+        user(3, created_at="2024-02-30T10:00:00"),
+    ])
+    assert valid.column("id").to_pylist() == [1]
+    assert validator.report.reasons["format:created_at"] == 1
+
+
+def test_quarantine_writer_only_creates_the_file_on_rejects(tmp_path):
+    path = str(tmp_path / "quarantine" / "listen_history.parquet")
+    writer = QuarantineWriter(BatchValidator("listen_history", track_ids=pa.array([1, 2])), path)
+    writer.validate([{"user_id": 1, "items": [1, 2], "created_at": "2024-01-01T00:00:00",
+                      "updated_at": "2024-01-01T00:00:00"}])
+    assert not (tmp_path / "quarantine").exists()
+
+    writer.validate([{"user_id": 2, "items": [3], "created_at": "2024-01-01T00:00:00",
+                      "updated_at": "2024-01-01T00:00:00"}])
+    report = writer.close()
+    assert report.to_dict() == {"rows": 2, "valid": 1, "rejected": 1, "reasons": {"reference:items": 1}}
+    assert pq.read_table(path).column("reasons").to_pylist() == [["reference:items"]]
+
+    # A clean re-run of the same date leaves no stale quarantine file behind
+    rerun = QuarantineWriter(BatchValidator("listen_history", track_ids=pa.array([1, 2])), path)
+    rerun.validate([{"user_id": 1, "items": [1], "created_at": "2024-01-01T00:00:00",
+                     "updated_at": "2024-01-01T00:00:00"}])
+    rerun.close()
+    assert not (tmp_path / "quarantine" / "listen_history.parquet").exists()